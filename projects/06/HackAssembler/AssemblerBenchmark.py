@@ -0,0 +1,83 @@
+import os
+import time
+import argparse
+import tempfile
+from HackAssembler import HackAssembler
+
+"""
+Times the serial second pass against parse_parallel on programs of increasing size
+to find the size from which the process pool pays off
+"""
+def make_program(source_lines, instructions, file_path):
+    """
+    writes a program of roughly the given number of instructions by repeating the source
+    with its labels renamed on every copy so each copy stays a valid program
+    """
+    labels = {line[1:-1] for line in source_lines if line.startswith('(')}
+    written = copy = 0
+    with open(file_path, 'w') as file:
+        while written < instructions:
+            for line in source_lines:
+                if line.startswith('('):
+                    file.write("({}_{})\n".format(line[1:-1], copy))
+                    continue
+                if line.startswith('@') and line[1:] in labels:
+                    line = "@{}_{}".format(line[1:], copy)
+                file.write(line + "\n")
+                written += 1
+                if written == instructions:
+                    break
+            copy += 1
+
+def time_pass(file_path, jobs, repeat):
+    """
+    returns the best time over repeat runs of the second pass, parse when jobs is None and
+    parse_parallel in jobs processes otherwise, even on a single cpu
+    """
+    best = None
+    for _ in range(repeat):
+        assembler = HackAssembler(file_path)
+        assembler.symbol_check()
+        start = time.perf_counter()
+        if jobs is None:
+            assembler.parse()
+        else:
+            assembler.parse_parallel(jobs)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    default_source = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pong", "Pong.asm")
+    arg_parser = argparse.ArgumentParser(description="Find the crossover size of the parallel assembler")
+    arg_parser.add_argument("--source", default=default_source, help=".asm file repeated to build the test programs")
+    arg_parser.add_argument("--jobs", type=int, default=max(2, os.cpu_count() or 1),
+                            help="worker processes for the parallel pass, at least 2")
+    arg_parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 4000, 16000, 32000, 65000],
+                            help="program sizes in instructions, at most 65535 so every label fits in 16 bits")
+    arg_parser.add_argument("--repeat", type=int, default=3, help="runs per measurement, the best is reported")
+    args = arg_parser.parse_args()
+    if args.jobs < 2:
+        arg_parser.error("--jobs must be at least 2, with 1 both columns would time the serial pass")
+
+    with open(args.source, 'r') as file:
+        source_lines = [line.strip() for line in file if line.strip() and not line.strip().startswith('/')]
+    print("jobs={} cpus={}".format(args.jobs, os.cpu_count()))
+    print("{:>12} {:>12} {:>12} {:>8}".format("instructions", "serial (s)", "parallel (s)", "speedup"))
+    crossover = None
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            file_path = os.path.join(directory, "Bench{}.asm".format(size))
+            make_program(source_lines, size, file_path)
+            serial = time_pass(file_path, None, args.repeat)
+            parallel = time_pass(file_path, args.jobs, args.repeat)
+            if crossover is None and parallel < serial:
+                crossover = size
+            print("{:>12} {:>12.4f} {:>12.4f} {:>7.2f}x".format(size, serial, parallel, serial / parallel))
+    if crossover is None:
+        print("the parallel pass did not beat the serial pass at any measured size")
+    else:
+        print("the parallel pass is faster from about {} instructions".format(crossover))
+
+if __name__ == '__main__':
+    main()
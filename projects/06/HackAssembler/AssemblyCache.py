@@ -0,0 +1,108 @@
+import os
+import sys
+import json
+import hashlib
+from array import array
+
+"""
+On disk cache of assembled programs keyed by the content of the .asm source
+"""
+class AssemblyCache:
+    def __init__(self, directory=None, max_bytes=64*1024*1024):
+        """
+        sets up the cache directory
+        @param directory(str): where entries are stored, defaults to $HACK_ASSEMBLER_CACHE or ~/.cache/hack-assembler
+        @param max_bytes(int): total size of the entries kept before the least recently used are evicted
+        """
+        if directory is None:
+            directory = os.environ.get("HACK_ASSEMBLER_CACHE",
+                                       os.path.join(os.path.expanduser("~"), ".cache", "hack-assembler"))
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, file_path, version):
+        """
+        returns the cache key for a source file, a hash of its bytes and the assembler version
+        @param file_path(str): path to the .asm file
+        @param version(str): assembler version, so entries from older assemblers are never reused
+        """
+        digest = hashlib.sha256(version.encode() + b"\0")
+        with open(file_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 16), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def load(self, key):
+        """
+        returns (words, symbol_table) stored under key or None on a miss
+        a hit marks the entry as most recently used
+        """
+        words_path = os.path.join(self.directory, key + ".bin")
+        symbols_path = os.path.join(self.directory, key + ".json")
+        try:
+            with open(words_path, 'rb') as file:
+                words = array('H', file.read())
+            with open(symbols_path, 'r') as file:
+                symbol_table = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if sys.byteorder == 'little':
+            words.byteswap()
+        os.utime(words_path)
+        os.utime(symbols_path)
+        return words, symbol_table
+
+    def store(self, key, words, symbol_table):
+        """
+        stores the machine words and symbol table of an assembled program under key
+        then evicts least recently used entries until the cache fits in max_bytes
+        """
+        words = array('H', words)
+        if sys.byteorder == 'little':
+            words.byteswap()
+        # write to temporary names first so a concurrent reader never sees half an entry
+        for suffix, data in ((".json", json.dumps(symbol_table).encode()), (".bin", words.tobytes())):
+            path = os.path.join(self.directory, key + suffix)
+            with open(path + ".tmp", 'wb') as file:
+                file.write(data)
+            os.replace(path + ".tmp", path)
+        self.evict()
+
+    def evict(self):
+        """
+        removes least recently used entries until the total size is within max_bytes
+        """
+        entries = {}
+        for name in os.listdir(self.directory):
+            key, ext = os.path.splitext(name)
+            if ext not in (".bin", ".json"):
+                continue
+            stat = os.stat(os.path.join(self.directory, name))
+            used, size = entries.get(key, (0, 0))
+            entries[key] = (max(used, stat.st_mtime), size + stat.st_size)
+        total = sum(size for _, size in entries.values())
+        for key in sorted(entries, key=lambda key: entries[key][0]):
+            if total <= self.max_bytes:
+                break
+            self.remove(key)
+            total -= entries[key][1]
+
+    def remove(self, key):
+        """
+        deletes the files of one entry
+        """
+        for suffix in (".bin", ".json"):
+            try:
+                os.remove(os.path.join(self.directory, key + suffix))
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        """
+        deletes every entry in the cache
+        """
+        for name in os.listdir(self.directory):
+            key, ext = os.path.splitext(name)
+            if ext in (".bin", ".json"):
+                self.remove(key)
@@ -0,0 +1,717 @@
+import re
+import argparse
+from array import array
+from HackAssembler import HackAssembler
+
+"""
+Hack CPU emulator that runs machine code straight from the assembler or from a .hack file
+"""
+
+# comp bits (a-bit first) -> computation on the A, D and M values, results are 16-bit unsigned
+COMP = {
+    0b0101010: lambda a, d, m: 0,
+    0b0111111: lambda a, d, m: 1,
+    0b0111010: lambda a, d, m: 0xFFFF,
+    0b0001100: lambda a, d, m: d,
+    0b0110000: lambda a, d, m: a,
+    0b1110000: lambda a, d, m: m,
+    0b0001101: lambda a, d, m: d ^ 0xFFFF,
+    0b0110001: lambda a, d, m: a ^ 0xFFFF,
+    0b1110001: lambda a, d, m: m ^ 0xFFFF,
+    0b0001111: lambda a, d, m: -d & 0xFFFF,
+    0b0110011: lambda a, d, m: -a & 0xFFFF,
+    0b1110011: lambda a, d, m: -m & 0xFFFF,
+    0b0011111: lambda a, d, m: (d + 1) & 0xFFFF,
+    0b0110111: lambda a, d, m: (a + 1) & 0xFFFF,
+    0b1110111: lambda a, d, m: (m + 1) & 0xFFFF,
+    0b0001110: lambda a, d, m: (d - 1) & 0xFFFF,
+    0b0110010: lambda a, d, m: (a - 1) & 0xFFFF,
+    0b1110010: lambda a, d, m: (m - 1) & 0xFFFF,
+    0b0000010: lambda a, d, m: (d + a) & 0xFFFF,
+    0b1000010: lambda a, d, m: (d + m) & 0xFFFF,
+    0b0010011: lambda a, d, m: (d - a) & 0xFFFF,
+    0b1010011: lambda a, d, m: (d - m) & 0xFFFF,
+    0b0000111: lambda a, d, m: (a - d) & 0xFFFF,
+    0b1000111: lambda a, d, m: (m - d) & 0xFFFF,
+    0b0000000: lambda a, d, m: d & a,
+    0b1000000: lambda a, d, m: d & m,
+    0b0010101: lambda a, d, m: d | a,
+    0b1010101: lambda a, d, m: d | m,
+}
+
+# the same computations as Python source for the block compiler, {a} {d} {m} are the operands
+COMP_SOURCE = {
+    0b0101010: "0",
+    0b0111111: "1",
+    0b0111010: "65535",
+    0b0001100: "{d}",
+    0b0110000: "{a}",
+    0b1110000: "{m}",
+    0b0001101: "{d} ^ 65535",
+    0b0110001: "{a} ^ 65535",
+    0b1110001: "{m} ^ 65535",
+    0b0001111: "-{d} & 65535",
+    0b0110011: "-{a} & 65535",
+    0b1110011: "-{m} & 65535",
+    0b0011111: "({d} + 1) & 65535",
+    0b0110111: "({a} + 1) & 65535",
+    0b1110111: "({m} + 1) & 65535",
+    0b0001110: "({d} - 1) & 65535",
+    0b0110010: "({a} - 1) & 65535",
+    0b1110010: "({m} - 1) & 65535",
+    0b0000010: "({d} + {a}) & 65535",
+    0b1000010: "({d} + {m}) & 65535",
+    0b0010011: "({d} - {a}) & 65535",
+    0b1010011: "({d} - {m}) & 65535",
+    0b0000111: "({a} - {d}) & 65535",
+    0b1000111: "({m} - {d}) & 65535",
+    0b0000000: "{d} & {a}",
+    0b1000000: "{d} & {m}",
+    0b0010101: "{d} | {a}",
+    0b1010101: "{d} | {m}",
+}
+
+# jump bits -> condition on the computed value v, 16-bit values of 32768 and up are negative
+JUMP_SOURCE = {
+    0b001: "0 < v < 32768",
+    0b010: "v == 0",
+    0b011: "v < 32768",
+    0b100: "v > 32767",
+    0b101: "v != 0",
+    0b110: "v == 0 or v > 32767",
+}
+
+# the computations the block compiler folds on ("sp", offset) values: x, x + 1, x - 1, x + y and x - y
+# comp -> (operands used, x alone or None, x, sign, y or None for 1) as matched in COMP_SOURCE
+FOLD_PATTERN = re.compile(r"^(?:\{(\w)\}|\(\{(\w)\} ([+-]) (?:\{(\w)\}|(1))\) & 65535)$")
+FOLDS = {}
+for comp, template in COMP_SOURCE.items():
+    match = FOLD_PATTERN.match(template)
+    FOLDS[comp] = (tuple(name for name in "adm" if "{" + name + "}" in template), match and match.groups()[:4])
+MAX_OFFSET = 256 # larger offsets from the stack pointer are computed at run time
+UNLIMITED = float("inf") # instruction limit of a block run without a cycle budget
+HOT_ENTRIES = 16 # jumps to an address before the code there is compiled, colder code is interpreted
+HOT_TARGET = 2 # jumps to an address before compiled code treats it as the start of a path
+MAX_PATH = 256 # instructions in a path, and in one that has not run straight before
+MAX_SIDE = 8 # instructions a conditional jump skips that the path takes in as an if
+MAX_NESTING = 40 # else blocks in the source of a path, Python limits the indentation to 100 levels
+
+RAM_SIZE = 32768 # 16K data memory, 8K screen map and the keyboard register
+STACK = 256 # the VM stack, compiled code runs only while every sp + offset it uses is in it
+HEAP = 2048
+SCREEN = 16384
+KBD = 24576
+
+class CPUEmulator:
+    def __init__(self, program=None, blocks=False):
+        """
+        sets up empty RAM and ROM, loading a program if one is given
+        @param program: machine words (list or array('H')) or a path to a .hack or .asm file
+        @param blocks(bool): execute basic blocks compiled to Python functions instead of
+                             interpreting one instruction at a time
+        """
+        self.ram = [0] * RAM_SIZE
+        self.rom = array('H')
+        self.program = []
+        self.use_blocks = blocks
+        self.blocks = {}
+        self.entries = {}
+        self.extents = {}
+        self.halt_addresses = set()
+        self.halted = False
+        self.cycles = 0
+        self.reset()
+        if program is not None:
+            self.load(program)
+
+    def load(self, program):
+        """
+        loads a program into ROM, decoding every instruction once up front
+        A commands become (None, value) and C commands (comp function, uses M, dest, jump)
+        so the fetch loop never looks at bits or strings
+        @param program: machine words (list or array('H')) or a path to a .hack or .asm file
+        """
+        if isinstance(program, str):
+            program = read_program(program)
+        self.rom = array('H', program)
+        self.program = []
+        for word in self.rom:
+            if word & 0x8000:
+                comp = (word >> 6) & 0x7F
+                self.program.append((COMP[comp], comp & 0x40, (word >> 3) & 7, word & 7))
+            else:
+                self.program.append((None, word))
+        # an unconditional jump to the A command right before it is the usual end of program loop
+        self.halt_addresses = set()
+        for pc in range(1, len(self.program)):
+            instruction = self.program[pc]
+            previous = self.program[pc-1]
+            if instruction[0] is not None and instruction[3] == 0b111 and previous[0] is None and previous[1] == pc - 1:
+                self.halt_addresses.add(pc)
+        # compiled blocks belong to the old ROM
+        self.blocks = {}
+        self.entries = {}
+        self.extents = {}
+        self.reset()
+
+    def reset(self):
+        """
+        resets the CPU registers and program counter, RAM keeps its contents like the real reset
+        """
+        self.a = self.d = self.pc = 0
+        self.halted = False
+
+    def step(self):
+        """
+        executes a single instruction
+        """
+        return self.run(1)
+
+    def run(self, cycles=None):
+        """
+        executes instructions until the cycle budget is spent or the program halts
+        the program halts in an end of program loop or when the PC runs past the end of ROM
+        @param cycles(int): maximum number of instructions to execute, None to run until halted
+        returns the number of instructions executed
+        """
+        if self.use_blocks:
+            return self.run_blocks(cycles)
+        return self.interpret(cycles)
+
+    def interpret(self, cycles=None, until_jump=False):
+        """
+        fetch and execute loop over the decoded instructions, one instruction at a time
+        @param cycles(int): maximum number of instructions to execute, None to run until halted
+        @param until_jump(bool): also stop after the first jump taken
+        returns the number of instructions executed
+        """
+        ram = self.ram
+        program = self.program
+        size = len(program)
+        halt_addresses = self.halt_addresses
+        a, d, pc = self.a, self.d, self.pc
+        executed = 0
+        limit = -1 if cycles is None else cycles
+        while executed != limit:
+            if pc >= size:
+                self.halted = True
+                break
+            instruction = program[pc]
+            executed += 1
+            comp = instruction[0]
+            # A command
+            if comp is None:
+                a = instruction[1]
+                pc += 1
+                continue
+            # C command
+            _, uses_m, dest, jump = instruction
+            value = comp(a, d, ram[a] if uses_m else 0)
+            target = a # jumps go to the value A had before this instruction
+            if dest:
+                if dest & 0b001:
+                    ram[a] = value
+                if dest & 0b100:
+                    a = value
+                if dest & 0b010:
+                    d = value
+            if jump and jump & (0b100 if value & 0x8000 else 0b010 if value == 0 else 0b001):
+                if pc in halt_addresses:
+                    self.halted = True
+                    break
+                pc = target
+                if until_jump:
+                    break
+            else:
+                pc += 1
+        self.a, self.d, self.pc = a, d, pc
+        self.cycles += executed
+        return executed
+
+    def run_blocks(self, cycles=None):
+        """
+        executes compiled blocks, compiling the code at an address once execution has jumped to it
+        HOT_ENTRIES times. Until then, and when a block is entered with the stack pointer outside
+        the range it was compiled for, the interpreter runs up to the next jump taken. When the
+        next block could overrun the cycle budget the interpreter finishes the run.
+        @param cycles(int): maximum number of instructions to execute, None to run until halted
+        returns the number of instructions executed
+        """
+        ram = self.ram
+        blocks = self.blocks
+        entries = self.entries
+        extents = self.extents
+        size = len(self.program)
+        a, d, pc = self.a, self.d, self.pc
+        executed = interpreted = 0
+        left = UNLIMITED if cycles is None else cycles
+        while True:
+            block = blocks.get(pc)
+            if block is None:
+                if pc >= size:
+                    self.halted = True
+                    break
+                entries[pc] = entries.get(pc, 0) + 1
+                if entries[pc] >= HOT_ENTRIES:
+                    block = self.compile_block(pc)
+            if block is not None:
+                function, longest = block
+                if longest > left:
+                    break
+                pc, a, d, count = function(ram, a, d, pc, left - longest)
+                if count:
+                    executed += count
+                    left -= count
+                    # negative addresses mark an end of program loop, ~pc is the jump that loops
+                    if pc < 0:
+                        self.halted = True
+                        pc = ~pc
+                        break
+                    continue
+            self.a, self.d, self.pc = a, d, pc
+            ran = self.interpret(None if cycles is None else left, True)
+            # no jump was taken before the last instruction, so the code from pc on ran straight
+            if ran > extents.get(pc, 0):
+                extents[pc] = ran
+            interpreted += ran
+            left -= ran
+            a, d, pc = self.a, self.d, self.pc
+            if self.halted or not left:
+                break
+        self.a, self.d, self.pc = a, d, pc
+        self.cycles += executed
+        executed += interpreted
+        if cycles is not None and not self.halted and left:
+            executed += self.interpret(left)
+        return executed
+
+    def compile_block(self, start, max_length=1024):
+        """
+        compiles the code reached from start into one Python function, entered at the start of
+        any path in it
+        the function runs a region of paths compiled by compile_path. The region starts with the
+        path at start and adds the paths at the addresses its exits jump to that already ran before
+        and are not compiled yet, until it holds max_length instructions. The paths are laid out by
+        address in a loop: an exit to a later path falls through to it, an exit to an earlier one
+        or to an address computed at run time goes round the loop, other exits return.
+        returns (function(ram, a, d, pc, limit) -> (next pc, a, d, instructions executed), longest
+        run of the loop), also stored as the block of every path. The function executes nothing
+        and returns 0 instructions when entered with sp out of range, and only goes round the loop
+        again while it has executed limit instructions or less.
+        """
+        hot = set(self.blocks).union(address for address, entries in self.entries.items() if entries >= HOT_TARGET)
+        paths = {}
+        pending = [start]
+        length = 0
+        while pending and length < max_length:
+            label = pending.pop(0)
+            if label in paths or label in self.blocks:
+                continue
+            paths[label] = self.compile_path(label, hot, self.extents)
+            length += paths[label][2]
+            pending += [target for target in sorted(paths[label][3]) if target in hot]
+        labels = sorted(paths)
+        if labels == [start] and start not in paths[start][3]:
+            lines = self.path_source(start, paths[start], (), False)
+        else:
+            lines = ["n = 0", "while True:", "    if n > limit:", "        return pc, a, d, n"]
+            for label in labels:
+                lines.append("    if pc == {}:".format(label))
+                lines += ["        " + line for line in self.path_source(label, paths[label], labels, True)]
+            lines.append("    return pc, a, d, n")
+        source = "def block(ram, a, d, pc, limit):\n    " + "\n    ".join(lines) + "\n"
+        namespace = {}
+        exec(compile(source, "<block {}>".format(start), "exec"), namespace)
+        block = namespace["block"], length
+        for label in labels:
+            self.blocks[label] = block
+        return block
+
+    def compile_path(self, start, stops, extents):
+        """
+        compiles the code reached from start into the body lines of a function
+        the path starts at a jump target and extends along the fall through path as far as the
+        code there ran straight before. A conditional jump forward over a few instructions, or
+        over a few and back like an if else, becomes an if in the path, other taken conditional
+        jumps leave through side exits. Jumps to a known address are followed unless another path
+        starts there, or D holds a constant like the return address passed to the shared VM
+        routines, and a jump to an address only known at run time ends it.
+        A and D are locals, or while they hold a constant or the stack pointer plus a known offset
+        they are folded into the generated code. The stack pointer RAM[0] is read once into the
+        local sp and only written back when the path leaves, so @SP A=M, M=M+1, AM=M-1 and
+        A=A-1 generate no code. The path runs only if every sp + offset it uses is an address
+        in the stack. A write through an address computed at run time leaves the path if that
+        address is 0, a read through it takes sp from the local. Values written to or read from RAM at a constant address or sp + offset
+        are remembered until the local holding them or an address that may be the same changes,
+        so reading them again costs nothing.
+        @param stops: addresses where other paths start
+        @param extents: address -> instructions the code there ran before a jump was taken
+        returns (lines, offsets of sp used, longest path, addresses the exits jump to)
+        """
+        rom = self.rom
+        size = len(rom)
+        lines = []
+        visited = set()
+        offsets = set()
+        targets = set()
+        # values of A and D: an int constant, ("sp", offset) or the name of the local holding it.
+        # While tracking, RAM[0] is sp + offset, and RAM itself is stale unless the offset is 0.
+        # memory maps a constant or ("sp", offset) address to the value known to be in RAM there.
+        state = {"a": "a", "d": "d", "tracking": True, "offset": 0, "memory": {}, "count": 0}
+        extra = 0 # instructions the longer side of the ifs runs on top of the count
+        reach = start + extents.get(start, MAX_PATH)
+        through = None
+        pc = start
+
+        def source(value):
+            if type(value) is int:
+                return str(value)
+            if type(value) is tuple:
+                offsets.add(value[1])
+                return "sp" if value[1] == 0 else "sp {} {}".format("+" if value[1] > 0 else "-", abs(value[1]))
+            return value
+
+        def leave(state, target, indent="", flush=True):
+            # the lines that leave the path for target with the registers it has now, the exit
+            # itself is a tuple that path_source turns into a return or a jump within the region
+            code = []
+            if flush and state["tracking"] and state["offset"] != 0:
+                code.append(indent + "ram[0] = " + source(("sp", state["offset"])))
+            if type(target) is int and target >= 0:
+                targets.add(target)
+            code.append((indent, target if type(target) is int else None, source(target),
+                         source(state["a"]), source(state["d"]), state["count"]))
+            return code
+
+        def forget(state, name):
+            # the local changed, so RAM no longer holds its value anywhere known
+            memory = state["memory"]
+            for key in [key for key, known in memory.items() if known == name]:
+                del memory[key]
+
+        def execute(state, pc, lines):
+            # adds the lines of the instruction at pc, returns its jump bits, target and condition
+            word = rom[pc]
+            if not word & 0x8000:
+                state["count"] += 1
+                state["a"] = word
+                return 0, None, None
+            comp, dest, jump = (word >> 6) & 0x7F, (word >> 3) & 7, word & 7
+            a_value, d_value, memory = state["a"], state["d"], state["memory"]
+            state["count"] += 1
+            m = None
+            if comp & 0x40:
+                if a_value == 0 and state["tracking"]:
+                    m = ("sp", state["offset"])
+                elif a_value in memory:
+                    m = memory[a_value]
+                elif a_value == "a" and state["tracking"] and state["offset"] != 0:
+                    # RAM[0] is stale in memory, the stack pointer is in the local
+                    m = "(ram[a] if a else {})".format(source(("sp", state["offset"])))
+                else:
+                    m = "ram[{}]".format(source(a_value))
+            value = fold(comp, a_value, d_value, m)
+            expression = None if value is not None else COMP_SOURCE[comp].format(
+                a=source(a_value), d=source(d_value), m=m if type(m) is str else source(m) if m is not None else "")
+            if value is None and FOLDS[comp][1] and FOLDS[comp][1][1]:
+                # adding or taking 0 leaves a local as it is
+                _, x, sign, y = FOLDS[comp][1]
+                operands = {"a": a_value, "d": d_value, "m": m}
+                x, y = operands[x], operands[y] if y else 1
+                if y == 0 and type(x) is str and x in "ad":
+                    expression = x
+                elif sign == "+" and x == 0 and type(y) is str and y in "ad":
+                    expression = y
+            target = a_value
+            address = a_value
+            if a_value == "a" and dest & 0b100 and (jump or dest & 0b001 and state["tracking"]):
+                lines.append("t = a")
+                target = address = "t"
+            # the write to M, None when it only moves the offset of sp
+            store = None
+            if dest & 0b001:
+                if address == 0 and state["tracking"]:
+                    if type(value) is tuple:
+                        state["offset"] = value[1]
+                    else:
+                        store = "ram[0]"
+                        state["tracking"] = False
+                else:
+                    store = "ram[{}]".format(source(address))
+            condition = None
+            if value is not None:
+                if store:
+                    lines.append("{} = {}".format(store, source(value)))
+                if dest & 0b100:
+                    state["a"] = value
+                if dest & 0b010:
+                    state["d"] = value
+                if jump and jump != 0b111:
+                    # sp + offset is from 1 to 32767, so it is decided like 1
+                    v = value if type(value) is int else 1
+                    jump = 0b111 if jump & (0b100 if v & 0x8000 else 0b010 if v == 0 else 0b001) else 0
+            else:
+                if jump and jump != 0b111:
+                    if dest & 0b010:
+                        condition = "d"
+                    elif dest & 0b100:
+                        condition = "a"
+                    elif expression in ("d", "a") or expression.startswith("ram[") and expression.endswith("]"):
+                        condition = expression
+                    else:
+                        lines.append("v = " + expression)
+                        expression = condition = "v"
+                    condition = JUMP_SOURCE[jump].replace("v", condition)
+                # a local already holding the value, like d after D=M of a known M, is not assigned
+                names = [name for name in ([store] if store else []) + (["a"] if dest & 0b100 else []) +
+                         (["d"] if dest & 0b010 else []) if name != expression]
+                if names:
+                    lines.append(" = ".join(names) + " = " + expression)
+                for name in "ad":
+                    if name in names:
+                        forget(state, name)
+                if dest & 0b100:
+                    state["a"] = "a"
+                if dest & 0b010:
+                    state["d"] = "d"
+            if store:
+                if type(address) in (int, tuple):
+                    for key in [key for key in memory if aliases(key, address)]:
+                        del memory[key]
+                    known = value if value is not None else "d" if dest & 0b010 else "a" if dest & 0b100 else \
+                        expression if expression in ("a", "d") else None
+                    if known is not None:
+                        memory[address] = known
+                else:
+                    memory.clear()
+            elif comp == 0b1110000 and type(m) is str and dest & 0b110 and type(address) in (int, tuple):
+                # D=M, A=M or AD=M leaves the value read in a local
+                memory[address] = "d" if dest & 0b010 else "a"
+            if store and state["tracking"] and address in ("a", "t"):
+                # the program moved the stack pointer through a computed address, RAM[0] is
+                # already written so the block leaves without writing it back
+                lines.append("if not {}:".format(address))
+                lines += leave(state, pc + 1, "    ", False)
+            return jump, target, condition
+
+        def straight(first, end):
+            return all(not rom[address] & 0x8000 or not rom[address] & 7 for address in range(first, end))
+
+        def sides(pc, target):
+            # the addresses run when the conditional jump to target that pc follows is taken and
+            # when it is not, and the address they join at, if it skips a few straight instructions
+            # or they end with @join 0;JMP over a few more, None otherwise. An A command at the join
+            # runs on both sides so they agree on A.
+            if not pc < target <= pc + MAX_SIDE:
+                return None
+            join = rom[target - 2] if target - pc >= 2 else 0
+            if straight(pc, target):
+                taken, other, join = [], list(range(pc, target)), target
+            elif not join & 0x8000 and target < join <= target + MAX_SIDE and rom[target - 1] & 0x8007 == 0x8007 \
+                    and straight(pc, target - 1) and straight(target, join):
+                taken, other = list(range(target, join)), list(range(pc, target))
+            else:
+                return None
+            if join < size and not rom[join] & 0x8000:
+                taken.append(join)
+                other.append(join)
+                join += 1
+            return taken, other, join
+
+        def side(addresses):
+            # the state and lines after the instructions at addresses
+            branch = dict(state, memory=dict(state["memory"]))
+            code = []
+            for address in addresses:
+                execute(branch, address, code)
+            return branch, code
+
+        while True:
+            if pc >= size or pc in visited or pc >= reach or state["count"] >= MAX_PATH or \
+                    pc != through and state["count"] and pc in stops:
+                lines += leave(state, pc)
+                break
+            visited.add(pc)
+            jump, target, condition = execute(state, pc, lines)
+            pc += 1
+            if not jump:
+                continue
+            if pc - 1 in self.halt_addresses:
+                lines += leave(state, ~(pc - 1))
+                break
+            if jump != 0b111:
+                shape = sides(pc, target) if type(target) is int else None
+                if shape:
+                    taken_addresses, other_addresses, join = shape
+                    taken, taken_lines = side(taken_addresses)
+                    other, other_lines = side(other_addresses)
+                    if taken["tracking"] == other["tracking"] and taken["offset"] == other["offset"]:
+                        # both sides leave A, D and the instruction count the same way at the join
+                        for name in "ad":
+                            if taken[name] != other[name]:
+                                for branch, code in ((taken, taken_lines), (other, other_lines)):
+                                    if branch[name] != name:
+                                        code.append("{} = {}".format(name, source(branch[name])))
+                                        forget(branch, name)
+                                        branch[name] = name
+                        count = min(taken["count"], other["count"])
+                        for branch, code in ((taken, taken_lines), (other, other_lines)):
+                            if branch["count"] > count:
+                                code.append("n += {}".format(branch["count"] - count))
+                        extra += abs(taken["count"] - other["count"])
+                        memory = {key: known for key, known in taken["memory"].items() if other["memory"].get(key) == known}
+                        state = dict(taken, memory=memory, count=count)
+                        if taken_lines:
+                            lines.append("if {}:".format(condition))
+                            lines += indented(taken_lines)
+                            if other_lines:
+                                lines.append("else:")
+                                lines += indented(other_lines)
+                        elif other_lines:
+                            lines.append("if not ({}):".format(condition))
+                            lines += indented(other_lines)
+                        visited.update(taken_addresses, other_addresses)
+                        reach = max([reach] + [address + extents.get(address, 0) for address in (target, join - 1, join)])
+                        pc = through = join
+                        continue
+                lines.append("if {}:".format(condition))
+                lines += leave(state, target, "    ")
+            elif type(target) is int and (target not in stops or type(state["d"]) is int):
+                if target in stops:
+                    # a call of a shared routine, which usually returns to the address in D
+                    visited = set()
+                    if type(state["d"]) is int and state["d"] < size:
+                        targets.add(state["d"])
+                pc = through = target
+                reach = target + extents.get(target, 0)
+            else:
+                lines += leave(state, target)
+                break
+        return lines, offsets, state["count"] + extra, targets
+
+    def path_source(self, start, path, labels, looping):
+        """
+        returns the source lines of a path compiled by compile_path, reading sp and checking its
+        range first if the path uses it, n counts the instructions the ifs in it add. In a looping
+        region an exit to the path at one of the labels or to an address computed at run time
+        sets pc and moves A and D into the locals. A jump back, to a computed address or from
+        inside an if goes round the loop, a side exit forward leaves the rest of the path in an
+        else so the jump falls through to the later path
+        """
+        lines, offsets, _, _ = path
+        code = [] if looping else ["n = 0"]
+        if offsets:
+            code += ["sp = ram[0]", "if not {} <= sp <= {}:".format(STACK - min(offsets), HEAP - 1 - max(offsets)),
+                     "    return {}, a, d, n".format(start)]
+        indent = ""
+        for line in lines:
+            if type(line) is str:
+                code.append(indent + line)
+                continue
+            exit_indent, address, target, a_source, d_source, count = line
+            if looping and (address in labels or address is None):
+                if address != start:
+                    code.append(indent + exit_indent + "pc = {}".format(target))
+                moves = [(name, value) for name, value in (("a", a_source), ("d", d_source)) if name != value]
+                if moves:
+                    code.append(indent + exit_indent + ", ".join(name for name, _ in moves) + " = " +
+                                ", ".join(value for _, value in moves))
+                code.append(indent + exit_indent + "n += {}".format(count))
+                if address is None or address <= start or len(exit_indent) > 4 or len(indent) >= MAX_NESTING * 4:
+                    code.append(indent + exit_indent + "continue")
+                elif exit_indent:
+                    code.append(indent + "else:")
+                    indent += "    "
+            else:
+                code.append(indent + exit_indent + "return {}, {}, {}, n + {}".format(target, a_source, d_source, count))
+        return code
+
+    def peek(self, address):
+        """
+        returns the RAM value at address as a signed 16-bit integer
+        """
+        value = self.ram[address]
+        return value - 0x10000 if value & 0x8000 else value
+
+    def poke(self, address, value):
+        """
+        stores a (possibly negative) integer in RAM as a 16-bit value
+        """
+        self.ram[address] = value & 0xFFFF
+
+def fold(comp, a, d, m):
+    """
+    returns the result of comp on the values of A, D and M when the block compiler knows it: an int
+    when they are constants, ("sp", offset) for an offset added to or taken from the stack pointer,
+    None when the computation has to run
+    """
+    operands = {"a": a, "d": d, "m": m}
+    used, match = FOLDS[comp]
+    for name in used:
+        if type(operands[name]) is not int:
+            break
+    else:
+        return COMP[comp](a, d, m)
+    if not match:
+        return None
+    alone, x, sign, y = match
+    if alone:
+        value = operands[alone]
+        return value if type(value) in (int, tuple) else None
+    x, y = operands[x], operands[y] if y else 1
+    if sign == "+" and type(x) is int:
+        x, y = y, x
+    if type(x) is not tuple or type(y) is not int:
+        return None
+    y = y if y < 32768 else y - 65536
+    offset = x[1] + y if sign == "+" else x[1] - y
+    return ("sp", offset) if abs(offset) <= MAX_OFFSET else None
+
+def indented(lines, indent="    "):
+    """
+    returns the lines of compile_path nested one level deeper, exits included
+    """
+    return [indent + line if type(line) is str else (indent + line[0],) + line[1:] for line in lines]
+
+def aliases(x, y):
+    """
+    returns whether the RAM addresses x and y, each a constant or ("sp", offset), may be the same
+    """
+    if type(x) is type(y):
+        return x == y
+    constant = x if type(x) is int else y
+    return STACK <= constant < HEAP
+
+def read_program(file_path):
+    """
+    returns the machine words of a .hack file, or of a .asm file assembled in memory
+    """
+    if file_path.endswith(".asm"):
+        assembler = HackAssembler(file_path)
+        assembler.symbol_check()
+        assembler.parse()
+        return assembler.binary
+    with open(file_path, 'r') as file:
+        return array('H', (int(line, 2) for line in file if line.strip()))
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Run a Hack program on an emulated CPU")
+    arg_parser.add_argument("file_path", help="path to a .hack file or a .asm file to assemble first")
+    arg_parser.add_argument("--cycles", type=int, help="stop after this many instructions, default runs until the program halts")
+    arg_parser.add_argument("--blocks", action="store_true", help="compile basic blocks to Python functions instead of interpreting")
+    arg_parser.add_argument("--set", nargs="*", default=[], metavar="ADDRESS=VALUE", help="RAM values to set before running")
+    arg_parser.add_argument("--ram", nargs="*", default=[], metavar="ADDRESS[:END]", help="RAM addresses or ranges to print afterwards")
+    args = arg_parser.parse_args()
+    emulator = CPUEmulator(args.file_path, args.blocks)
+    for assignment in args.set:
+        address, value = assignment.split("=")
+        emulator.poke(int(address), int(value))
+    executed = emulator.run(args.cycles)
+    print("{} cycles, {}".format(executed, "halted at {}".format(emulator.pc) if emulator.halted else "pc {}".format(emulator.pc)))
+    for selection in args.ram:
+        start, _, end = selection.partition(":")
+        for address in range(int(start), int(end or start) + 1):
+            print("RAM[{}] = {}".format(address, emulator.peek(address)))
+
+if __name__ == '__main__':
+    main()
@@ -6,48 +6,64 @@ class Code:
     def __init__(self):
         """
         Initialise the mappings of assembly code to binary for C commands
+        each field is stored as an int already shifted into its position
+        in the 16-bit instruction word so a C command is a single bitwise or
         """
         self.dest_table={
-		    "null":"000", "M":"001", "D":"010", "MD":"011",
-		    "A":"100", "AM":"101", "AD":"110", "AMD":"111"
+		    "null":0b000<<3, "M":0b001<<3, "D":0b010<<3, "MD":0b011<<3,
+		    "A":0b100<<3, "AM":0b101<<3, "AD":0b110<<3, "AMD":0b111<<3
 		}
 
         self.comp_table = {
-            "0":"0101010", "1":"0111111", "-1":"0111010", 
-            "D":"0001100", "A":"0110000", "M":"1110000",
-            "!D":"0001101", "!A":"0110001", "!M":"1110001",
-            "-D":"0001111", "-A":"0110011", "-M":"1110011",
-            "D+1":"0011111", "A+1":"0110111", "M+1":"1110111",
-            "D-1":"0001110", "A-1":"0110010", "M-1":"1110010",
-            "D+A":"0000010", "D+M":"1000010", "D-A":"0010011",
-            "D-M":"1010011", "A-D":"0000111", "M-D":"1000111",
-            "D&A":"0000000", "D&M":"1000000", "D|A":"0010101",
-            "D|M":"1010101"
+            "0":0b0101010<<6, "1":0b0111111<<6, "-1":0b0111010<<6,
+            "D":0b0001100<<6, "A":0b0110000<<6, "M":0b1110000<<6,
+            "!D":0b0001101<<6, "!A":0b0110001<<6, "!M":0b1110001<<6,
+            "-D":0b0001111<<6, "-A":0b0110011<<6, "-M":0b1110011<<6,
+            "D+1":0b0011111<<6, "A+1":0b0110111<<6, "M+1":0b1110111<<6,
+            "D-1":0b0001110<<6, "A-1":0b0110010<<6, "M-1":0b1110010<<6,
+            "D+A":0b0000010<<6, "D+M":0b1000010<<6, "D-A":0b0010011<<6,
+            "D-M":0b1010011<<6, "A-D":0b0000111<<6, "M-D":0b1000111<<6,
+            "D&A":0b0000000<<6, "D&M":0b1000000<<6, "D|A":0b0010101<<6,
+            "D|M":0b1010101<<6
         }
+        # operand swapped spellings of the commutative computations, as emitted by the VM translator
+        for code in ["D+A", "D+M", "D&A", "D&M", "D|A", "D|M"]:
+            self.comp_table[code[2]+code[1]+code[0]] = self.comp_table[code]
 
         self.jump_table={
-		    "null":"000","JGT":"001","JEQ":"010","JGE":"011",
-		    "JLT":"100","JNE":"101","JLE":"110","JMP":"111"
+		    "null":0b000,"JGT":0b001,"JEQ":0b010,"JGE":0b011,
+		    "JLT":0b100,"JNE":0b101,"JLE":0b110,"JMP":0b111
 		}
 
+        self.c_prefix = 0b111<<13 # leading bits of every C command
+
 
     def dest(self, code):
         """
-        returns corresponding dest binary from assembly code
+        returns corresponding dest bits from assembly code
         @param code(str): assembly representation of dest in Hack C command
         """
         return self.dest_table[code]
-    
+
     def comp(self, code):
         """
-        returns corresponding comp binary from assembly code
+        returns corresponding comp bits from assembly code
         @param code(str): assembly representation of comp in Hack C command
         """
         return self.comp_table[code]
-    
+
     def jump(self, code):
         """
-        returns corresponding jump binary from assembly code
+        returns corresponding jump bits from assembly code
         @param code(str): assembly representation of jump in Hack C command
         """
-        return self.jump_table[code]
\ No newline at end of file
+        return self.jump_table[code]
+
+    def instruction(self, dest, comp, jump):
+        """
+        returns the 16-bit integer encoding of a whole C command
+        @param dest(str): assembly representation of dest in Hack C command
+        @param comp(str): assembly representation of comp in Hack C command
+        @param jump(str): assembly representation of jump in Hack C command
+        """
+        return self.c_prefix | self.comp_table[comp] | self.dest_table[dest] | self.jump_table[jump]
@@ -1,39 +1,60 @@
 import os
 import sys
+import argparse
+import json
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 from Parser import Parser
 from Code import Code
+from AssemblyCache import AssemblyCache
+
+VERSION = "1.3" # part of the cache key, bump whenever the generated machine code can change
+
+PREDEFINED_SYMBOLS = {
+    "SP":0, "LCL":1, "ARG":2, "THIS":3, "THAT":4,
+    "R0":0, "R1":1, "R2":2, "R3":3, "R4":4, "R5":5,
+    "R6":6, "R7":7, "R8":8, "R9":9, "R10":10, "R11":11,
+    "R12":12, "R13":13, "R14":14, "R15":15,
+    "SCREEN":16384, "KBD":24576
+} #default symbols in Hack
 
 """Hack Assembler takes an assembly code and translates it into binary machine language"""
 class HackAssembler:
-    def __init__(self, file_path):
+    def __init__(self, file_path, single_pass=False):
         """
         opens the assembly file discarding empty and comment lines and striping whitespace
         @param file_path(str): path to .asm file that is being translated to binary
+        @param single_pass(bool): stream the source into the parser instead of keeping
+                                  the stripped lines, for use with assemble()
         """
         self.instructions=[]
-        self.binary=[]
-        self.symbol_table = {
-            "SP":0, "LCL":1, "ARG":2, "THIS":3, "THAT":4,
-		    "R0":0, "R1":1, "R2":2, "R3":3, "R4":4, "R5":5,
-            "R6":6, "R7":7, "R8":8, "R9":9, "R10":10, "R11":11,
-		    "R12":12, "R13":13, "R14":14, "R15":15,
-		    "SCREEN":16384, "KBD":24576
-        } #default symbols in Hack
+        self.binary=array('H') # 16-bit machine words
+        self.symbol_table = dict(PREDEFINED_SYMBOLS)
         self.next_var_address = 16 #first free memery address
+        self.file_path = file_path
         self.file_name = os.path.basename(file_path)
         ext = self.file_name[-3:]
         assert ext == "asm", "incorrect file type, input must be named like xxx.asm"
-        with open(file_path,'r') as file:
+        if single_pass:
+            self.parser = Parser(self.read_instructions())
+        else:
+            self.instructions = list(self.read_instructions())
+            self.parser = Parser(self.instructions)
+        self.code = Code()
+
+    def read_instructions(self):
+        """
+        generator over the instructions of the assembly file, one stripped line at a time
+        """
+        with open(self.file_path,'r') as file:
             for line in file:
                 line = line.strip()
                 if not line or line[0] == '/':
                     continue
                 if line.find('/') != -1:
                     line = line[:line.find('/')]
-                self.instructions.append(line.strip())
-        self.parser = Parser(self.instructions)
-        self.code = Code()
-        
+                yield line.strip()
+
     def symbol_check(self):
         """
         first pass to map all labels to the line count in file
@@ -57,7 +78,6 @@ class HackAssembler:
         while self.parser.hasMoreLines():
             self.parser.advance()
             type = self.parser.instructionType()
-            binary_code = ""
             # A commands in Hack
             if type =='A':
                 symbol = self.parser.symbol()
@@ -68,39 +88,338 @@ class HackAssembler:
                         self.symbol_table[symbol] = self.next_var_address
                         symbol = self.next_var_address
                         self.next_var_address += 1
-                symbol = format(int(symbol), 'b')
-                pre = '0'*(16-len(symbol))
-                binary_code += pre+symbol
+                binary_code = int(symbol)
             # skip line if it is a label (no neeed to convert to binary)
             elif type == 'L':
                 continue
             # C commands in Hack
             else:
-                dest = self.parser.dest()
-                comp = self.parser.comp()
-                jump = self.parser.jump()
-
-                dest_code = self.code.dest(dest)
-                comp_code = self.code.comp(comp)
-                jump_code = self.code.jump(jump)
-                binary_code += "111"+comp_code+dest_code+jump_code
+                binary_code = self.c_instruction()
+            self.binary.append(binary_code)
+
+    def parse_parallel(self, jobs, chunk_size=None):
+        """
+        second pass with the encoding split across a process pool, run after symbol_check
+        variable addresses depend on order of first use so a cheap serial scan allocates
+        them first, after that every symbol is known and each chunk is encoded on its own.
+        Chunks come back in order so the result is identical to parse()
+        @param jobs(int): number of worker processes
+        @param chunk_size(int): instructions per task, defaults to an even split over 4 tasks per worker
+        """
+        lines = []
+        for line in self.instructions:
+            if line[0] == '(':
+                continue
+            if line[0] == '@':
+                symbol = line[1:]
+                if not symbol.isdecimal() and symbol not in self.symbol_table:
+                    self.symbol_table[symbol] = self.next_var_address
+                    self.next_var_address += 1
+            lines.append(line)
+        if chunk_size is None:
+            chunk_size = max(1, -(-len(lines) // (jobs * 4)))
+        chunks = [lines[start:start+chunk_size] for start in range(0, len(lines), chunk_size)]
+        with ProcessPoolExecutor(jobs, initializer=init_worker, initargs=(self.symbol_table,)) as pool:
+            for words in pool.map(encode_chunk, chunks):
+                self.binary.extend(words)
+
+    def assemble(self):
+        """
+        single pass alternative to symbol_check followed by parse
+        a reference to a symbol that is not known yet is recorded as a fixup and
+        backpatched once the label is declared. Symbols still unresolved at the end
+        are variables, allocated from address 16 in order of first use exactly as
+        the two pass version does
+        """
+        fixups = {} # symbol -> indices of the A commands waiting for its address
+        while self.parser.hasMoreLines():
+            self.parser.advance()
+            type = self.parser.instructionType()
+            # A commands in Hack
+            if type == 'A':
+                binary_code = self.a_instruction(fixups, len(self.binary))
+            # labels take the address of the next instruction and resolve earlier references
+            elif type == 'L':
+                label = self.parser.symbol()
+                address = len(self.binary)
+                self.symbol_table[label] = address
+                for index in fixups.pop(label, ()):
+                    self.binary[index] = address
+                continue
+            # C commands in Hack
+            else:
+                binary_code = self.c_instruction()
+            self.binary.append(binary_code)
+
+        # remaining fixups are variables, dict order is their order of first use
+        for symbol, indices in fixups.items():
+            address = self.resolve(symbol)
+            for index in indices:
+                self.binary[index] = address
+
+    def stream(self, raw=False, buffer_size=4096):
+        """
+        single pass assembly that writes machine words to the output file as they are produced
+        only the symbol table and the fixup index are kept in memory. Forward references are
+        written as placeholders and patched in place once the whole source has been read,
+        every word has a fixed width in the output so its offset is known from its index
+        @param raw(bool): write a raw big-endian .bin file instead of .hack text
+        @param buffer_size(int): number of words rendered and written at a time
+        """
+        width = 2 if raw else 17
+        fixups = {} # symbol -> indices of the A commands waiting for its address
+        pending = array('H')
+        index = 0
+        with open(self.binary_file_name(raw), 'wb') as file:
+            while self.parser.hasMoreLines():
+                self.parser.advance()
+                type = self.parser.instructionType()
+                # A commands in Hack
+                if type == 'A':
+                    pending.append(self.a_instruction(fixups, index))
+                # labels take the address of the next instruction
+                elif type == 'L':
+                    self.symbol_table[self.parser.symbol()] = index
+                    continue
+                # C commands in Hack
+                else:
+                    pending.append(self.c_instruction())
+                index += 1
+                if len(pending) >= buffer_size:
+                    file.write(render(pending, raw))
+                    del pending[:]
+            file.write(render(pending, raw))
+
+            # fixups are labels declared after use or variables, in order of first use
+            for symbol, indices in fixups.items():
+                word = render(array('H', [self.resolve(symbol)]), raw)
+                for index in indices:
+                    file.seek(index * width)
+                    file.write(word)
+
+    def assemble_object(self):
+        """
+        single pass assembly into a relocatable module instead of a finished program
+        labels are addresses relative to the start of the module, every word that holds
+        one is recorded as a relocation. Symbols that are not declared in the module are
+        left as references for the linker, which resolves them against the labels of the
+        other modules or allocates them as variables
+        sets self.binary, self.labels, self.relocations and self.references
+        """
+        self.labels = {}
+        self.relocations = array('I')
+        fixups = {} # symbol -> indices of the A commands waiting for its address
+        while self.parser.hasMoreLines():
+            self.parser.advance()
+            type = self.parser.instructionType()
+            # A commands in Hack
+            if type == 'A':
+                symbol = self.parser.symbol()
+                index = len(self.binary)
+                if symbol.isdecimal():
+                    binary_code = int(symbol)
+                elif symbol in self.labels:
+                    binary_code = self.labels[symbol]
+                    self.relocations.append(index)
+                elif symbol in PREDEFINED_SYMBOLS:
+                    binary_code = PREDEFINED_SYMBOLS[symbol]
+                else:
+                    if symbol not in fixups:
+                        fixups[symbol] = array('I')
+                    fixups[symbol].append(index)
+                    binary_code = 0
+            # labels take the module relative address of the next instruction
+            elif type == 'L':
+                label = self.parser.symbol()
+                address = len(self.binary)
+                self.labels[label] = address
+                for index in fixups.pop(label, ()):
+                    self.binary[index] = address
+                    self.relocations.append(index)
+                continue
+            # C commands in Hack
+            else:
+                binary_code = self.c_instruction()
             self.binary.append(binary_code)
+        # what is left is external to this module, in order of first use
+        self.references = fixups
+
+    def create_object(self):
+        """
+        creates the relocatable object file (.hobj) of a module built by assemble_object
+        """
+        module = {
+            "version": VERSION,
+            "code": self.binary.tolist(),
+            "labels": self.labels,
+            "relocations": sorted(self.relocations),
+            "references": {symbol: indices.tolist() for symbol, indices in self.references.items()},
+        }
+        with open(self.file_name[:-4]+".hobj", 'w') as file:
+            json.dump(module, file)
+
+    def a_instruction(self, fixups, index):
+        """
+        returns the machine word for the parser's current A command in single pass mode
+        a symbol that is not known yet is recorded in fixups and encoded as 0 for now
+        @param fixups(dict): symbol -> array of instruction indices waiting for its address
+        @param index(int): index of the current instruction in the output
+        """
+        symbol = self.parser.symbol()
+        if symbol.isdecimal():
+            return int(symbol)
+        if symbol in self.symbol_table:
+            return self.symbol_table[symbol]
+        if symbol not in fixups:
+            fixups[symbol] = array('I')
+        fixups[symbol].append(index)
+        return 0
+
+    def resolve(self, symbol):
+        """
+        returns the address of a symbol, allocating the next free variable address if it is unknown
+        """
+        if symbol not in self.symbol_table:
+            self.symbol_table[symbol] = self.next_var_address
+            self.next_var_address += 1
+        return self.symbol_table[symbol]
 
-    def create_binary(self):
+    def c_instruction(self):
         """
-        creates the binary code file from the list of all 
+        returns the machine word for the parser's current C command
         """
-        binary_file_name = self.file_name[:-4]+".hack"
-        with open(binary_file_name, 'w') as file:
-            for line in self.binary:
-                file.write(line+'\n')
+        dest = self.parser.dest()
+        comp = self.parser.comp()
+        jump = self.parser.jump()
+        return self.code.instruction(dest, comp, jump)
+
+    def create_binary(self, raw=False):
+        """
+        creates the binary code file from the array of machine words
+        text .hack output is only rendered here, one 16 character line per word
+        @param raw(bool): write the words as big-endian 16-bit values to a .bin file instead
+        """
+        write_binary(self.binary_file_name(raw), self.binary, raw)
+
+    def create_symbols(self):
+        """
+        creates a .sym file listing every symbol and its address, one per line
+        """
+        write_symbols(self.file_name[:-4]+".sym", self.symbol_table)
+
+    def binary_file_name(self, raw=False):
+        """
+        returns the output file name, .bin for raw output and .hack otherwise
+        """
+        return self.file_name[:-4] + (".bin" if raw else ".hack")
+
+worker_symbol_table = None # symbol table of a parse_parallel worker process
+
+def init_worker(symbol_table):
+    """
+    process pool initializer, receives the complete symbol table once per worker
+    """
+    global worker_symbol_table
+    worker_symbol_table = symbol_table
+
+def encode_chunk(lines):
+    """
+    process pool task of parse_parallel, encodes label free instructions whose symbols are all known
+    @param lines(list(str)): stripped A and C commands
+    """
+    parser = Parser(lines)
+    code = Code()
+    words = array('H')
+    while parser.hasMoreLines():
+        parser.advance()
+        if parser.instructionType() == 'A':
+            symbol = parser.symbol()
+            words.append(int(symbol) if symbol.isdecimal() else worker_symbol_table[symbol])
+        else:
+            words.append(code.instruction(parser.dest(), parser.comp(), parser.jump()))
+    return words
+
+def render(words, raw=False):
+    """
+    returns the bytes written to the output file for an array of machine words
+    @param words(array): 16-bit machine words
+    @param raw(bool): big-endian 16-bit values instead of lines of 0s and 1s
+    """
+    if raw:
+        words = array('H', words)
+        if sys.byteorder == 'little':
+            words.byteswap()
+        return words.tobytes()
+    return ''.join(map('{:016b}\n'.format, words)).encode()
+
+def write_binary(file_name, words, raw=False):
+    """
+    writes machine words to a .hack (or raw .bin) file, rendering a few thousand at a time
+    """
+    with open(file_name, 'wb') as file:
+        for start in range(0, len(words), 4096):
+            file.write(render(words[start:start+4096], raw))
+
+def write_symbols(file_name, symbol_table):
+    """
+    writes a symbol table as one "symbol address" pair per line
+    """
+    with open(file_name, 'w') as file:
+        for symbol, address in symbol_table.items():
+            file.write("{} {}\n".format(symbol, address))
 
 def main():
-    file_path=sys.argv[1]
-    assembler = HackAssembler(file_path)
-    assembler.symbol_check()
-    assembler.parse()
-    assembler.create_binary()
+    arg_parser = argparse.ArgumentParser(description="Translate Hack assembly into machine code")
+    arg_parser.add_argument("file_path", nargs="?", help="path to the .asm file")
+    arg_parser.add_argument("--raw", action="store_true", help="write a raw big-endian .bin file instead of .hack text")
+    arg_parser.add_argument("--symbols", action="store_true", help="also write the symbol table to a .sym file")
+    arg_parser.add_argument("--single-pass", action="store_true", help="resolve labels by backpatching in one pass over the source")
+    arg_parser.add_argument("--object", action="store_true", help="write a relocatable .hobj module for Linker.py instead of a program")
+    arg_parser.add_argument("--stream", action="store_true", help="single pass writing output as it is produced, memory bounded by the symbol table (bypasses the cache)")
+    arg_parser.add_argument("--jobs", type=int, default=1, help="encode the second pass of the default two-pass mode in this many worker processes")
+    arg_parser.add_argument("--no-cache", action="store_true", help="always assemble, neither reading nor updating the cache")
+    arg_parser.add_argument("--clear-cache", action="store_true", help="delete every cached program before assembling")
+    arg_parser.add_argument("--cache-dir", help="cache location, defaults to $HACK_ASSEMBLER_CACHE or ~/.cache/hack-assembler")
+    args = arg_parser.parse_args()
+    if args.jobs > 1 and (args.single_pass or args.stream or args.object):
+        arg_parser.error("--jobs only applies to the two-pass mode, not --single-pass, --stream or --object")
+    if args.clear_cache:
+        AssemblyCache(args.cache_dir).clear()
+    if args.file_path is None:
+        if not args.clear_cache:
+            arg_parser.error("the .asm file path is required")
+        return
+
+    if args.object:
+        assembler = HackAssembler(args.file_path, True)
+        assembler.assemble_object()
+        assembler.create_object()
+        return
+    if args.stream:
+        assembler = HackAssembler(args.file_path, True)
+        assembler.stream(args.raw)
+    else:
+        cache = None if args.no_cache else AssemblyCache(args.cache_dir)
+        key = cache.key(args.file_path, VERSION) if cache else None
+        entry = cache.load(key) if cache else None
+        # a hit skips parsing entirely, the streamed source is never walked
+        assembler = HackAssembler(args.file_path, args.single_pass or entry is not None)
+        if entry is not None:
+            assembler.binary, assembler.symbol_table = entry
+        else:
+            if args.single_pass:
+                assembler.assemble()
+            else:
+                assembler.symbol_check()
+                if args.jobs > 1:
+                    assembler.parse_parallel(args.jobs)
+                else:
+                    assembler.parse()
+            if cache:
+                cache.store(key, assembler.binary, assembler.symbol_table)
+        assembler.create_binary(args.raw)
+    if args.symbols:
+        assembler.create_symbols()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,86 @@
+import os
+import json
+import argparse
+from array import array
+from HackAssembler import VERSION, PREDEFINED_SYMBOLS, write_binary, write_symbols
+
+"""
+Linker that combines relocatable modules written by HackAssembler.py --object into one program
+"""
+class Linker:
+    def __init__(self):
+        """
+        starts with no modules and the default Hack symbols
+        """
+        self.modules = []
+        self.binary = array('H')
+        self.symbol_table = dict(PREDEFINED_SYMBOLS)
+        self.next_var_address = 16 #first free memery address
+
+    def load(self, object_path):
+        """
+        adds a module, modules are laid out in ROM in the order they are loaded
+        @param object_path(str): path to a .hobj file
+        """
+        with open(object_path, 'r') as file:
+            module = json.load(file)
+        assert module["version"] == VERSION, \
+            "{} was assembled by version {}, reassemble it with version {}".format(object_path, module["version"], VERSION)
+        module["name"] = os.path.basename(object_path)
+        self.modules.append(module)
+
+    def link(self):
+        """
+        places every module after the previous one, resolves references against the labels
+        of all modules and allocates the remaining references as variables from address 16
+        in order of first use, module by module
+        """
+        # place modules and make their labels global
+        base = 0
+        defined_in = {}
+        for module in self.modules:
+            module["base"] = base
+            for label, offset in module["labels"].items():
+                assert label not in defined_in, \
+                    "label {} is declared in both {} and {}".format(label, defined_in[label], module["name"])
+                defined_in[label] = module["name"]
+                self.symbol_table[label] = base + offset
+            base += len(module["code"])
+
+        # relocate and patch every module
+        for module in self.modules:
+            code = array('H', module["code"])
+            for index in module["relocations"]:
+                code[index] += module["base"]
+            for symbol, indices in module["references"].items():
+                address = self.resolve(symbol)
+                for index in indices:
+                    code[index] = address
+            self.binary.extend(code)
+
+    def resolve(self, symbol):
+        """
+        returns the address of a symbol, allocating the next free variable address if it is unknown
+        """
+        if symbol not in self.symbol_table:
+            self.symbol_table[symbol] = self.next_var_address
+            self.next_var_address += 1
+        return self.symbol_table[symbol]
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Link relocatable Hack modules into one program")
+    arg_parser.add_argument("objects", nargs="+", help=".hobj modules in ROM order, the one with the entry point first")
+    arg_parser.add_argument("-o", "--output", required=True, help="path of the .hack (or .bin with --raw) program")
+    arg_parser.add_argument("--raw", action="store_true", help="write raw big-endian 16-bit words instead of .hack text")
+    arg_parser.add_argument("--symbols", action="store_true", help="also write the linked symbol table to a .sym file")
+    args = arg_parser.parse_args()
+    linker = Linker()
+    for object_path in args.objects:
+        linker.load(object_path)
+    linker.link()
+    write_binary(args.output, linker.binary, args.raw)
+    if args.symbols:
+        write_symbols(os.path.splitext(args.output)[0]+".sym", linker.symbol_table)
+
+if __name__ == '__main__':
+    main()
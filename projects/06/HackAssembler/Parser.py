@@ -6,74 +6,75 @@ class Parser:
     def __init__(self, instructions):
         """
         sets the current location of parser
-        @param instructions(list(str)): list of assembly instructions
+        @param instructions(iterable(str)): assembly instructions, a list or any stream of lines
         """
-        self.instructions = instructions
-        self.curr_instruction = -1
+        self.instructions = iter(instructions)
+        self.next_instruction = next(self.instructions, None)
+        self.curr_instruction = None
         self.curr_type = None
 
     def hasMoreLines(self):
         """
         checks if parser has reached the last instruction
         """
-        return self.curr_instruction<len(self.instructions)-1
+        return self.next_instruction is not None
 
     def advance(self):
         """
         moves the current location to next instruction
         """
-        self.curr_instruction += 1
-        
+        self.curr_instruction = self.next_instruction
+        self.next_instruction = next(self.instructions, None)
+
     def instructionType(self):
         """
         sets the current instruction's type
         """
-        if self.instructions[self.curr_instruction][0]=='@':
+        if self.curr_instruction[0]=='@':
             self.curr_type = 'A'
-        elif self.instructions[self.curr_instruction][0]=='(':
+        elif self.curr_instruction[0]=='(':
             self.curr_type = 'L'
         else:
             self.curr_type = 'C'
         return self.curr_type
-            
+
     def symbol(self):
         """
         returns the symbol, label is type L and decimal/variable if type A
         """
         if self.curr_type == 'A':
-            return self.instructions[self.curr_instruction][1:]
+            return self.curr_instruction[1:]
         else:
-            return self.instructions[self.curr_instruction][1:-1]
+            return self.curr_instruction[1:-1]
 
     def dest(self):
         """
         returns the dest section of instruction
         """
-        eq_pos = self.instructions[self.curr_instruction].find('=')
+        eq_pos = self.curr_instruction.find('=')
         if eq_pos == -1:
             return 'null'
-        return self.instructions[self.curr_instruction][:eq_pos]
-    
+        return self.curr_instruction[:eq_pos]
+
     def comp(self):
         """
         returns the comp section of instruction
         """
-        eq_pos = self.instructions[self.curr_instruction].find('=')
-        semi_pos = self.instructions[self.curr_instruction].find(';')
+        eq_pos = self.curr_instruction.find('=')
+        semi_pos = self.curr_instruction.find(';')
         if semi_pos == -1:
             if eq_pos == -1:
-                return self.instructions[self.curr_instruction]
-            return self.instructions[self.curr_instruction][eq_pos+1:]
+                return self.curr_instruction
+            return self.curr_instruction[eq_pos+1:]
         if eq_pos == -1:
-            return self.instructions[self.curr_instruction][:semi_pos]
-        return self.instructions[self.curr_instruction][eq_pos+1:semi_pos]
-    
+            return self.curr_instruction[:semi_pos]
+        return self.curr_instruction[eq_pos+1:semi_pos]
+
     def jump(self):
         """
         returns the jump section of instruction
         """
-        semi_pos = self.instructions[self.curr_instruction].find(';')
+        semi_pos = self.curr_instruction.find(';')
         if semi_pos == -1:
             return 'null'
-        return self.instructions[self.curr_instruction][semi_pos+1:]
-    
\ No newline at end of file
+        return self.curr_instruction[semi_pos+1:]
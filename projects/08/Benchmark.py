@@ -0,0 +1,140 @@
+import os
+import re
+import sys
+import argparse
+import tempfile
+
+"""
+Benchmark of the translator's optimization levels: every program is translated at -O0, -O1 and -O2,
+its size and the cycles it runs on the CPU emulator are reported, and the test scripts of projects
+7 and 8 are checked against their .cmp files at every level
+"""
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SET_RAM = re.compile(r"set RAM\[(\d+)\] (-?\d+)")
+REPEAT = re.compile(r"repeat (\d+)")
+OUTPUT_RAM = re.compile(r"RAM\[(\d+)\]")
+JUMP = 0xEA87  # 0;JMP
+
+
+def read_test(tst_path):
+    """
+    returns (RAM settings, cycles, RAM addresses output) of a test script
+    only what the scripts of projects 7 and 8 use is read: sets, one repeat of ticktock and the output lists
+    """
+    settings, cycles, outputs = [], 0, []
+    with open(tst_path, "r") as file:
+        for line in file:
+            line = line.partition("//")[0]
+            settings += [(int(address), int(value)) for address, value in SET_RAM.findall(line)]
+            cycles += sum(int(count) for count in REPEAT.findall(line))
+            if "set" not in line:
+                outputs += [int(address) for address in OUTPUT_RAM.findall(line)]
+    return settings, cycles, outputs
+
+
+def read_compare(cmp_path):
+    """
+    returns the expected values of a .cmp file in order, the header rows are skipped
+    """
+    values = []
+    with open(cmp_path, "r") as file:
+        for line in file:
+            cells = [cell.strip() for cell in line.strip().strip("|").split("|")]
+            if all(re.match(r"^-?\d+$", cell) for cell in cells):
+                values += [int(cell) for cell in cells]
+    return values
+
+
+def vm_files(directory):
+    return [os.path.join(directory, file) for file in sorted(os.listdir(directory)) if file[-3:] == ".vm"]
+
+
+def run_level(files, level, cycles, bootstrap, settings=(), options=None):
+    """
+    translates and assembles the files at an optimization level and runs them on the CPU emulator
+    Sys.halt's loop is turned into a jump to itself so the emulator sees the program halt
+    returns (instructions, the emulator after the run), the emulator is None if the program does not fit in ROM
+    """
+    from VMTransltor import OPTIMIZATION_LEVELS, translate
+    from HackAssembler import HackAssembler
+    from CPUEmulator import CPUEmulator
+
+    with tempfile.TemporaryDirectory() as directory:
+        asm_file_name = os.path.join(directory, "Program.asm")
+        writer = translate(files, asm_file_name, bootstrap=bootstrap, **dict(OPTIMIZATION_LEVELS[level], **(options or {})))
+        assembler = HackAssembler(asm_file_name)
+        assembler.symbol_check()
+        assembler.parse()
+    if len(assembler.binary) > 32768:
+        return writer.instructions, None
+    program = list(assembler.binary)
+    halt = assembler.symbol_table.get("Sys.halt")
+    if halt is not None:
+        program[halt : halt + 2] = [halt, JUMP]
+    cpu = CPUEmulator(program, blocks=True)
+    for address, value in settings:
+        cpu.poke(address, value)
+    cpu.run(cycles)
+    return writer.instructions, cpu
+
+
+def main():
+    """
+    Runs every program at every level. A directory with a test script is translated alone, with
+    the bootstrap if it has a Sys.vm, and run for the cycles of the script before its outputs are
+    compared. Other directories get the OS classes they do not define and run until Sys.halt.
+    """
+    sys.path.insert(0, os.path.join(HERE, "..", "06", "HackAssembler"))
+    from VMTransltor import OPTIMIZATION_LEVELS
+
+    tests = []
+    for project in ["07", "08"]:
+        for directory, _, names in sorted(os.walk(os.path.join(HERE, "..", project))):
+            tests += [os.path.join(directory, name) for name in names if name[-4:] == ".tst" and name[-7:] != "VME.tst"]
+    arg_parser = argparse.ArgumentParser(description="Compare the size and cycles of the translator's optimization levels")
+    arg_parser.add_argument("programs", nargs="*",
+                            help="directories of .vm files, defaults to the test programs of projects 7 and 8")
+    arg_parser.add_argument("--os", default=os.path.join(HERE, "..", "..", "tools", "OS"),
+                            help="directory of OS .vm files added to programs without a test script")
+    arg_parser.add_argument("--cycles", type=int, default=200000000, help="instructions to run programs without a test script at most")
+    arg_parser.add_argument("--shared-calls", action="store_true", help="translate every level with shared call and return routines")
+    arg_parser.add_argument("--shared-comparisons", action="store_true", help="translate every level with shared comparison routines")
+    args = arg_parser.parse_args()
+    options = {"shared_calls": args.shared_calls, "shared_comparisons": args.shared_comparisons}
+
+    programs = args.programs or sorted(set(os.path.dirname(test) for test in tests))
+    failures = 0
+    for program in programs:
+        program = os.path.normpath(program)
+        files = vm_files(program)
+        test = os.path.join(program, os.path.basename(program) + ".tst")
+        if os.path.exists(test):
+            settings, cycles, outputs = read_test(test)
+            expected = read_compare(test[:-4] + ".cmp")
+            bootstrap = any(os.path.basename(file) == "Sys.vm" for file in files)
+        else:
+            settings, cycles, outputs, expected, bootstrap = [], args.cycles, [], [], True
+            defined = set(os.path.basename(file) for file in files)
+            files += [file for file in vm_files(args.os) if os.path.basename(file) not in defined]
+        if not bootstrap and (args.shared_calls or args.shared_comparisons):
+            print("{}: skipped, the shared routines need the bootstrap".format(program))
+            continue
+        results = []
+        for level in range(len(OPTIMIZATION_LEVELS)):
+            instructions, cpu = run_level(files, level, cycles, bootstrap, settings, options)
+            if cpu is None:
+                results.append("-O{} {} instructions, does not fit in ROM".format(level, instructions))
+                continue
+            result = "-O{} {} instructions {}{} cycles".format(level, instructions, "" if cpu.halted else ">", cpu.cycles)
+            if expected:
+                passed = [cpu.peek(address) for address in outputs] == expected
+                failures += not passed
+                result += " passed" if passed else " FAILED"
+            results.append(result)
+        print("{}: {}".format(os.path.relpath(program), ", ".join(results)))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
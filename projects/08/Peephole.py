@@ -0,0 +1,288 @@
+import os
+import re
+import sys
+import argparse
+import tempfile
+
+"""
+Peephole optimizer for the Hack assembly written by CodeWriter, and a harness that runs
+translations with and without an optimization on the CPU emulator and compares their RAM
+"""
+
+PUSH_D = ["@SP", "AM=M+1", "A=A-1", "M=D"]
+POP_D = ["@SP", "AM=M-1", "D=M"]
+SEGMENT_POINTERS = ["@LCL", "@ARG", "@THIS", "@THAT"]
+SEGMENT_BASES = {"@3": 3, "@5": 5}  # pointer and temp
+ONLY_A = re.compile(r"^(@.*|A=[^;]*)$")  # instructions whose only effect is loading A
+CONSTANT = re.compile(r"^@\d+$")
+POP_THROUGH_R13 = ["@R13", "M=D"] + POP_D + ["@R13", "A=M", "M=D"]
+# conditions branched on by the built-in program of the harness, most of them not booleans
+CONDITIONS = [1, 2, 5, -2, 0, -1]
+
+
+def a_free(line):
+    """
+    true for a line that loads A before using it, so the A left by the previous line is dead
+    labels are never A free since other paths jump there
+    """
+    return line[0] == "@"
+
+
+def segment_offset(index):
+    """
+    returns the instructions that turn A=base pointer address into A=base pointer + index
+    """
+    if index == 0:
+        return ["A=M"]
+    return ["A=M+1"] + ["A=A+1"] * (index - 1)
+
+
+def push_pop(lines):
+    # push D then pop into D: the value is still in D, only A has to end up where the pop leaves it
+    if lines[-7:] == PUSH_D + POP_D:
+        return 7, ["@SP", "A=M"]
+
+
+def dead_a(lines):
+    # an A load immediately overwritten by the next A load
+    if len(lines) >= 2 and a_free(lines[-1]) and ONLY_A.match(lines[-2]):
+        return 2, [lines[-1]]
+
+
+def a_arithmetic(lines):
+    # A=M followed by A=A-1 or A=A+1
+    if lines[-2:] == ["A=M", "A=A-1"]:
+        return 2, ["A=M-1"]
+    if lines[-2:] == ["A=M", "A=A+1"]:
+        return 2, ["A=M+1"]
+
+
+def small_constant(lines):
+    # @0 D=A or @1 D=A, when the constant left in A is not used
+    if len(lines) >= 3 and lines[-3] in ["@0", "@1"] and lines[-2] == "D=A" and a_free(lines[-1]):
+        return 3, ["D=" + lines[-3][1:], lines[-1]]
+
+
+def constant_reload(lines):
+    # the constant pushed last is loaded into D again, D still holds it
+    if len(lines) >= 8 and lines[-7:-3] == PUSH_D and lines[-2] == "D=A" and a_free(lines[-1]):
+        constant = lines[-3]
+        if CONSTANT.match(constant) and (lines[-9:-7] == [constant, "D=A"] or lines[-8] == "D=" + constant[1:]):
+            return 3, [lines[-1]]
+
+
+def pop_fixed(lines):
+    # pop to a static, temp or pointer address known at assembly time, without going through R13
+    if len(lines) >= 10 and lines[-8:] == POP_THROUGH_R13 and lines[-9] == "D=A" and lines[-10][0] == "@":
+        return 10, POP_D + [lines[-10], "M=D"]
+    if len(lines) >= 12 and lines[-8:] == POP_THROUGH_R13 and lines[-9] == "D=A+D" and lines[-11] == "D=A":
+        base, index = lines[-12], lines[-10]
+        if base in SEGMENT_BASES and CONSTANT.match(index):
+            return 12, POP_D + ["@" + str(SEGMENT_BASES[base] + int(index[1:])), "M=D"]
+
+
+def pop_segment(lines):
+    # pop to local, argument, this or that with a small index, stepping A instead of going through R13
+    if len(lines) >= 12 and lines[-8:] == POP_THROUGH_R13 and lines[-9] == "D=A+D" and lines[-11] == "D=M":
+        pointer, index = lines[-12], lines[-10]
+        if pointer in SEGMENT_POINTERS and CONSTANT.match(index) and int(index[1:]) <= 6:
+            return 12, POP_D + [pointer] + segment_offset(int(index[1:])) + ["M=D"]
+
+
+def push_fixed(lines):
+    # push from a temp or pointer address known at assembly time
+    if len(lines) >= 5 and lines[-4] == "D=A" and lines[-2:] == ["A=A+D", "D=M"]:
+        base, index = lines[-5], lines[-3]
+        if base in SEGMENT_BASES and CONSTANT.match(index):
+            return 5, ["@" + str(SEGMENT_BASES[base] + int(index[1:])), "D=M"]
+
+
+def push_segment(lines):
+    # push from local, argument, this or that with index 0 to 2
+    if len(lines) >= 5 and lines[-4] == "D=M" and lines[-2:] == ["A=A+D", "D=M"]:
+        pointer, index = lines[-5], lines[-3]
+        if pointer in SEGMENT_POINTERS and CONSTANT.match(index) and int(index[1:]) <= 2:
+            return 5, [pointer] + segment_offset(int(index[1:])) + ["D=M"]
+
+
+# (name, rule) tried in order on the end of the pending lines
+# a rule returns (number of trailing lines matched, replacement) or None; every replacement is
+# shorter than the lines it replaces, leaves the same D and memory and either the same A or
+# keeps a following line that loads A
+PATTERNS = [
+    ("push-pop", push_pop),
+    ("dead-a", dead_a),
+    ("a-arithmetic", a_arithmetic),
+    ("constant-reload", constant_reload),
+    ("small-constant", small_constant),
+    ("pop-fixed", pop_fixed),
+    ("pop-segment", pop_segment),
+    ("push-fixed", push_fixed),
+    ("push-segment", push_segment),
+]
+WINDOW = 16  # longest pattern plus its lookahead
+
+
+class Peephole:
+    """
+    Rewrites the assembly stream line by line before it is written.
+    Each added line is matched against the end of the pending lines, a replacement is fed back
+    through the patterns so rewrites can cascade, and lines that fall out of the window are final.
+    """
+
+    def __init__(self, write):
+        """
+        @param write(function): called with every line of optimized assembly, in order
+        """
+        self.write = write
+        self.pending = []
+        self.hits = {name: 0 for name, _ in PATTERNS}
+
+    def add(self, line):
+        """
+        adds the next line of assembly
+        """
+        todo = [line]
+        while todo:
+            self.pending.append(todo.pop())
+            for name, pattern in PATTERNS:
+                match = pattern(self.pending)
+                if match:
+                    length, replacement = match
+                    del self.pending[-length:]
+                    todo.extend(reversed(replacement))
+                    self.hits[name] += 1
+                    break
+        if len(self.pending) > WINDOW:
+            for line in self.pending[:-WINDOW]:
+                self.write(line)
+            del self.pending[:-WINDOW]
+
+    def flush(self):
+        """
+        writes the pending lines, call once the last line was added
+        """
+        for line in self.pending:
+            self.write(line)
+        self.pending = []
+
+
+def run_program(files, asm_file_name, cycles, jobs=1, **options):
+    """
+    translates, assembles and runs a program on the CPU emulator, translating in jobs processes if more than 1
+    returns (RAM, number of instructions, whether it halted, variable name to address)
+    """
+    from VMTransltor import translate, translateFragments
+    from HackAssembler import HackAssembler
+    from CPUEmulator import CPUEmulator
+
+    if jobs > 1:
+        writer = translateFragments(files, asm_file_name, jobs, **options)
+    else:
+        writer = translate(files, asm_file_name, **options)
+    assembler = HackAssembler(asm_file_name)
+    assembler.symbol_check()
+    labels = set(assembler.symbol_table)
+    assembler.parse()
+    assert len(assembler.binary) <= 32768, "{} instructions do not fit in ROM".format(len(assembler.binary))
+    cpu = CPUEmulator(list(assembler.binary), blocks=True)
+    cpu.run(cycles)
+    variables = {name: address for name, address in assembler.symbol_table.items() if name not in labels}
+    return cpu.ram, writer.instructions, cpu.halted, variables
+
+
+def branch_conditions():
+    """
+    returns the vm code of a Sys.init that branches on each of CONDITIONS with if-goto and with
+    not, if-goto, storing 111 in a static when the branch is taken and 222 when it is not
+    the condition goes through temp 0 so no optimization sees it as a constant
+    """
+    lines = ["function Sys.init 0"]
+    for i, value in enumerate(CONDITIONS):
+        for j, negate in enumerate([[], ["not"]]):
+            n = 2 * i + j
+            lines += ["push constant " + str(abs(value))] + ["neg"] * (value < 0) + ["pop temp 0", "push temp 0"] + negate
+            lines += ["if-goto TAKEN" + str(n), "push constant 222", "pop static " + str(n), "goto NEXT" + str(n),
+                      "label TAKEN" + str(n), "push constant 111", "pop static " + str(n), "label NEXT" + str(n)]
+    return "\n".join(lines + ["label HALT", "goto HALT"]) + "\n"
+
+
+def main():
+    """
+    Runs each program translated with and without the checked option until it halts or runs
+    out of cycles and compares RAM. The stack holds ROM return addresses and R13-R15 are scratch,
+    both are left out. Static variables are compared by name, their addresses depend on the
+    order the assembler first sees them in. Programs that end in Sys.halt's loop compare fine once both got there, a
+    run that halts while the other is still looping is only reported.
+    The built-in program of branch_conditions is checked first, without the OS.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, os.path.join(here, "..", "06", "HackAssembler"))
+    arg_parser = argparse.ArgumentParser(description="Check that an optimization keeps RAM identical")
+    arg_parser.add_argument("programs", nargs="*", help=".vm files or directories of .vm files")
+    arg_parser.add_argument("--os", default=os.path.join(here, "..", "..", "tools", "OS"),
+                            help="directory of OS .vm files added for classes a program does not define")
+    arg_parser.add_argument("--no-os", action="store_true", help="translate the programs without the OS")
+    arg_parser.add_argument("--cycles", type=int, default=50000000, help="instructions to run at most")
+    arg_parser.add_argument("--shared-calls", action="store_true", help="translate with shared call and return routines")
+    arg_parser.add_argument("--shared-comparisons", action="store_true", help="translate with shared comparison routines")
+    arg_parser.add_argument("--check", choices=["peephole", "fuse", "cache_top", "prune", "jobs"], default="peephole",
+                            help="the translate option that is off in the first run and on in the second, "
+                                 "jobs translates the second run in --jobs processes")
+    arg_parser.add_argument("--peephole", action="store_true", help="translate both runs with the peephole optimizer")
+    arg_parser.add_argument("--fuse", action="store_true", help="translate both runs with command fusion")
+    arg_parser.add_argument("--cache-top", action="store_true", help="translate both runs with the top of the stack cached in D")
+    arg_parser.add_argument("--prune", action="store_true", help="translate both runs without unreachable functions")
+    arg_parser.add_argument("--jobs", type=int, default=2, help="worker processes of the second run with --check jobs")
+    args = arg_parser.parse_args()
+
+    compared = list(range(1, 13)) + list(range(2048, 32768))
+    failures = 0
+    conditions = tempfile.TemporaryDirectory()
+    with open(os.path.join(conditions.name, "Sys.vm"), "w") as file:
+        file.write(branch_conditions())
+    for program in [conditions.name] + args.programs:
+        if os.path.isdir(program):
+            files = [os.path.join(program, file) for file in sorted(os.listdir(program)) if file[-3:] == ".vm"]
+        else:
+            files = [program]
+        if program == conditions.name:
+            program = "branch conditions"
+        elif not args.no_os:
+            defined = set(os.path.basename(file) for file in files)
+            files += [os.path.join(args.os, file) for file in sorted(os.listdir(args.os))
+                      if file[-3:] == ".vm" and file not in defined]
+        with tempfile.TemporaryDirectory() as directory:
+            results = []
+            for checked in [False, True]:
+                asm_file_name = os.path.join(directory, "Program{}.asm".format(int(checked)))
+                options = {"shared_calls": args.shared_calls, "shared_comparisons": args.shared_comparisons,
+                           "peephole": args.peephole, "fuse": args.fuse, "cache_top": args.cache_top, "prune": args.prune}
+                if args.check == "jobs":
+                    options["jobs"] = args.jobs if checked else 1
+                else:
+                    options[args.check] = checked
+                try:
+                    results.append(run_program(files, asm_file_name, args.cycles, **options))
+                except AssertionError as error:
+                    print("{}: skipped, {}".format(program, error))
+                    break
+        if len(results) < 2:
+            continue
+        (plain, plain_size, plain_halted, plain_variables), (optimized, optimized_size, optimized_halted, optimized_variables) = results
+        differences = [address for address in compared if plain[address] != optimized[address]]
+        # a variable only one run has belongs to a pruned function that never ran
+        differences += [name for name in sorted(set(plain_variables) & set(optimized_variables))
+                        if plain[plain_variables[name]] != optimized[optimized_variables[name]]]
+        failures += bool(differences)
+        # fusion turns Sys.halt's loop into a jump to itself, which only then is seen as halting
+        halted = "" if plain_halted == optimized_halted else ", only the {} run halted".format(
+            "optimized" if optimized_halted else "plain")
+        print("{}: {} -> {} instructions, {}{}".format(program, plain_size, optimized_size,
+              "RAM differs at " + str(differences[:10]) if differences else "RAM identical", halted))
+    conditions.cleanup()
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
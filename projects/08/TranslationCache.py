@@ -0,0 +1,119 @@
+import os
+import json
+import hashlib
+
+"""
+On disk cache of the assembly of single .vm files keyed by their content and the translator options
+"""
+
+
+class TranslationCache:
+    def __init__(self, directory=None, max_bytes=16 * 1024 * 1024):
+        """
+        sets up the cache directory
+        @param directory(str): where entries are stored, defaults to $VM_TRANSLATOR_CACHE or ~/.cache/vm-translator
+        @param max_bytes(int): total size of the entries kept before the least recently used are evicted
+        """
+        if directory is None:
+            directory = os.environ.get(
+                "VM_TRANSLATOR_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "vm-translator")
+            )
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, file_path, version, options):
+        """
+        returns the cache key for a vm file, a hash of its name, its bytes, the translator version and options
+        the name is part of the key because static variables and labels are named after the file
+        @param file_path(str): path to the .vm file
+        @param version(str): translator version, so entries from older translators are never reused
+        @param options(dict): everything else the translation depends on, must be json serializable
+        """
+        digest = hashlib.sha256(version.encode() + b"\0")
+        digest.update(json.dumps([os.path.basename(file_path), options], sort_keys=True).encode() + b"\0")
+        with open(file_path, "rb") as file:
+            for chunk in iter(lambda: file.read(1 << 16), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def load(self, key):
+        """
+        returns the fragment stored under key or None on a miss
+        a hit marks the entry as most recently used
+        """
+        path = os.path.join(self.directory, key + ".json")
+        try:
+            with open(path, "r") as file:
+                fragment = json.load(file)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        os.utime(path)
+        self.hits += 1
+        return fragment
+
+    def store(self, key, fragment, evict=True):
+        """
+        stores a translated fragment under key
+        then evicts least recently used entries until the cache fits in max_bytes
+        @param fragment: the json serializable translation of one file
+        @param evict(bool): False to leave eviction to a later evict call after storing many fragments
+        """
+        path = os.path.join(self.directory, key + ".json")
+        # write to a temporary name first so a concurrent reader never sees half an entry
+        with open(path + ".tmp", "w") as file:
+            json.dump(fragment, file)
+        os.replace(path + ".tmp", path)
+        if evict:
+            self.evict()
+
+    def entries(self):
+        """
+        returns a dict of key to (last use, size in bytes) of every entry
+        """
+        entries = {}
+        for name in os.listdir(self.directory):
+            key, ext = os.path.splitext(name)
+            if ext == ".json":
+                stat = os.stat(os.path.join(self.directory, name))
+                entries[key] = (stat.st_mtime, stat.st_size)
+        return entries
+
+    def size(self):
+        """
+        returns the total size of the entries in bytes
+        """
+        return sum(size for _, size in self.entries().values())
+
+    def evict(self):
+        """
+        removes least recently used entries until the total size is within max_bytes
+        """
+        entries = self.entries()
+        total = sum(size for _, size in entries.values())
+        for key in sorted(entries, key=lambda key: entries[key][0]):
+            if total <= self.max_bytes:
+                break
+            self.remove(key)
+            self.evictions += 1
+            total -= entries[key][1]
+
+    def remove(self, key):
+        """
+        deletes one entry
+        """
+        try:
+            os.remove(os.path.join(self.directory, key + ".json"))
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        """
+        deletes every entry in the cache
+        """
+        for key in self.entries():
+            self.remove(key)
@@ -0,0 +1,290 @@
+"""
+Python implementations of hot OS routines for VMEmulator.
+
+Each builtin mirrors the body of the tools/OS function it replaces, with the same 16-bit
+arithmetic and the same wrapped comparisons as the translated code, so every word of RAM the
+caller can observe ends up identical: the return value, statics, the heap, the screen and
+temp 0. Only the dead stack above SP differs because no frame is built.
+
+A builtin takes the emulator and the list of argument words and returns the result word.
+Returning None means "run the VM body instead", which builtins do for the Sys.error paths
+and whenever the OS has not been initialised yet, so errors keep their exact VM behaviour.
+"""
+
+WORD = 0xFFFF
+
+# function name -> (builtin, OS classes whose VM code the original calls)
+BUILTINS = {}
+
+
+def builtin(name, uses=()):
+    """
+    registers the decorated function as the builtin for the vm function name
+    it is only bound when the function and every class in uses are loaded from the OS directory
+    """
+
+    def register(function):
+        BUILTINS[name] = (function, tuple(uses))
+        return function
+
+    return register
+
+
+def _lt(x, y):
+    """
+    lt of the translated code: x-y in 16 bits is negative
+    """
+    return (x - y) & WORD >= 0x8000
+
+
+def _gt(x, y):
+    """
+    gt of the translated code: x-y in 16 bits is positive
+    """
+    return 0 < (x - y) & WORD < 0x8000
+
+
+def _abs(x):
+    """
+    Math.abs on a 16-bit word, abs(-32768) stays -32768
+    """
+    x &= WORD
+    return -x & WORD if x & 0x8000 else x
+
+
+@builtin("Math.multiply")
+def mathMultiply(vm, args):
+    # the shift and add loop always ends with the product modulo 2^16
+    if not vm.ram[vm.statics["Math.0"]]:
+        return None
+    x, y = args
+    return (x * y) & WORD
+
+
+@builtin("Math.divide")
+def mathDivide(vm, args):
+    # doubles abs(y) into Math's static 1 array, then subtracts the multiples back from abs(x)
+    ram = vm.ram
+    powers = ram[vm.statics["Math.0"]]
+    multiples = ram[vm.statics["Math.1"]]
+    x, y = args
+    if y == 0 or not powers:
+        return None
+    negative = (_lt(x, 0) and _gt(y, 0)) or (_gt(x, 0) and _lt(y, 0))
+    temp = ram[multiples] = _abs(y)
+    x = _abs(x)
+    i = 0
+    overflow = False
+    while _lt(i, 15) and not overflow:
+        multiple = ram[(multiples + i) & WORD]
+        overflow = _lt(32767 - (multiple - 1), multiple - 1)
+        if not overflow:
+            temp = ram[(multiples + i + 1) & WORD] = (multiple + multiple) & WORD
+            overflow = _gt(temp - 1, x - 1)
+            if not overflow:
+                i += 1
+    quotient = 0
+    while _gt(i, -1):
+        multiple = ram[(multiples + i) & WORD]
+        if not _gt(multiple - 1, x - 1):
+            quotient += ram[(powers + i) & WORD]
+            x -= multiple
+        i -= 1
+    ram[5] = temp
+    return -quotient & WORD if negative else quotient & WORD
+
+
+@builtin("Memory.alloc")
+def memoryAlloc(vm, args):
+    # first fit over the free list, merging neighbouring free segments on the way
+    # the merges happen before the out of memory check, so they are undone when it fails
+    ram = vm.ram
+    size = args[0]
+    if _lt(size, 0):
+        return None
+    if size == 0:
+        size = 1
+    undo = []
+    segment = 2048
+    while _lt(segment, 16383) & _lt(ram[segment], size):
+        following = ram[(segment + 1) & WORD]
+        if ram[segment] == 0 or _gt(following, 16382) or ram[following] == 0:
+            segment = following
+            continue
+        undo.append((segment, ram[segment]))
+        ram[segment] = (following - segment + ram[following]) & WORD
+        link = (segment + 1) & WORD
+        undo.append((link, ram[link]))
+        if ram[(following + 1) & WORD] == (following + 2) & WORD:
+            ram[link] = (segment + 2) & WORD
+        else:
+            ram[link] = ram[(following + 1) & WORD]
+    if _gt(segment + size, 16379):
+        for address, value in reversed(undo):
+            ram[address] = value
+        return None
+    if _gt(ram[segment], size + 2):
+        ram[(segment + size + 2) & WORD] = (ram[segment] - size - 2) & WORD
+        if ram[(segment + 1) & WORD] == (segment + 2) & WORD:
+            ram[(segment + size + 3) & WORD] = (segment + size + 4) & WORD
+        else:
+            ram[(segment + size + 3) & WORD] = ram[(segment + 1) & WORD]
+        ram[(segment + 1) & WORD] = (segment + size + 2) & WORD
+    ram[segment] = 0
+    ram[5] = 0
+    return (segment + 2) & WORD
+
+
+def _screenUpdate(vm, ram, address, mask):
+    """
+    Screen.updateLocation: sets or clears the mask bits of a screen word in the current color
+    """
+    address = (address + ram[vm.statics["Screen.1"]]) & WORD
+    if ram[vm.statics["Screen.2"]]:
+        ram[address] |= mask
+    else:
+        ram[address] &= ~mask & WORD
+
+
+@builtin("Screen.drawLine", uses=["Math"])
+def screenDrawLine(vm, args):
+    # Bresenham along the longer axis, every pixel is checked before the first one is drawn
+    # because drawPixel stops with an error in the middle of the line in the VM code
+    ram = vm.ram
+    bits = ram[vm.statics["Screen.0"]]
+    x1, y1, x2, y2 = args
+    if _lt(x1, 0) or _gt(x2, 511) or _lt(y1, 0) or _gt(y2, 255) or not bits:
+        return None
+    dx = _abs(x2 - x1)
+    dy = _abs(y2 - y1)
+    steep = _lt(dx, dy)
+    if (steep and _lt(y2, y1)) or (not steep and _lt(x2, x1)):
+        x1, y1, x2, y2 = x2, y2, x1, y1
+    if steep:
+        dx, dy = dy, dx
+        a, b, end, down = y1, x1, y2, _gt(x1, x2)
+    else:
+        a, b, end, down = x1, y1, x2, _gt(y1, y2)
+    error = 2 * dy - dx
+    pixels = [(b, a) if steep else (a, b)]
+    while _lt(a, end):
+        if _lt(error, 0):
+            error += 2 * dy
+        else:
+            error += 2 * (dy - dx)
+            b = b - 1 if down else b + 1
+        a += 1
+        pixels.append((b, a) if steep else (a, b))
+    for x, y in pixels:
+        if _lt(x, 0) or _gt(x, 511) or _lt(y, 0) or _gt(y, 255):
+            return None
+    # drawPixel divides x by 16, which fills Math's array of multiples as far as the largest x needs
+    if mathDivide(vm, [max(x & WORD for x, _ in pixels), 16]) is None:
+        return None
+    for x, y in pixels:
+        x &= WORD
+        _screenUpdate(vm, ram, (y & WORD) * 32 + (x >> 4), ram[bits + (x & 15)])
+    ram[5] = 0
+    return 0
+
+
+@builtin("Screen.drawRectangle", uses=["Math"])
+def screenDrawRectangle(vm, args):
+    # full words in between the partial first and last word of each row
+    ram = vm.ram
+    bits = ram[vm.statics["Screen.0"]]
+    x1, y1, x2, y2 = args
+    if _gt(x1, x2) or _gt(y1, y2) or _lt(x1, 0) or _gt(x2, 511) or _lt(y1, 0) or _gt(y2, 255) or not bits:
+        return None
+    first = mathDivide(vm, [x1, 16])
+    last = mathDivide(vm, [x2, 16])
+    if first is None or last is None:
+        return None
+    first_mask = ~(ram[bits + x1 - first * 16] - 1) & WORD
+    last_mask = (ram[bits + x2 - last * 16 + 1] - 1) & WORD
+    words = last - first
+    address = y1 * 32 + first
+    for _ in range(y1, y2 + 1):
+        end = address + words
+        if words == 0:
+            _screenUpdate(vm, ram, address, last_mask & first_mask)
+        else:
+            _screenUpdate(vm, ram, address, first_mask)
+            for full in range(address + 1, end):
+                _screenUpdate(vm, ram, full, WORD)
+            _screenUpdate(vm, ram, end, last_mask)
+        address = end + 32 - words
+    ram[5] = 0
+    return 0
+
+
+def _outputDrawChar(ram, statics, character):
+    """
+    Output.drawChar: draws the bitmap of the character in the half word at the cursor
+    """
+    if _lt(character, 32) or _gt(character, 126):
+        character = 0
+    left = ram[statics[2]]
+    bitmap = ram[(ram[statics[5] if left else statics[6]] + character) & WORD]
+    keep = 0xFF00 if left else 0x00FF
+    screen = ram[statics[4]]
+    location = ram[statics[1]]
+    for row in range(11):
+        address = (location + screen) & WORD
+        ram[address] = ram[(bitmap + row) & WORD] | (ram[address] & keep)
+        location += 32
+
+
+def _outputPrintln(ram, statics):
+    """
+    Output.println: moves the cursor to the start of the next line, back to the top after the last
+    """
+    ram[statics[1]] = (ram[statics[1]] + 352 - ram[statics[0]]) & WORD
+    ram[statics[0]] = 0
+    ram[statics[2]] = WORD
+    if ram[statics[1]] == 8128:
+        ram[statics[1]] = 32
+
+
+def _outputBackSpace(ram, statics):
+    """
+    Output.backSpace: moves the cursor one character back and erases it
+    """
+    if ram[statics[2]]:
+        if _gt(ram[statics[0]], 0):
+            ram[statics[0]] = (ram[statics[0]] - 1) & WORD
+            ram[statics[1]] = (ram[statics[1]] - 1) & WORD
+        else:
+            ram[statics[0]] = 31
+            if ram[statics[1]] == 32:
+                ram[statics[1]] = 8128
+            ram[statics[1]] = (ram[statics[1]] - 321) & WORD
+        ram[statics[2]] = 0
+    else:
+        ram[statics[2]] = WORD
+    _outputDrawChar(ram, statics, 32)
+
+
+@builtin("Output.printChar", uses=["String"])
+def outputPrintChar(vm, args):
+    # static 0 is the cursor column pair, 1 its screen word, 2 whether it is in the left half
+    ram = vm.ram
+    statics = [vm.statics["Output." + str(index)] for index in range(7)]
+    if not ram[statics[5]]:
+        return None
+    character = args[0]
+    if character == 128:
+        _outputPrintln(ram, statics)
+    elif character == 129:
+        _outputBackSpace(ram, statics)
+    else:
+        _outputDrawChar(ram, statics, character)
+        if ~ram[statics[2]] & WORD:
+            ram[statics[0]] = (ram[statics[0]] + 1) & WORD
+            ram[statics[1]] = (ram[statics[1]] + 1) & WORD
+        if ram[statics[0]] == 32:
+            _outputPrintln(ram, statics)
+        else:
+            ram[statics[2]] = ~ram[statics[2]] & WORD
+    ram[5] = 0
+    return 0
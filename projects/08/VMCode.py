@@ -0,0 +1,183 @@
+import os
+import time
+import argparse
+from array import array
+
+"""
+Compact form of vm code shared by the translator, its optimizations and the emulator: every
+command is decoded once into an opcode, an interned name id and an integer value kept in
+parallel arrays, instead of splitting the command text again for each question asked about it
+"""
+
+# opcodes, the arithmetic commands first in the order of ARITHMETIC_COMMANDS
+ADD, SUB, NEG, EQ, GT, LT, AND, OR, NOT = range(9)
+PUSH, POP, LABEL, GOTO, IF_GOTO, FUNCTION, CALL, RETURN = range(9, 17)
+
+ARITHMETIC_COMMANDS = ["add", "sub", "neg", "eq", "gt", "lt", "and", "or", "not"]
+KEYWORDS = {
+    "push": PUSH,
+    "pop": POP,
+    "label": LABEL,
+    "goto": GOTO,
+    "if-goto": IF_GOTO,
+    "function": FUNCTION,
+    "call": CALL,
+}
+# Parser.commandType of each opcode
+COMMAND_TYPES = ["C_ARITHMETIC"] * 9 + ["C_PUSH", "C_POP", "C_LABEL", "C_GOTO", "C_IF", "C_FUNCTION", "C_CALL", "C_RETURN"]
+
+# the segments are the first names interned, so their ids are the same in every VMCode
+SEGMENTS = ["constant", "local", "argument", "this", "that", "static", "temp", "pointer"]
+CONSTANT, LOCAL, ARGUMENT, THIS, THAT, STATIC, TEMP, POINTER = range(8)
+NO_NAME = -1
+
+
+class VMCode:
+    """
+    Decoded vm commands in parallel arrays, command i is (ops[i], args[i], values[i]):
+    - arithmetic and return: the opcode alone, args NO_NAME and values 0
+    - push and pop: args the segment id, values the index
+    - label, goto and if-goto: args the label name id
+    - function and call: args the function name id, values the number of locals or arguments
+    """
+
+    def __init__(self, file_path=None):
+        """
+        starts empty or with the commands of a .vm file
+        @param file_path(str): path to a .vm file to load
+        """
+        self.ops = array("B")
+        self.args = array("i")
+        self.values = array("i")
+        self.names = list(SEGMENTS)
+        self.name_ids = {name: id for id, name in enumerate(self.names)}
+        self.decoded = {}  # command text -> (op, arg, value), most commands repeat
+        if file_path is not None:
+            self.load(file_path)
+
+    def __len__(self):
+        return len(self.ops)
+
+    def load(self, file_path):
+        """
+        appends the commands of a .vm file, discarding comments, empty lines and surrounding whitespace
+        """
+        decoded = self.decoded
+        ops, args, values = self.ops, self.args, self.values
+        with open(file_path, "r") as file:
+            for line in file:
+                line = line.partition("//")[0].strip()
+                if not line:
+                    continue
+                command = decoded.get(line)
+                if command is None:
+                    command = decoded[line] = self.decode(line)
+                op, arg, value = command
+                ops.append(op)
+                args.append(arg)
+                values.append(value)
+
+    def decode(self, line):
+        """
+        returns the (op, arg, value) of one command, interning its name
+        """
+        words = line.split()
+        if len(words) == 1:
+            if words[0] == "return":
+                return RETURN, NO_NAME, 0
+            return ARITHMETIC_COMMANDS.index(words[0]), NO_NAME, 0
+        return KEYWORDS[words[0]], self.intern(words[1]), int(words[2]) if len(words) > 2 else 0
+
+    def intern(self, name):
+        """
+        returns the id of a segment, label or function name, adding it if it is new
+        """
+        id = self.name_ids.get(name)
+        if id is None:
+            id = self.name_ids[name] = len(self.names)
+            self.names.append(name)
+        return id
+
+    def command(self, index):
+        """
+        returns command index as (op, name or None, value)
+        """
+        arg = self.args[index]
+        return self.ops[index], self.names[arg] if arg != NO_NAME else None, self.values[index]
+
+    def keep(self, indices):
+        """
+        keeps only the commands at the given indices, in their order
+        """
+        self.ops = array("B", (self.ops[index] for index in indices))
+        self.args = array("i", (self.args[index] for index in indices))
+        self.values = array("i", (self.values[index] for index in indices))
+
+
+def splitEveryTime(file_path):
+    """
+    reads a .vm file the way Parser did before VMCode: each command kept as text and split again
+    by commandType, arg1 and arg2, returns the number of commands
+    """
+    commands = []
+    with open(file_path, "r") as file:
+        for line in file:
+            line = line.partition("//")[0].strip()
+            if line:
+                commands.append(line)
+    for command in commands:
+        arithmetic = len(command.split(" ")) == 1  # commandType
+        arithmetic = len(command.split(" ")) == 1  # arg1 asks commandType again
+        if arithmetic:
+            command.split(" ")[0]
+        else:
+            command.split(" ")[1]
+            if command[0] in "pfc":  # push, pop, function and call also ask arg2
+                int(command.split(" ")[2])
+    return len(commands)
+
+
+def decodeOnce(file_path):
+    """
+    reads a .vm file into a VMCode and walks its arrays the way the translator does, returns the number of commands
+    """
+    code = VMCode(file_path)
+    names = code.names
+    for op, arg, value in zip(code.ops, code.args, code.values):
+        COMMAND_TYPES[op]
+        if arg != NO_NAME:
+            names[arg]
+    return len(code)
+
+
+def main():
+    """
+    Benchmark of parse throughput, by default on the largest .vm files of the repository
+    """
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+    arg_parser = argparse.ArgumentParser(description="Compare parsing .vm files as text with decoding them into a VMCode")
+    arg_parser.add_argument("files", nargs="*", help=".vm files, defaults to the 5 largest in the repository")
+    arg_parser.add_argument("--seconds", type=float, default=0.5, help="time spent on each file and method")
+    args = arg_parser.parse_args()
+
+    files = args.files
+    if not files:
+        found = []
+        for directory, _, names in os.walk(root):
+            found += [os.path.join(directory, name) for name in names if name[-3:] == ".vm"]
+        files = sorted(found, key=os.path.getsize, reverse=True)[:5]
+    for file in files:
+        results = []
+        for method in [splitEveryTime, decodeOnce]:
+            runs = 0
+            start = time.perf_counter()
+            while time.perf_counter() - start < args.seconds:
+                n_commands = method(file)
+                runs += 1
+            results.append(n_commands * runs / (time.perf_counter() - start))
+        print("{}: {} commands, split every time {:.0f} commands/s, decoded once {:.0f} commands/s, {:.2f}x".format(
+            os.path.relpath(file, root), n_commands, results[0], results[1], results[1] / results[0]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,528 @@
+import os
+import argparse
+from VMCode import VMCode, COMMAND_TYPES, ARITHMETIC_COMMANDS, NO_NAME
+from VMBuiltins import BUILTINS
+
+# decoded vm command opcodes
+PUSH_CONSTANT = 0   # x = value
+PUSH_SEGMENT = 1    # x = base pointer address (LCL, ARG, THIS, THAT), y = index
+PUSH_ADDRESS = 2    # x = fixed RAM address (static, temp, pointer)
+POP_SEGMENT = 3
+POP_ADDRESS = 4
+ADD = 5
+SUB = 6
+NEG = 7
+EQ = 8
+GT = 9
+LT = 10
+AND = 11
+OR = 12
+NOT = 13
+GOTO = 14           # x = target command index
+IF_GOTO = 15
+FUNCTION = 16       # x = number of local variables, y = 1 for the halt function
+CALL = 17           # x = target command index, y = number of arguments
+RETURN = 18
+NATIVE = 19         # call of a builtin, x = index in natives, y = number of arguments
+
+RAM_SIZE = 32768
+HALT_FUNCTION = "Sys.halt"  # calling it ends the program, its body is an endless loop
+DEFAULT_OS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "tools", "OS")
+
+
+class VMEmulator:
+    """
+    Runs vm commands directly on an emulated Hack RAM without translating them to assembly.
+    The memory layout is the one CodeWriter produces: SP, LCL, ARG, THIS and THAT in RAM[0..4],
+    pointer at RAM[3..4], temp at RAM[5..12], statics allocated from RAM[16] in order of first
+    use, the stack from RAM[256] and call frames saved exactly like writeCall and writeReturn.
+    The return address saved in a frame is a vm command index instead of a ROM address.
+    Calls of the OS functions listed in VMBuiltins.py run their Python builtin instead of the VM
+    code, which only changes the step count and the dead stack above SP.
+    """
+
+    def __init__(self, blocks=False, builtins=BUILTINS):
+        """
+        sets up empty RAM and an empty program
+        @param blocks(bool): execute blocks of commands compiled to Python functions instead of
+                             interpreting one command at a time
+        @param builtins(dict): function name -> (builtin, classes it uses), see VMBuiltins.py
+                               None runs every OS function from its VM code
+        """
+        self.ram = [0] * RAM_SIZE
+        self.use_blocks = blocks
+        self.builtins = builtins or {}
+        self.natives = []  # (builtin, command index of the VM function) of each bound builtin
+        self.os_classes = set()
+        self.blocks = {}
+        self.commands = []
+        self.names = []  # function name of each command, for error messages
+        self.functions = {}
+        self.labels = {}
+        self.statics = {}
+        self.calls = []  # (command index, function name) of calls to resolve once all files are loaded
+        self.gotos = []  # (command index, label name) likewise
+        self.pc = 0
+        self.halted = False
+        self.steps = 0
+
+    def loadFile(self, file_path):
+        """
+        decodes the VMCode of a .vm file into (opcode, x, y) tuples with the segments and targets resolved
+        labels take the index of the next command, targets are resolved by resolve()
+        """
+        file_name = os.path.basename(file_path)[:-3]
+        function_name = ""
+        code = VMCode(file_path)
+        for op, arg, value in zip(code.ops, code.args, code.values):
+            type = COMMAND_TYPES[op]
+            name = code.names[arg] if arg != NO_NAME else None
+            index = len(self.commands)
+            if type == "C_ARITHMETIC":
+                command = (ARITHMETIC[ARITHMETIC_COMMANDS[op]], 0, 0)
+            elif type in ["C_PUSH", "C_POP"]:
+                command = self._decodePushPop(type, name, value, file_name)
+            elif type == "C_LABEL":
+                self.labels[function_name + "$" + name] = index
+                continue
+            elif type in ["C_GOTO", "C_IF"]:
+                self.gotos.append((index, function_name + "$" + name))
+                command = (GOTO if type == "C_GOTO" else IF_GOTO, None, 0)
+            elif type == "C_FUNCTION":
+                function_name = name
+                self.functions[function_name] = index
+                command = (FUNCTION, value, int(function_name == HALT_FUNCTION))
+            elif type == "C_CALL":
+                self.calls.append((index, name))
+                command = (CALL, None, value)
+            elif type == "C_RETURN":
+                command = (RETURN, 0, 0)
+            self.commands.append(command)
+            self.names.append(function_name)
+
+    def loadProgram(self, path, os_path=DEFAULT_OS):
+        """
+        loads a .vm file or every .vm file of a directory, plus the OS classes it does not define itself
+        files are taken in the same order as the translator's main()
+        @param os_path(str): directory of OS .vm files, None to load the program alone
+        """
+        files = []
+        if os.path.isdir(path):
+            files = [os.path.join(path, file) for file in os.listdir(path) if file[-3:] == ".vm"]
+        else:
+            files = [path]
+        if os_path is not None:
+            defined = set(os.path.basename(file) for file in files)
+            os_files = [file for file in os.listdir(os_path) if file[-3:] == ".vm" and file not in defined]
+            self.os_classes.update(file[:-3] for file in os_files)
+            files += [os.path.join(os_path, file) for file in os_files]
+        for file in files:
+            self.loadFile(file)
+        self.resolve()
+
+    def resolve(self):
+        """
+        fills in the target command index of every goto, if-goto and call
+        calls of OS functions with a builtin become native calls, as long as the function and
+        the classes its VM code calls were loaded from the OS directory and not from the program
+        """
+        for index, label in self.gotos:
+            op, _, _ = self.commands[index]
+            assert label in self.labels, "unknown label " + label
+            self.commands[index] = (op, self.labels[label], 0)
+        bound = {}
+        for function_name, (function, uses) in self.builtins.items():
+            classes = [function_name.split(".")[0]] + list(uses)
+            if function_name in self.functions and self.os_classes.issuperset(classes):
+                bound[function_name] = len(self.natives)
+                self.natives.append((function, self.functions[function_name]))
+        for index, function_name in self.calls:
+            _, _, n_args = self.commands[index]
+            assert function_name in self.functions, "call to undefined function " + function_name
+            if function_name in bound:
+                self.commands[index] = (NATIVE, bound[function_name], n_args)
+            else:
+                self.commands[index] = (CALL, self.functions[function_name], n_args)
+        self.gotos = []
+        self.calls = []
+        # compiled blocks belong to the old program
+        self.blocks = {}
+
+    def bootstrap(self, function_name="Sys.init"):
+        """
+        SP = 256 and call Sys.init, as the translator's bootstrap code does
+        returning from Sys.init would end the program
+        """
+        self.ram[0] = 256
+        self.pc = self._call(self.functions[function_name], 0, len(self.commands))
+        self.halted = False
+
+    def run(self, steps=None):
+        """
+        executes vm commands until the step budget is spent or the program halts
+        the program halts when Sys.halt is entered, in a goto to itself or when it returns past the last command
+        @param steps(int): maximum number of vm commands to execute, None to run until halted
+        returns the number of commands executed
+        """
+        if self.use_blocks:
+            return self.runBlocks(steps)
+        return self.interpret(steps)
+
+    def interpret(self, steps=None):
+        """
+        dispatch loop over the decoded commands, one command at a time
+        @param steps(int): maximum number of vm commands to execute, None to run until halted
+        returns the number of commands executed
+        """
+        ram = self.ram
+        commands = self.commands
+        size = len(commands)
+        pc = self.pc
+        executed = 0
+        limit = -1 if steps is None else steps
+        while executed != limit:
+            if pc >= size:
+                self.halted = True
+                break
+            op, x, y = commands[pc]
+            executed += 1
+            pc += 1
+            if op == PUSH_SEGMENT:
+                sp = ram[0]
+                ram[sp] = ram[(ram[x] + y) & 0xFFFF]
+                ram[0] = sp + 1
+            elif op == PUSH_CONSTANT:
+                sp = ram[0]
+                ram[sp] = x
+                ram[0] = sp + 1
+            elif op == POP_SEGMENT:
+                sp = ram[0] - 1
+                ram[0] = sp
+                ram[(ram[x] + y) & 0xFFFF] = ram[sp]
+            elif op == PUSH_ADDRESS:
+                sp = ram[0]
+                ram[sp] = ram[x]
+                ram[0] = sp + 1
+            elif op == POP_ADDRESS:
+                sp = ram[0] - 1
+                ram[0] = sp
+                ram[x] = ram[sp]
+            elif op == ADD:
+                sp = ram[0] - 1
+                ram[0] = sp
+                ram[sp-1] = (ram[sp-1] + ram[sp]) & 0xFFFF
+            elif op == SUB:
+                sp = ram[0] - 1
+                ram[0] = sp
+                ram[sp-1] = (ram[sp-1] - ram[sp]) & 0xFFFF
+            elif op == IF_GOTO:
+                sp = ram[0] - 1
+                ram[0] = sp
+                if ram[sp]:
+                    pc = x
+            elif op == GOTO:
+                # a goto to itself is an end of program loop
+                if x == pc - 1:
+                    self.halted = True
+                    pc = x
+                    break
+                pc = x
+            elif op == CALL:
+                pc = self._call(x, y, pc)
+            elif op == NATIVE:
+                function, target = self.natives[x]
+                sp = ram[0] - y
+                value = function(self, ram[sp:sp+y])
+                if value is None:
+                    pc = self._call(target, y, pc)
+                else:
+                    ram[sp] = value
+                    ram[0] = sp + 1
+            elif op == FUNCTION:
+                if y:
+                    self.halted = True
+                    pc -= 1
+                    break
+                sp = ram[0]
+                for i in range(x):
+                    ram[sp+i] = 0
+                ram[0] = sp + x
+            elif op == RETURN:
+                frame = ram[1]
+                pc = ram[frame-5]
+                ram[ram[2]] = ram[ram[0]-1]
+                ram[0] = ram[2] + 1
+                ram[4] = ram[frame-1]
+                ram[3] = ram[frame-2]
+                ram[2] = ram[frame-3]
+                ram[1] = ram[frame-4]
+            elif op == NOT:
+                sp = ram[0] - 1
+                ram[sp] ^= 0xFFFF
+            elif op == NEG:
+                sp = ram[0] - 1
+                ram[sp] = -ram[sp] & 0xFFFF
+            elif op == AND:
+                sp = ram[0] - 1
+                ram[0] = sp
+                ram[sp-1] &= ram[sp]
+            elif op == OR:
+                sp = ram[0] - 1
+                ram[0] = sp
+                ram[sp-1] |= ram[sp]
+            else:
+                # eq, gt and lt test x-y in 16 bits exactly like the translated D=M-D; D;Jxx
+                sp = ram[0] - 1
+                ram[0] = sp
+                difference = (ram[sp-1] - ram[sp]) & 0xFFFF
+                if op == EQ:
+                    result = difference == 0
+                elif op == GT:
+                    result = 0 < difference < 0x8000
+                else:
+                    result = difference >= 0x8000
+                ram[sp-1] = 0xFFFF if result else 0
+        self.pc = pc
+        self.steps += executed
+        return executed
+
+    def runBlocks(self, steps=None):
+        """
+        executes compiled blocks, compiling each the first time execution reaches its command
+        when the next block could overrun the step budget the interpreter finishes the run
+        @param steps(int): maximum number of vm commands to execute, None to run until halted
+        returns the number of commands executed
+        """
+        ram = self.ram
+        blocks = self.blocks
+        size = len(self.commands)
+        pc = self.pc
+        executed = 0
+        while True:
+            if pc >= size:
+                self.halted = True
+                break
+            block = blocks.get(pc)
+            if block is None:
+                block = blocks[pc] = self._compileBlock(pc)
+            function, longest = block
+            if steps is not None and executed + longest > steps:
+                break
+            pc, count = function(ram)
+            executed += count
+            # negative indexes mark a halt, ~pc is the command the program halted on
+            if pc < 0:
+                self.halted = True
+                pc = ~pc
+                break
+        self.pc = pc
+        self.steps += executed
+        if steps is not None and not self.halted and executed < steps:
+            executed += self.interpret(steps - executed)
+        return executed
+
+    def _compileBlock(self, start, max_length=16):
+        """
+        compiles the commands reached from start into one Python function
+        the block follows gotos and calls whose target is known and leaves through a side
+        exit on a taken if-goto, at a return or after max_length commands. SP is kept in a
+        local and stack slots are addressed with offsets known at compile time, it is written
+        back to RAM[0] at every exit (and read back if the program writes RAM[0] itself)
+        returns (function(ram) -> (next command index, commands executed), longest path)
+        """
+        size = len(self.commands)
+        lines = ["sp = ram[0]"]
+        visited = set()
+        k = 0  # SP - sp
+        count = 0
+        pc = start
+
+        def slot(offset):
+            if offset == 0:
+                return "ram[sp]"
+            return "ram[sp {} {}]".format("+" if offset > 0 else "-", abs(offset))
+
+        def leave(next_pc, indent=""):
+            lines.append(indent + "ram[0] = " + slot(k)[4:-1])
+            lines.append(indent + "return {}, {}".format(next_pc, count))
+
+        while True:
+            if pc >= size or pc in visited or count >= max_length:
+                leave(pc)
+                break
+            visited.add(pc)
+            op, x, y = self.commands[pc]
+            count += 1
+            pc += 1
+            if op == PUSH_CONSTANT:
+                lines.append("{} = {}".format(slot(k), x))
+                k += 1
+            elif op == PUSH_ADDRESS:
+                lines.append("{} = ram[{}]".format(slot(k), x))
+                k += 1
+            elif op == POP_ADDRESS:
+                k -= 1
+                lines.append("ram[{}] = {}".format(x, slot(k)))
+            elif op == PUSH_SEGMENT:
+                lines.append("a = (ram[{}] + {}) & 65535".format(x, y))
+                lines.append("{} = ram[a] if a else {}".format(slot(k), slot(k)[4:-1]))
+                k += 1
+            elif op == POP_SEGMENT:
+                k -= 1
+                lines.append("a = (ram[{}] + {}) & 65535".format(x, y))
+                lines.append("if a:")
+                lines.append("    ram[a] = " + slot(k))
+                lines.append("else:")
+                lines.append("    sp = {} - ({})".format(slot(k), k))
+            elif op in (ADD, SUB):
+                k -= 1
+                lines.append("{0} = ({0} {1} {2}) & 65535".format(slot(k-1), "+" if op == ADD else "-", slot(k)))
+            elif op in (AND, OR):
+                k -= 1
+                lines.append("{} {}= {}".format(slot(k-1), "&" if op == AND else "|", slot(k)))
+            elif op == NEG:
+                lines.append("{0} = -{0} & 65535".format(slot(k-1)))
+            elif op == NOT:
+                lines.append("{} ^= 65535".format(slot(k-1)))
+            elif op in (EQ, GT, LT):
+                k -= 1
+                lines.append("v = ({} - {}) & 65535".format(slot(k-1), slot(k)))
+                condition = {EQ: "v == 0", GT: "0 < v < 32768", LT: "v > 32767"}[op]
+                lines.append("{} = 65535 if {} else 0".format(slot(k-1), condition))
+            elif op == IF_GOTO:
+                k -= 1
+                lines.append("if {}:".format(slot(k)))
+                leave(x, "    ")
+            elif op == GOTO:
+                if x == pc - 1:
+                    leave(~x)
+                    break
+                pc = x
+            elif op == CALL:
+                # save the caller's frame like writeCall, then continue in the callee
+                lines.append("{} = {}".format(slot(k), pc))
+                for i in range(1, 5):
+                    lines.append("{} = ram[{}]".format(slot(k+i), i))
+                lines.append("ram[2] = " + slot(k-y)[4:-1])
+                lines.append("ram[1] = " + slot(k+5)[4:-1])
+                k += 5
+                pc = x
+            elif op == NATIVE:
+                # the builtin's result replaces the arguments, or the VM function is called after all
+                lines.append("value = natives[{}][0](vm, ram[{}:{}])".format(x, slot(k-y)[4:-1], slot(k)[4:-1]))
+                lines.append("if value is None:")
+                lines.append("    {} = {}".format(slot(k), pc))
+                for i in range(1, 5):
+                    lines.append("    {} = ram[{}]".format(slot(k+i), i))
+                lines.append("    ram[2] = " + slot(k-y)[4:-1])
+                lines.append("    ram[0] = ram[1] = " + slot(k+5)[4:-1])
+                lines.append("    return {}, {}".format(self.natives[x][1], count))
+                lines.append("{} = value".format(slot(k-y)))
+                k += 1 - y
+            elif op == FUNCTION:
+                if y:
+                    leave(~(pc - 1))
+                    break
+                for i in range(x):
+                    lines.append("{} = 0".format(slot(k+i)))
+                k += x
+            elif op == RETURN:
+                # the return address is read first, a call without arguments stores the return value over it
+                lines.append("frame = ram[1]")
+                lines.append("address = ram[frame-5]")
+                lines.append("ram[ram[2]] = " + slot(k-1))
+                lines.append("ram[0] = ram[2] + 1")
+                lines.append("ram[4] = ram[frame-1]")
+                lines.append("ram[3] = ram[frame-2]")
+                lines.append("ram[2] = ram[frame-3]")
+                lines.append("ram[1] = ram[frame-4]")
+                lines.append("return address, {}".format(count))
+                break
+        source = "def block(ram):\n    " + "\n    ".join(lines) + "\n"
+        namespace = {"vm": self, "natives": self.natives}
+        exec(compile(source, "<vm block {}>".format(start), "exec"), namespace)
+        return namespace["block"], count
+
+    def _call(self, target, n_args, return_address):
+        """
+        saves the caller's frame like writeCall and returns the index of the callee
+        """
+        ram = self.ram
+        sp = ram[0]
+        ram[sp] = return_address
+        ram[sp+1] = ram[1]
+        ram[sp+2] = ram[2]
+        ram[sp+3] = ram[3]
+        ram[sp+4] = ram[4]
+        ram[0] = sp + 5
+        ram[2] = sp - n_args
+        ram[1] = sp + 5
+        return target
+
+    def _decodePushPop(self, type, segment, index, file_name):
+        """
+        returns the decoded tuple of a push or pop command
+        """
+        if segment == "constant":
+            return (PUSH_CONSTANT, index, 0)
+        if segment in SEGMENT_POINTERS:
+            return (PUSH_SEGMENT if type == "C_PUSH" else POP_SEGMENT, SEGMENT_POINTERS[segment], index)
+        if segment == "static":
+            name = file_name + "." + str(index)
+            if name not in self.statics:
+                self.statics[name] = 16 + len(self.statics)
+            address = self.statics[name]
+        else:
+            address = SEGMENT_BASES[segment] + index
+        return (PUSH_ADDRESS if type == "C_PUSH" else POP_ADDRESS, address, 0)
+
+    def peek(self, address):
+        """
+        returns the RAM value at address as a signed 16-bit integer
+        """
+        value = self.ram[address]
+        return value - 0x10000 if value & 0x8000 else value
+
+
+ARITHMETIC = {
+    "add": ADD,
+    "sub": SUB,
+    "neg": NEG,
+    "eq": EQ,
+    "gt": GT,
+    "lt": LT,
+    "and": AND,
+    "or": OR,
+    "not": NOT,
+}
+SEGMENT_POINTERS = {"local": 1, "argument": 2, "this": 3, "that": 4}
+SEGMENT_BASES = {"pointer": 3, "temp": 5}
+
+
+def main():
+    """
+    Runs a vm program without translating it.
+    """
+    arg_parser = argparse.ArgumentParser(description="Run vm code directly on an emulated Hack RAM")
+    arg_parser.add_argument("path", help="a .vm file or a directory of .vm files")
+    arg_parser.add_argument("--os", default=DEFAULT_OS, help="directory of OS .vm files added for classes the program does not define")
+    arg_parser.add_argument("--no-os", action="store_true", help="run the program without the OS")
+    arg_parser.add_argument("--blocks", action="store_true", help="compile blocks of commands to Python functions instead of interpreting")
+    arg_parser.add_argument("--no-builtins", action="store_true", help="run every OS function from its VM code, for conformance testing")
+    arg_parser.add_argument("--steps", type=int, help="stop after this many vm commands, default runs until the program halts")
+    arg_parser.add_argument("--ram", nargs="*", default=[], metavar="ADDRESS[:END]", help="RAM addresses or ranges to print afterwards")
+    args = arg_parser.parse_args()
+
+    emulator = VMEmulator(args.blocks, None if args.no_builtins else BUILTINS)
+    emulator.loadProgram(args.path, None if args.no_os else args.os)
+    emulator.bootstrap()
+    executed = emulator.run(args.steps)
+    print("{} vm commands, {}".format(executed, "halted" if emulator.halted else "stopped in " + emulator.names[emulator.pc]))
+    for selection in args.ram:
+        start, _, end = selection.partition(":")
+        for address in range(int(start), int(end or start) + 1):
+            print("RAM[{}] = {}".format(address, emulator.peek(address)))
+
+
+if __name__ == "__main__":
+    main()
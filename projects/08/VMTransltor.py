@@ -1,11 +1,27 @@
 import os
-import sys
+import io
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from Peephole import Peephole
+from TranslationCache import TranslationCache
+from VMCode import VMCode, COMMAND_TYPES, ARITHMETIC_COMMANDS, ADD, SUB, EQ, GT, LT, NOT, PUSH, POP, IF_GOTO, FUNCTION, CALL
+
+VERSION = "1.1"  # part of the fragment cache key, bump whenever the generated assembly can change
+FUSION_WINDOW = 4  # longest window of commands CodeWriter.writeFused translates as one
+# translate options turned on by -O0, -O1 and -O2, options given on their own are added on top
+# shared calls and comparisons are left out, they trade cycles for size
+OPTIMIZATION_LEVELS = [
+    {},
+    {"peephole": True, "fuse": True},
+    {"peephole": True, "fuse": True, "cache_top": True, "prune": True},
+]
+OPTIONS = ["shared_calls", "shared_comparisons", "peephole", "fuse", "cache_top", "prune"]
 
 
 class Parser:
     """
     Hack vm file parser
-    Loads the supplied vm file, parsing each line of code.
+    Loads the supplied vm file, decoding each line of code once into a VMCode.
     """
 
     def __init__(self, file_path):
@@ -13,71 +29,86 @@ class Parser:
         Opens file discarding empty and comment lines and stripping whitespace.
         @param file_path(str): path to .vm file that is being translated to assembly
         """
-        self.commands = []
+        self.code = VMCode(file_path)
         self.curr_line = -1
-        self.curr_command = None
-
-        with open(file_path, "r") as file:
-            for line in file:
-                line = line.partition("//")[0]
-                line = line.strip()
-                if line:
-                    self.commands.append(line)
 
     def hasMoreCommands(self):
         """
         checks to see if parser has reached last command
         """
-        return self.curr_line < len(self.commands) - 1
+        return self.curr_line < len(self.code) - 1
 
     def advance(self):
         """
         moves the current location to next command
         """
         self.curr_line += 1
-        self.curr_command = self.commands[self.curr_line]
+
+    def window(self, length):
+        """
+        returns the current command and the ones after it, at most length of them, as (op, name, value) records
+        """
+        return [self.code.command(index) for index in range(self.curr_line, min(self.curr_line + length, len(self.code)))]
+
+    def skip(self, n_commands):
+        """
+        moves past n commands after the current one without returning them
+        """
+        self.curr_line += n_commands
+
+    def calls(self):
+        """
+        returns a dict of every function defined in the file to the set of functions it calls
+        calls made before the first function command are listed under None
+        """
+        calls = {None: set()}
+        function_name = None
+        names = self.code.names
+        for op, arg in zip(self.code.ops, self.code.args):
+            if op == FUNCTION:
+                function_name = names[arg]
+                calls[function_name] = set()
+            elif op == CALL:
+                calls[function_name].add(names[arg])
+        return calls
+
+    def dropFunctions(self, function_names):
+        """
+        removes the named functions, each from its function command up to the next function command
+        """
+        if not function_names:
+            return
+        kept = []
+        dropping = False
+        names = self.code.names
+        for index, (op, arg) in enumerate(zip(self.code.ops, self.code.args)):
+            if op == FUNCTION:
+                dropping = names[arg] in function_names
+            if not dropping:
+                kept.append(index)
+        self.code.keep(kept)
 
     def commandType(self):
         """
         returns the current command's type
         """
-        commands = self.curr_command.split(" ")
-
-        if len(commands) == 1:
-            if commands[0] == "return":
-                return "C_RETURN"
-            else:
-                return "C_ARITHMETIC"
-        elif commands[0] == "pop":
-            return "C_POP"
-        elif commands[0] == "push":
-            return "C_PUSH"
-        elif commands[0] == "label":
-            return "C_LABEL"
-        elif commands[0] == "goto":
-            return "C_GOTO"
-        elif commands[0] == "if-goto":
-            return "C_IF"
-        elif commands[0] == "function":
-            return "C_FUNCTION"
-        elif commands[0] == "call":
-            return "C_CALL"
+        return COMMAND_TYPES[self.code.ops[self.curr_line]]
 
     def arg1(self):
         """
         returns the command itself if the current command is an arithmetic command
         returns the segment for push and pop commands
         """
-        if self.commandType() == "C_ARITHMETIC":
-            return self.curr_command.split(" ")[0]
-        else:
-            return self.curr_command.split(" ")[1]
+        op = self.code.ops[self.curr_line]
+        if op < len(ARITHMETIC_COMMANDS):
+            return ARITHMETIC_COMMANDS[op]
+        return self.code.names[self.code.args[self.curr_line]]
 
     def arg2(self):
         """
         returns the index for push/pop/call/function commands
         """
-        return int(self.curr_command.split(" ")[2])
+        return self.code.values[self.curr_line]
 
 
 class CodeWriter:
@@ -85,13 +116,47 @@ class CodeWriter:
     translates assembly instruction from vm command and write to an output file
     """
 
-    def __init__(self, file_path):
-        """
-        sets up the output file
-        """
-        self.file = open(file_path, "w")
+    def __init__(self, file_path, shared_calls=False, shared_comparisons=False, peephole=False, fuse=False, cache_top=False,
+                 bootstrap=True, file_labels=False):
+        """
+        sets up the output file, or an in memory one that is kept in text on close if file_path is None
+        @param shared_calls(bool): call and return through the shared $$CALL and $$RETURN routines
+                                   instead of inlining the frame handling at every site
+        @param shared_comparisons(bool): jump to the shared $$EQ, $$GT and $$LT routines for eq, gt
+                                         and lt instead of inlining them
+        @param peephole(bool): pass the assembly through the Peephole optimizer before writing it
+        @param fuse(bool): translate the common multi command windows listed in writeFused as one
+        @param cache_top(bool): keep the top of the stack in D between commands, it is only written
+                                to the stack before labels, jumps, calls, returns and functions
+        @param bootstrap(bool): start with the bootstrap code and the shared routines
+        @param file_labels(bool): prefix the labels the writer makes up with the file name, so files
+                                  translated by separate writers can be put together
+        """
+        self.file = open(file_path, "w") if file_path else io.StringIO()
+        self.text = None
         self.file_name = ""
         self.function_name = ""
+        self.shared_calls = shared_calls
+        self.shared_comparisons = shared_comparisons
+        self.comparison_sites = {"eq": 0, "gt": 0, "lt": 0}  # comparisons routed to the shared routines
+        self.instructions = 0  # number of instructions written, labels excluded
+        self.peephole = Peephole(self.emit) if peephole else None
+        self.fuse = fuse
+        self.cache_top = cache_top
+        self.top_in_d = False  # the top of the stack is in D and SP points at the slot it belongs in
+        self.pending_top = None  # (code leaving the top in D, code leaving it on the stack) not yet written
+        # (name, method) tried in order by writeFused, each returns (number of commands, assembly) or None
+        self.fusions = [
+            ("increment", self.fuseIncrement),
+            ("array-write", self.fuseArrayWrite),
+            ("array-read", self.fuseArrayRead),
+            ("constant-branch", self.fuseConstantBranch),
+            ("compare-branch", self.fuseCompareBranch),
+            ("not-branch", self.fuseNotBranch),
+            ("constant-arithmetic", self.fuseConstantArithmetic),
+        ]
+        self.fusion_hits = {name: 0 for name, _ in self.fusions}
+        self.dropped_functions = []  # unreachable functions left out by translate with prune
 
         # assembly instruction for each vm command
         self.arithmetic_logical_commands = {
@@ -105,6 +170,15 @@ class CodeWriter:
             "or": "M=D|M",
             "not": "M=!M",
         }
+        # computation of each vm command on a top of the stack cached in D, the value below it in M
+        self.cached_commands = {
+            "add": "D=M+D",
+            "sub": "D=M-D",
+            "neg": "D=-D",
+            "and": "D=D&M",
+            "or": "D=D|M",
+            "not": "D=!D",
+        }
         # map of vm segment names to assembly symbols
         self.segment_table = {
             "local": "@LCL",
@@ -116,23 +190,59 @@ class CodeWriter:
         }
         self.label_index = 0
         self.return_index = 0
+        self.file_labels = file_labels
+        self.label_prefix = ""
+        self.comparison_routines = 0  # size of the shared comparison routines
+        if not bootstrap:
+            return
 
         # VM bootstrap
         asm_code = ["@256", "D=A", "@SP", "M=D"]
-        for line in asm_code:
-            self.file.write(line + "\n")
+        self.writeLines(asm_code)
         self.writeCall("Sys.init", 0)
+        if self.shared_calls:
+            self.writeSharedCall()
+            self.writeSharedReturn()
+        if self.shared_comparisons:
+            start = self.instructions
+            for command in ["eq", "gt", "lt"]:
+                self.writeSharedComparison(command)
+            self.comparison_routines = self.instructions - start
+
+    def writeLines(self, asm_code):
+        """
+        writes assembly lines to the output file, through the peephole optimizer if enabled
+        """
+        for line in asm_code:
+            if self.peephole:
+                self.peephole.add(line)
+            else:
+                self.emit(line)
+
+    def emit(self, line):
+        """
+        writes one final line of assembly
+        """
+        self.file.write(line + "\n")
+        if line[0] != "(":
+            self.instructions += 1
 
     def setFileName(self, file_name):
         """
         sets the file name for static varaible labels
         """
         self.file_name = os.path.basename(file_name)[:-3]
+        if self.file_labels:
+            self.label_prefix = self.file_name + "$"
 
     def writeArithmetic(self, command):
         """
         writes assembly instruction for vm arithmetic commands
         """
+        if self.cache_top and not (command in ["eq", "gt", "lt"] and self.shared_comparisons):
+            self.writeCachedArithmetic(command)
+            return
+        self.flushTop()
         asm_code = []
         if command in ["neg", "not"]:
             asm_code += ["@SP", "A=M-1", self.arithmetic_logical_commands[command]]
@@ -144,8 +254,14 @@ class CodeWriter:
                 "A=A-1",
                 self.arithmetic_logical_commands[command],
             ]
+        elif command in ["eq", "gt", "lt"] and self.shared_comparisons:
+            # the routine returns to the label passed in D
+            label = self.label_prefix + command + "_" + str(self.label_index)
+            self.label_index += 1
+            self.comparison_sites[command] += 1
+            asm_code += ["@" + label, "D=A", "@$$" + command.upper(), "0;JMP", "(" + label + ")"]
         elif command in ["eq", "gt", "lt"]:
-            label = command + "_" + str(self.label_index)
+            label = self.label_prefix + command + "_" + str(self.label_index)
             self.label_index += 1
             asm_code += [
                 "@SP",
@@ -161,8 +277,74 @@ class CodeWriter:
                 "M=0",
                 "(" + label + ")",
             ]
-        for line in asm_code:
-            self.file.write(line + "\n")
+        self.writeLines(asm_code)
+
+    def writeCachedArithmetic(self, command):
+        """
+        writes assembly for an arithmetic command on the top of the stack in D, the result stays in D
+        a binary command or comparison is held back until the next command shows whether its result
+        is better left in D or written over the value below on the stack
+        """
+        self.loadTop()
+        if command in ["neg", "not"]:
+            self.writeLines([self.cached_commands[command]])
+        elif command in ["add", "sub", "and", "or"]:
+            self.pending_top = (
+                ["@SP", "AM=M-1", self.cached_commands[command]],
+                ["@SP", "A=M-1", self.arithmetic_logical_commands[command]],
+            )
+        else:
+            label = self.label_prefix + command + "_" + str(self.label_index)
+            self.label_index += 1
+            in_d = [
+                "@SP",
+                "AM=M-1",
+                "D=M-D",
+                "@" + label + "_true",
+                self.arithmetic_logical_commands[command],
+                "D=0",
+                "@" + label,
+                "0;JMP",
+                "(" + label + "_true)",
+                "D=-1",
+                "(" + label + ")",
+            ]
+            on_stack = [
+                "@SP",
+                "A=M-1",
+                "D=M-D",
+                "M=-1",
+                "@" + label,
+                self.arithmetic_logical_commands[command],
+                "@SP",
+                "A=M-1",
+                "M=0",
+                "(" + label + ")",
+            ]
+            self.pending_top = (in_d, on_stack)
+
+    def loadTop(self):
+        """
+        pops the top of the stack into D unless it is already there
+        """
+        if self.pending_top:
+            self.writeLines(self.pending_top[0])
+            self.pending_top = None
+        if not self.top_in_d:
+            self.writeLines(["@SP", "AM=M-1", "D=M"])
+            self.top_in_d = True
+
+    def flushTop(self):
+        """
+        pushes the top of the stack cached in D, done before code that expects the whole stack in memory
+        """
+        if self.pending_top:
+            self.writeLines(self.pending_top[1])
+            self.pending_top = None
+            self.top_in_d = False
+        if self.top_in_d:
+            self.writeLines(["@SP", "AM=M+1", "A=A-1", "M=D"])
+            self.top_in_d = False
 
     def writePushPop(self, command, segment, index):
         """
@@ -191,6 +373,11 @@ class CodeWriter:
                 asm_code = ["@" + str_index, "D=A"]
             elif segment == "static":
                 asm_code = ["@" + self.file_name + "." + str_index, "D=M"]
+            self.flushTop()
+            if self.cache_top:
+                self.writeLines(asm_code)
+                self.top_in_d = True
+                return
             asm_code += ["@SP", "AM=M+1", "A=A-1", "M=D"]
 
         elif command == "C_POP":
@@ -219,10 +406,20 @@ class CodeWriter:
                     "@R13",
                     "M=D",
                 ]
+            if self.cache_top:
+                self.loadTop()
+                self.top_in_d = False
+                address = self.segmentAddress(segment, index)
+                if address is None:
+                    # R14 keeps the value while the address is worked out in D
+                    asm_code = ["@R14", "M=D"] + asm_code + ["@R14", "D=M", "@R13", "A=M", "M=D"]
+                else:
+                    asm_code = address + ["M=D"]
+                self.writeLines(asm_code)
+                return
             asm_code += ["@SP", "AM=M-1", "D=M", "@R13", "A=M", "M=D"]
 
-        for line in asm_code:
-            self.file.write(line + "\n")
+        self.writeLines(asm_code)
 
     def writeLabel(self, label):
         """
@@ -230,25 +427,26 @@ class CodeWriter:
         for file xxx, function foo, label bar, label is formatted as xxx.foo$bar
         """
         label_name = self.function_name + "$" + label
-        self.file.write("(" + label_name + ")\n")
+        self.flushTop()
+        self.writeLines(["(" + label_name + ")"])
 
     def writeGoto(self, label):
         """
         writes assembly to jump to specified label
         """
         label_name = self.function_name + "$" + label
+        self.flushTop()
         asm_code = ["@" + label_name, "0;JMP"]
-        for line in asm_code:
-            self.file.write(line + "\n")
+        self.writeLines(asm_code)
 
     def writeIf(self, label):
         """
         writes assembly to jump to label if condition is met
         """
         label_name = self.function_name + "$" + label
-        asm_code = ["@SP", "AM=M-1", "D=M", "@" + label_name, "D;JNE"]
-        for line in asm_code:
-            self.file.write(line + "\n")
+        self.loadTop()
+        self.top_in_d = False
+        self.writeLines(["@" + label_name, "D;JNE"])
 
     def writeFunction(self, function_name, n_args):
         """
@@ -257,19 +455,30 @@ class CodeWriter:
         writes assembly to set n local variables to 0
         """
         self.function_name = function_name
-        self.file.write("(" + function_name + ")\n")
+        self.flushTop()
+        self.writeLines(["(" + function_name + ")"])
         for _ in range(n_args):
-            asm_code = ["@SP", "AM=M+1", "A=A-1", "M=0"]
-            for line in asm_code:
-                self.file.write(line + "\n")
+            self.writeLines(["@SP", "AM=M+1", "A=A-1", "M=0"])
 
     def writeCall(self, function_name, n_args):
         """
         write assembly code to call a function with n args
         assembly to save frame of caller
         """
-        return_address = function_name + "$ret" + str(self.return_index)
+        return_address = self.label_prefix + function_name + "$ret" + str(self.return_index)
         self.return_index += 1
+        self.flushTop()
+        if self.shared_calls:
+            # R13 = n_args, R14 = function, D = return address, the rest is done by $$CALL
+            if n_args < 2:
+                asm_code = ["@R13", "M=" + str(n_args)]
+            else:
+                asm_code = ["@" + str(n_args), "D=A", "@R13", "M=D"]
+            asm_code += ["@" + function_name, "D=A", "@R14", "M=D"]
+            asm_code += ["@" + return_address, "D=A", "@$$CALL", "0;JMP"]
+            asm_code += ["(" + return_address + ")"]
+            self.writeLines(asm_code)
+            return
         push_D = ["@SP", "AM=M+1", "A=A-1", "M=D"]
         asm_code = ["@" + return_address, "D=A"] + push_D  # push return_address
         for segment in ["LCL", "ARG", "THIS", "THAT"]:
@@ -285,8 +494,7 @@ class CodeWriter:
         asm_code += ["@SP", "D=M", "@LCL", "M=D"]  # LCL = SP
         asm_code += ["@" + function_name, "0;JMP"]  # GOTO function
         asm_code += ["(" + return_address + ")"]  # return_address label
-        for line in asm_code:
-            self.file.write(line + "\n")
+        self.writeLines(asm_code)
 
     def writeReturn(self):
         """
@@ -296,6 +504,16 @@ class CodeWriter:
         restores the frame of the caller
         goto the return address it has saved
         """
+        self.flushTop()
+        if self.shared_calls:
+            self.writeLines(["@$$RETURN", "0;JMP"])
+            return
+        self.writeLines(self.returnCode())
+
+    def returnCode(self):
+        """
+        returns the assembly of a return
+        """
         asm_code = ["@LCL", "D=M", "@R13", "M=D"]  # frame = LCL in R13
         asm_code += [
             "@5",
@@ -315,20 +533,252 @@ class CodeWriter:
                 "M=D",
             ]  # restore THAT, THIS, ARG, LCL
         asm_code += ["@R14", "A=M", "0;JMP"]  # goto return_address
-        for line in asm_code:
-            self.file.write(line + "\n")
+        return asm_code
+
+    def writeSharedCall(self):
+        """
+        writes the $$CALL routine used by every call site with shared_calls
+        expects the return address in D, the number of arguments in R13 and the function in R14
+        """
+        push_D = ["@SP", "AM=M+1", "A=A-1", "M=D"]
+        asm_code = ["($$CALL)"] + push_D  # push return_address
+        for segment in ["LCL", "ARG", "THIS", "THAT"]:
+            asm_code += ["@" + segment, "D=M"] + push_D  # push LCL, ARG, THIS, THAT
+        asm_code += [
+            "@R13",
+            "D=M",
+            "@5",
+            "D=D+A",
+            "@SP",
+            "D=M-D",
+            "@ARG",
+            "M=D",
+        ]  # ARG = SP-5-n_args
+        asm_code += ["@SP", "D=M", "@LCL", "M=D"]  # LCL = SP
+        asm_code += ["@R14", "A=M", "0;JMP"]  # GOTO function
+        self.writeLines(asm_code)
+
+    def writeSharedComparison(self, command):
+        """
+        writes the $$EQ, $$GT or $$LT routine used by the comparisons with shared_comparisons
+        expects the return address in D and keeps it in R13
+        """
+        routine = "$$" + command.upper()
+        asm_code = ["(" + routine + ")", "@R13", "M=D"]
+        asm_code += [
+            "@SP",
+            "AM=M-1",
+            "D=M",
+            "A=A-1",
+            "D=M-D",
+            "M=-1",
+            "@" + routine + "$END",
+            self.arithmetic_logical_commands[command],
+            "@SP",
+            "A=M-1",
+            "M=0",
+            "(" + routine + "$END)",
+        ]
+        asm_code += ["@R13", "A=M", "0;JMP"]
+        self.writeLines(asm_code)
+
+    def writeSharedReturn(self):
+        """
+        writes the $$RETURN routine every return jumps to with shared_calls
+        """
+        self.writeLines(["($$RETURN)"] + self.returnCode())
+
+    def writeFused(self, commands):
+        """
+        writes one hand tuned translation for a window of commands the Jack compiler emits often
+        returns the number of commands translated, 0 if the window does not start with one of them
+        @param commands(list): the current command and the ones after it, as (op, name, value) records
+        """
+        for name, fusion in self.fusions:
+            match = fusion(commands)
+            if match:
+                n_commands, asm_code = match
+                self.fusion_hits[name] += 1
+                if self.top_in_d and asm_code[:2] == ["@SP", "AM=M-1"] and asm_code[2] in ["D=M", "D=M+1"]:
+                    # the value popped first is already in D, only A has to end up where the pop leaves it
+                    self.loadTop()
+                    asm_code = ["@SP", "A=M"] + ["D=D+1"] * (asm_code[2] == "D=M+1") + asm_code[3:]
+                    self.top_in_d = False
+                if asm_code:
+                    self.flushTop()
+                self.writeLines(asm_code)
+                return n_commands
+        return 0
+
+    def segmentAddress(self, segment, index):
+        """
+        returns assembly that loads the address of segment index into A without changing D
+        or None when it cannot be done in a few instructions
+        """
+        if segment in ["local", "argument", "this", "that"] and index <= 6:
+            if index == 0:
+                return [self.segment_table[segment], "A=M"]
+            return [self.segment_table[segment], "A=M+1"] + ["A=A+1"] * (index - 1)
+        elif segment == "temp":
+            return ["@" + str(5 + index)]
+        elif segment == "pointer":
+            return ["@" + str(3 + index)]
+        elif segment == "static":
+            return ["@" + self.file_name + "." + str(index)]
+        return None
+
+    def fuseIncrement(self, commands):
+        """
+        push x, push constant k, add or sub, pop x: changes x in place
+        """
+        if len(commands) < 4 or commands[1][:2] != (PUSH, "constant") or commands[2][0] not in (ADD, SUB):
+            return None
+        if commands[0][0] != PUSH or commands[3][0] != POP or commands[0][1:] != commands[3][1:]:
+            return None
+        address = self.segmentAddress(commands[0][1], commands[0][2])
+        if address is None:
+            return None
+        sign = "+" if commands[2][0] == ADD else "-"
+        constant = commands[1][2]
+        if constant == 0:
+            return 4, []
+        if constant == 1:
+            return 4, address + ["M=M" + sign + "1"]
+        return 4, ["@" + str(constant), "D=A"] + address + ["M=M" + sign + "D"]
+
+    def fuseArrayWrite(self, commands):
+        """
+        pop temp 0, pop pointer 1, push temp 0, pop that 0: the value on top is stored at the address below it
+        temp 0 and THAT are left as the commands leave them
+        """
+        if commands[:4] != [(POP, "temp", 0), (POP, "pointer", 1), (PUSH, "temp", 0), (POP, "that", 0)]:
+            return None
+        asm_code = ["@SP", "AM=M-1", "D=M", "@5", "M=D"]  # temp 0 = value
+        asm_code += ["@SP", "AM=M-1", "D=M", "@THAT", "M=D"]  # THAT = address
+        asm_code += ["@5", "D=M", "@THAT", "A=M", "M=D"]  # *THAT = value
+        return 4, asm_code
+
+    def fuseArrayRead(self, commands):
+        """
+        [add,] pop pointer 1, push that 0: replaces the address on top with the word it points to
+        """
+        asm_code = ["@SP", "A=M-1", "D=M"]
+        n_commands = 0
+        if commands[0][0] == ADD:
+            asm_code = ["@SP", "AM=M-1", "D=M", "A=A-1", "D=M+D"]
+            n_commands = 1
+        if commands[n_commands : n_commands + 2] != [(POP, "pointer", 1), (PUSH, "that", 0)]:
+            return None
+        asm_code += ["@THAT", "M=D", "A=D", "D=M", "@SP", "A=M-1", "M=D"]
+        return n_commands + 2, asm_code
+
+    def fuseConstantBranch(self, commands):
+        """
+        push constant k, any number of not, if-goto: a goto or nothing at all
+        """
+        if commands[0][:2] != (PUSH, "constant"):
+            return None
+        value = commands[0][2]
+        n_commands = 1
+        while n_commands < len(commands) and commands[n_commands][0] == NOT:
+            value = ~value & 0xFFFF
+            n_commands += 1
+        if n_commands == len(commands) or commands[n_commands][0] != IF_GOTO:
+            return None
+        if value:
+            return n_commands + 1, ["@" + self.function_name + "$" + commands[n_commands][1], "0;JMP"]
+        return n_commands + 1, []
+
+    def fuseCompareBranch(self, commands):
+        """
+        [push constant k,] eq, gt or lt, [not,] if-goto: jumps on x-y without pushing the boolean
+        """
+        jumps = {EQ: ["JEQ", "JNE"], GT: ["JGT", "JLE"], LT: ["JLT", "JGE"]}
+        n_commands = 0
+        constant = None
+        if commands[0][:2] == (PUSH, "constant"):
+            constant = commands[0][2]
+            n_commands = 1
+        if len(commands) <= n_commands + 1 or commands[n_commands][0] not in jumps:
+            return None
+        negated = commands[n_commands + 1][0] == NOT
+        jump = jumps[commands[n_commands][0]][negated]
+        n_commands += 1 + negated
+        if n_commands == len(commands) or commands[n_commands][0] != IF_GOTO:
+            return None
+        if constant is None:
+            asm_code = ["@SP", "AM=M-1", "D=M", "A=A-1", "D=M-D", "@SP", "M=M-1"]
+        elif constant == 0:
+            asm_code = ["@SP", "AM=M-1", "D=M"]
+        else:
+            asm_code = ["@SP", "AM=M-1", "D=M", "@" + str(constant), "D=D-A"]
+        asm_code += ["@" + self.function_name + "$" + commands[n_commands][1], "D;" + jump]
+        return n_commands + 1, asm_code
+
+    def fuseNotBranch(self, commands):
+        """
+        not, if-goto: jumps when not x is not 0, that is when x is not -1, whether or not x is a boolean
+        """
+        if len(commands) < 2 or commands[0][0] != NOT or commands[1][0] != IF_GOTO:
+            return None
+        return 2, ["@SP", "AM=M-1", "D=M+1", "@" + self.function_name + "$" + commands[1][1], "D;JNE"]
+
+    def fuseConstantArithmetic(self, commands):
+        """
+        push constant k, add or sub: changes the top in place
+        """
+        if len(commands) < 2 or commands[0][:2] != (PUSH, "constant") or commands[1][0] not in (ADD, SUB):
+            return None
+        sign = "+" if commands[1][0] == ADD else "-"
+        constant = commands[0][2]
+        if constant == 0:
+            return 2, []
+        if constant == 1:
+            return 2, ["@SP", "A=M-1", "M=M" + sign + "1"]
+        return 2, ["@" + str(constant), "D=A", "@SP", "A=M-1", "M=M" + sign + "D"]
 
     def close(self):
+        self.flushTop()
+        if self.peephole:
+            self.peephole.flush()
+        if isinstance(self.file, io.StringIO):
+            self.text = self.file.getvalue()
         self.file.close()
 
 
-def main():
+def main(argv=None):
     """
     Main class to translate vm file to asm file.
+    @param argv(list): command line arguments, sys.argv[1:] if None
     """
+    arg_parser = argparse.ArgumentParser(description="Translate vm code to Hack assembly")
+    arg_parser.add_argument("path", help="a .vm file or a directory of .vm files")
+    arg_parser.add_argument("-O", dest="level", type=int, choices=range(len(OPTIMIZATION_LEVELS)), default=0,
+                            help="optimization level, 0 for the reference templates, 1 adds --peephole and --fuse, "
+                                 "2 also --cache-top and --prune")
+    arg_parser.add_argument("--no-bootstrap", dest="bootstrap", action="store_false",
+                            help="leave out the code setting SP and calling Sys.init, for programs run from their first command")
+    arg_parser.add_argument("--shared-calls", action="store_true", help="share one call and one return routine between all call sites")
+    arg_parser.add_argument("--shared-comparisons", action="store_true", help="share one routine for each of eq, gt and lt")
+    arg_parser.add_argument("--peephole", action="store_true", help="optimize the assembly with the patterns of Peephole.py")
+    arg_parser.add_argument("--fuse", action="store_true", help="translate common windows of vm commands as one, see CodeWriter.writeFused")
+    arg_parser.add_argument("--cache-top", action="store_true", help="keep the top of the stack in D between commands")
+    arg_parser.add_argument("--prune", action="store_true", help="only translate the functions reachable from Sys.init")
+    arg_parser.add_argument("--jobs", type=int, default=1, help="translate the files apart in this many worker processes")
+    arg_parser.add_argument("--cache", action="store_true", help="translate the files apart and reuse the assembly of unchanged files")
+    arg_parser.add_argument("--clear-cache", action="store_true", help="delete every cached fragment before translating")
+    arg_parser.add_argument("--cache-dir", help="cache location, defaults to $VM_TRANSLATOR_CACHE or ~/.cache/vm-translator")
+    arg_parser.add_argument("--stats", action="store_true", help="print how many comparison sites use the shared routines, the fusion hits, the peephole pattern hits, the pruned functions and the cache use")
+    arg_parser.add_argument("--size", action="store_true", help="print the number of instructions written")
+    args = arg_parser.parse_args(argv)
+    if not args.bootstrap and (args.shared_calls or args.shared_comparisons):
+        arg_parser.error("the shared routines are written with the bootstrap, --no-bootstrap cannot be combined with them")
+    if args.clear_cache:
+        TranslationCache(args.cache_dir).clear()
+
     # geting and checking file validity
     files = []
-    path = sys.argv[1]
+    path = args.path
     asm_file_name = None
 
     # check if it is a file
@@ -347,34 +797,197 @@ def main():
         path = path[:-1] if path[-1] == "/" else path
         asm_file_name = os.path.join(path, os.path.basename(path)) + ".asm"
 
+    level = OPTIMIZATION_LEVELS[args.level]
+    options = {option: getattr(args, option) or level.get(option, False) for option in OPTIONS}
+    cache = TranslationCache(args.cache_dir) if args.cache else None
+    if args.jobs > 1 or cache:
+        writer = translateFragments(files, asm_file_name, args.jobs, cache, bootstrap=args.bootstrap, **options)
+    else:
+        writer = translate(files, asm_file_name, bootstrap=args.bootstrap, **options)
+    if args.size:
+        print("{}: {} instructions".format(asm_file_name, writer.instructions))
+    if options["prune"] and args.bootstrap:
+        print("dropped {} unreachable functions".format(len(writer.dropped_functions)))
+    if args.stats and cache:
+        print("translation cache: {} hits, {} misses, {} evicted, {} bytes in {}".format(
+            cache.hits, cache.misses, cache.evictions, cache.size(), cache.directory))
+    if args.stats and writer.dropped_functions:
+        print("dropped functions: " + ", ".join(writer.dropped_functions))
+    if args.stats and writer.shared_comparisons:
+        sites = writer.comparison_sites
+        # an inlined comparison is 11 instructions and a label, a call of the shared routine 4 and a label
+        print("shared comparison sites: eq {} gt {} lt {}, {} instructions saved".format(
+            sites["eq"], sites["gt"], sites["lt"], 7 * sum(sites.values()) - writer.comparison_routines))
+    if args.stats and writer.fuse:
+        print("fused windows: " + ", ".join("{} {}".format(name, hits) for name, hits in writer.fusion_hits.items()))
+    if args.stats and writer.peephole:
+        print("peephole pattern hits: " + ", ".join(
+            "{} {}".format(name, hits) for name, hits in writer.peephole.hits.items()))
+
+
+def reachableFunctions(call_graph, roots):
+    """
+    returns the set of functions the roots reach through the call graph, the roots included
+    @param call_graph(dict): function name to the set of functions it calls
+    @param roots(set): functions known to run
+    """
+    reachable = set()
+    todo = list(roots)
+    while todo:
+        function_name = todo.pop()
+        if function_name not in reachable:
+            reachable.add(function_name)
+            todo.extend(call_graph.get(function_name, ()))
+    return reachable
+
+
+def unreachableFunctions(parsers):
+    """
+    returns the sorted names of the functions neither Sys.init nor code outside functions reaches
+    """
+    call_graph = {}
+    roots = {"Sys.init"}  # called by the bootstrap
+    for parser in parsers:
+        calls = parser.calls()
+        roots |= calls.pop(None)
+        call_graph.update(calls)
+    return sorted(set(call_graph) - reachableFunctions(call_graph, roots))
+
+
+def translate(files, asm_file_name, shared_calls=False, shared_comparisons=False, peephole=False, fuse=False, cache_top=False, prune=False,
+              bootstrap=True):
+    """
+    translates the vm files into one assembly file, returns the closed CodeWriter
+    with prune only the functions reachable from Sys.init and from code outside functions are
+    translated, the others are listed sorted in the writer's dropped_functions
+    without bootstrap any function may be where the program is started, so nothing is pruned
+    """
+    parsers = [Parser(file) for file in files]
+    dropped_functions = unreachableFunctions(parsers) if prune and bootstrap else []
+    for parser in parsers:
+        parser.dropFunctions(set(dropped_functions))
+
     # create codewriter object
-    writer = CodeWriter(asm_file_name)
-
-    for file in files:
-        writer.setFileName(file)
-        parser = Parser(file)
-        # main loop to iterate through commands line by line, writing the corresponding assembly commands to the output file
-        while parser.hasMoreCommands():
-            parser.advance()
-            type = parser.commandType()
-            if type == "C_ARITHMETIC":
-                writer.writeArithmetic(parser.arg1())
-            elif type in ["C_PUSH", "C_POP"]:
-                writer.writePushPop(type, parser.arg1(), parser.arg2())
-            elif type == "C_LABEL":
-                writer.writeLabel(parser.arg1())
-            elif type == "C_GOTO":
-                writer.writeGoto(parser.arg1())
-            elif type == "C_IF":
-                writer.writeIf(parser.arg1())
-            elif type == "C_FUNCTION":
-                writer.writeFunction(parser.arg1(), parser.arg2())
-            elif type == "C_CALL":
-                writer.writeCall(parser.arg1(), parser.arg2())
-            elif type == "C_RETURN":
-                writer.writeReturn()
+    writer = CodeWriter(asm_file_name, shared_calls, shared_comparisons, peephole, fuse, cache_top, bootstrap)
+    writer.dropped_functions = dropped_functions
+    for file, parser in zip(files, parsers):
+        writeFile(writer, file, parser)
+    writer.close()
+    return writer
+
 
+def writeFile(writer, file, parser):
+    """
+    writes the translation of the commands of one parsed vm file
+    """
+    writer.setFileName(file)
+    # main loop to iterate through commands line by line, writing the corresponding assembly commands to the output file
+    while parser.hasMoreCommands():
+        parser.advance()
+        if writer.fuse:
+            n_commands = writer.writeFused(parser.window(FUSION_WINDOW))
+            if n_commands:
+                parser.skip(n_commands - 1)
+                continue
+        type = parser.commandType()
+        if type == "C_ARITHMETIC":
+            writer.writeArithmetic(parser.arg1())
+        elif type in ["C_PUSH", "C_POP"]:
+            writer.writePushPop(type, parser.arg1(), parser.arg2())
+        elif type == "C_LABEL":
+            writer.writeLabel(parser.arg1())
+        elif type == "C_GOTO":
+            writer.writeGoto(parser.arg1())
+        elif type == "C_IF":
+            writer.writeIf(parser.arg1())
+        elif type == "C_FUNCTION":
+            writer.writeFunction(parser.arg1(), parser.arg2())
+        elif type == "C_CALL":
+            writer.writeCall(parser.arg1(), parser.arg2())
+        elif type == "C_RETURN":
+            writer.writeReturn()
+
+
+def translateFragments(files, asm_file_name, jobs=1, cache=None, shared_calls=False, shared_comparisons=False, peephole=False, fuse=False, cache_top=False, prune=False,
+                       bootstrap=True):
+    """
+    translates every vm file on its own with file scoped labels, returns the closed CodeWriter of
+    the bootstrap with the statistics of all files added up
+    the output is the bootstrap followed by the files sorted by name, whatever order workers finish in
+    @param jobs(int): number of worker processes, the files are translated in this process if 1
+    @param cache(TranslationCache): where the fragments of unchanged files are taken from and new ones stored
+    """
+    files = sorted(files, key=os.path.basename)
+    options = {
+        "shared_calls": shared_calls,
+        "shared_comparisons": shared_comparisons,
+        "peephole": peephole,
+        "fuse": fuse,
+        "cache_top": cache_top,
+    }
+    # the functions dropped from each file, only those can change its fragment
+    dropped_functions = []
+    file_dropped_functions = [[] for _ in files]
+    if prune and bootstrap:
+        parsers = [Parser(file) for file in files]
+        dropped_functions = unreachableFunctions(parsers)
+        for parser, dropped in zip(parsers, file_dropped_functions):
+            dropped += sorted(set(parser.calls()) & set(dropped_functions))
+
+    fragments = [None] * len(files)
+    keys = [None] * len(files)
+    if cache:
+        for index, file in enumerate(files):
+            keys[index] = cache.key(file, VERSION, dict(options, dropped_functions=file_dropped_functions[index]))
+            fragments[index] = cache.load(keys[index])
+    missing = [index for index in range(len(files)) if fragments[index] is None]
+    tasks = [(files[index], options, file_dropped_functions[index]) for index in missing]
+    if jobs > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(jobs) as pool:
+            translated = list(pool.map(translateFile, *zip(*tasks)))
+    else:
+        translated = [translateFile(*task) for task in tasks]
+    for index, fragment in zip(missing, translated):
+        fragments[index] = fragment
+        if cache:
+            cache.store(keys[index], fragment, evict=False)
+    if cache and missing:
+        cache.evict()
+
+    writer = CodeWriter(asm_file_name, bootstrap=bootstrap, **options)
+    writer.dropped_functions = dropped_functions
+    if writer.peephole:
+        writer.peephole.flush()
+    for fragment in fragments:
+        writer.file.write(fragment["text"])
+        writer.instructions += fragment["instructions"]
+        for command, sites in fragment["comparison_sites"].items():
+            writer.comparison_sites[command] += sites
+        for name, hits in fragment["fusion_hits"].items():
+            writer.fusion_hits[name] += hits
+        for name, hits in fragment["peephole_hits"].items():
+            writer.peephole.hits[name] += hits
+    writer.close()
+    return writer
+
+
+def translateFile(file, options, dropped_functions):
+    """
+    translates one vm file with a writer of its own, also the process pool task of translateFragments
+    returns the fragment, a dict of the assembly text and the writer's statistics
+    """
+    writer = CodeWriter(None, bootstrap=False, file_labels=True, **options)
+    parser = Parser(file)
+    parser.dropFunctions(set(dropped_functions))
+    writeFile(writer, file, parser)
     writer.close()
+    return {
+        "text": writer.text,
+        "instructions": writer.instructions,
+        "comparison_sites": writer.comparison_sites,
+        "fusion_hits": writer.fusion_hits,
+        "peephole_hits": writer.peephole.hits if writer.peephole else {},
+    }
 
 
 if __name__ == "__main__":
@@ -1,134 +1,129 @@
 import os
+import re
 import sys
+from collections import deque
+
+KEYWORDS = {'class', 'constructor', 'function',
+            'method', 'field', 'static', 'var', 'int', 'char',
+            'boolean', 'void', 'true', 'false', 'null', 'this',
+            'let', 'do', 'if', 'else', 'while', 'return'}
+# whitespace and comments, then the start of a block comment that goes on past the line or
+# one group per kind of token: symbol, integer, string, word or error
+# words run up to whitespace or a symbol, a word starting with digits is an integer then a word
+TOKEN_PATTERN = re.compile(r'''
+    (?:\s+|//[^\n]*|/\*[^*]*(?:\*+[^*/][^*]*)*\*+/)*
+    (?:
+        (/\*)
+      | ([()\[\]{},;=.+\-*/&|~<>])
+      | (\d+)
+      | ("[^"\n]*")
+      | ([^\s()\[\]{},;=.+\-*/&|~<>"]+)
+      | (.)
+      | \Z
+    )
+''', re.VERBOSE | re.DOTALL)
+CHUNK_SIZE = 1 << 13  # characters read from the file at a time
 
-class JackTokens:
-    """
-    Class to represent tokens in Jack 
-    """
-    def __init__(self, type, token):
-        self.type = type
-        self.token = token
-    
 class JackTokenizer:
     """
     Converts jack code into a stream of individual jack tokens
     JackTokenizer as recommended in Nand2Tetris chapter 10
+    Each token is a (type, token) tuple. Tokens are read from the file as the compiler asks for
+    them, only the few looked ahead at are kept.
     """
     def __init__(self, file):
         """
         Opens jack file for reading, tokenizing jack code
         @param file(str): path to .jack file that is being converted to tokens
         """
-        self.symbols = ['(', ')', '[', ']', '{', '}',
-                        ',', ';', '=', '.', 
-                        '+', '-', '*', '/', '&', '|', '~', '<', '>']
-        self.keywords = ['class', 'constructor', 'function', 
-		                'method', 'field', 'static', 'var', 'int', 'char',
-		                'boolean', 'void', 'true', 'false', 'null', 'this',
-		                'let', 'do', 'if', 'else', 'while', 'return']
-        self.tokens = []
+        self.file = file
+        self.tokens = self.tokenize(file)
+        self.lookahead = deque()
+        self.current_token = None
 
+    def tokenize(self, file):
+        """
+        generates the jack tokens (with type) of the file, scanning CHUNK_SIZE characters of whole
+        lines at a time with TOKEN_PATTERN, no token but a block comment goes on past its line
+        words are keywords or identifiers
+        """
+        in_comment = False
         with open(file, "r") as file:
-            in_comment = False
-            for line in file:
+            while True:
+                lines = file.readlines(CHUNK_SIZE)
+                if not lines:
+                    break
+                chunk = ''.join(lines)
                 if in_comment:
-                    if '*/' in line:
-                        line = line.partition('*/')[2]
-                        in_comment = False
-                    else: continue
-                line = line.partition("//")[0]
-                if "/*" in line:
-                    if '*/' in line:
-                        line = line.partition("/*")[0] + line.partition('*/')[2]
-                    else:
-                        line = line.partition("/*")[0]
+                    if '*/' not in chunk:
+                        continue
+                    chunk = chunk.partition('*/')[2]
+                    in_comment = False
+                for comment, symbol, integer, string, word, error in TOKEN_PATTERN.findall(chunk):
+                    if symbol:
+                        yield ('SYMBOL', symbol)
+                    elif word:
+                        yield ('KEYWORD' if word in KEYWORDS else 'IDENTIFIER', word)
+                    elif integer:
+                        yield ('INT_CONST', integer)
+                    elif string:
+                        yield ('STRING_CONST', string[1:-1])
+                    elif comment:
+                        # the rest of the chunk is in the comment
                         in_comment = True
-                self.processLine(line)
+                        break
+                    elif error:
+                        raise SyntaxError('unexpected {} in {}'.format(repr(error), self.file))
 
-        self.current_pos = -1
-        self.current_token = None
-    
-    def processLine(self, line):
-        """
-        parses line to not split strings in quotations
-        splits line by whitespace to get preliminary set of tokens (some will need to be further split)
-        """
-        if '\"' in line:
-            start = line.find('\"')
-            end = line.find('\"', start+1)
-            string = line[start:end+1]
-            full = line[:start].split() + [string] + line[end+1:].split()
-            for string in full:
-                self.tokenize(string)
-        else:
-            line = line.split()
-            for string in line:
-                self.tokenize(string)
-
-    def tokenize(self, string):
+    def peek(self, distance=1):
         """
-        parse preliminary set of tokens, assigning them to jack tokens (with type)
+        returns the token distance tokens after the current one without advancing, None past the last token
         """
-        if not string:
-            return
-        
-        if string[0] in self.symbols:
-            self.tokens.append(JackTokens('SYMBOL', string[0]))
-            self.tokenize(string[1:])
-        elif string[0] == '\"':
-            self.tokens.append(JackTokens('STRING_CONST', string[1:-1]))
-        elif string[0].isdecimal():
-            i = 1
-            while string[i].isdecimal():
-                i += 1
-            token = string[:i]
-            self.tokens.append(JackTokens('INT_CONST', token))
-            self.tokenize(string[i:])
-        else:
-            i = 0
-            while i < len(string) and string[i] not in self.symbols:
-                i += 1
-            token = string[:i]
-            if token in self.keywords:
-                self.tokens.append(JackTokens('KEYWORD', token))
-            else:
-                self.tokens.append(JackTokens('IDENTIFIER', token))
-            self.tokenize(string[i:])
+        while len(self.lookahead) < distance:
+            token = next(self.tokens, None)
+            if token is None:
+                return None
+            self.lookahead.append(token)
+        return self.lookahead[distance - 1]
 
-        
     def hasMoreTokens(self):
         """
         checks to see if tokenizer has reached last token
         """
-        return self.current_pos < len(self.tokens) - 1
+        return self.peek() is not None
 
     def advance(self):
         """
         move current token to next token
         """
-        self.current_pos += 1
-        self.current_token = self.tokens[self.current_pos]
+        self.current_token = self.lookahead.popleft() if self.lookahead else next(self.tokens)
+
+    def close(self):
+        """
+        stops reading, closing the file when the compiler is done before its last token
+        """
+        self.tokens.close()
 
     def tokenType(self):
         """
         returns the jack type of token
         """
-        return self.current_token.type
+        return self.current_token[0]
 
     def keyWord(self):
-        return self.current_token.token
+        return self.current_token[1]
 
     def symbol(self):
-        return self.current_token.token
+        return self.current_token[1]
 
     def identifier(self):
-        return self.current_token.token
+        return self.current_token[1]
 
     def intVal(self):
-        return int (self.current_token.token)
+        return int (self.current_token[1])
 
     def stringVal(self):
-        return self.current_token.token
+        return self.current_token[1]
 
 class CompliationEngine:
     """
@@ -168,6 +163,7 @@ class CompliationEngine:
         self.indentation -= 1
         self.file.write('</class>\n')
         self.file.close()
+        self.tokenizer.close()
 
     def compileClassVarDec(self):
         """
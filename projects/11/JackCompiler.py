@@ -1,134 +1,137 @@
 import os
+import re
 import sys
+import json
+import time
+import hashlib
+import argparse
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+VERSION = '1.2' # kept in the build manifest, bump whenever the generated vm code can change
+MANIFEST_NAME = '.jack-manifest.json'
+
+KEYWORDS = {'class', 'constructor', 'function',
+            'method', 'field', 'static', 'var', 'int', 'char',
+            'boolean', 'void', 'true', 'false', 'null', 'this',
+            'let', 'do', 'if', 'else', 'while', 'return'}
+# whitespace and comments, then the start of a block comment that goes on past the line or
+# one group per kind of token: symbol, integer, string, word or error
+# words run up to whitespace or a symbol, a word starting with digits is an integer then a word
+TOKEN_PATTERN = re.compile(r'''
+    (?:\s+|//[^\n]*|/\*[^*]*(?:\*+[^*/][^*]*)*\*+/)*
+    (?:
+        (/\*)
+      | ([()\[\]{},;=.+\-*/&|~<>])
+      | (\d+)
+      | ("[^"\n]*")
+      | ([^\s()\[\]{},;=.+\-*/&|~<>"]+)
+      | (.)
+      | \Z
+    )
+''', re.VERBOSE | re.DOTALL)
+CHUNK_SIZE = 1 << 13  # characters read from the file at a time
 
-class JackTokens:
-    """
-    Class to represent tokens in Jack 
-    """
-    def __init__(self, type, token):
-        self.type = type
-        self.token = token
-    
 class JackTokenizer:
     """
     Converts jack code into a stream of individual jack tokens
     JackTokenizer as recommended in Nand2Tetris chapter 10
+    Each token is a (type, token) tuple. Tokens are read from the file as the compiler asks for
+    them, only the few looked ahead at are kept.
     """
     def __init__(self, file):
         """
         Opens jack file for reading, tokenizing jack code
         @param file(str): path to .jack file that is being converted to tokens
         """
-        self.symbols = ['(', ')', '[', ']', '{', '}',
-                        ',', ';', '=', '.', 
-                        '+', '-', '*', '/', '&', '|', '~', '<', '>']
-        self.keywords = ['class', 'constructor', 'function', 
-		                'method', 'field', 'static', 'var', 'int', 'char',
-		                'boolean', 'void', 'true', 'false', 'null', 'this',
-		                'let', 'do', 'if', 'else', 'while', 'return']
-        self.tokens = []
+        self.file = file
+        self.tokens = self.tokenize(file)
+        self.lookahead = deque()
+        self.current_token = None
 
+    def tokenize(self, file):
+        """
+        generates the jack tokens (with type) of the file, scanning CHUNK_SIZE characters of whole
+        lines at a time with TOKEN_PATTERN, no token but a block comment goes on past its line
+        words are keywords or identifiers
+        """
+        in_comment = False
         with open(file, "r") as file:
-            in_comment = False
-            for line in file:
+            while True:
+                lines = file.readlines(CHUNK_SIZE)
+                if not lines:
+                    break
+                chunk = ''.join(lines)
                 if in_comment:
-                    if '*/' in line:
-                        line = line.partition('*/')[2]
-                        in_comment = False
-                    else: continue
-                line = line.partition("//")[0]
-                if "/*" in line:
-                    if '*/' in line:
-                        line = line.partition("/*")[0] + line.partition('*/')[2]
-                    else:
-                        line = line.partition("/*")[0]
+                    if '*/' not in chunk:
+                        continue
+                    chunk = chunk.partition('*/')[2]
+                    in_comment = False
+                for comment, symbol, integer, string, word, error in TOKEN_PATTERN.findall(chunk):
+                    if symbol:
+                        yield ('SYMBOL', symbol)
+                    elif word:
+                        yield ('KEYWORD' if word in KEYWORDS else 'IDENTIFIER', word)
+                    elif integer:
+                        yield ('INT_CONST', integer)
+                    elif string:
+                        yield ('STRING_CONST', string[1:-1])
+                    elif comment:
+                        # the rest of the chunk is in the comment
                         in_comment = True
-                self.processLine(line)
-
-        self.current_pos = -1
-        self.current_token = None
-    
-    def processLine(self, line):
-        """
-        parses line to not split strings in quotations
-        splits line by whitespace to get preliminary set of tokens (some will need to be further split)
-        """
-        if '\"' in line:
-            start = line.find('\"')
-            end = line.find('\"', start+1)
-            string = line[start:end+1]
-            full = line[:start].split() + [string] + line[end+1:].split()
-            for string in full:
-                self.tokenize(string)
-        else:
-            line = line.split()
-            for string in line:
-                self.tokenize(string)
+                        break
+                    elif error:
+                        raise SyntaxError('unexpected {} in {}'.format(repr(error), self.file))
 
-    def tokenize(self, string):
+    def peek(self, distance=1):
         """
-        parse preliminary set of tokens, assigning them to jack tokens (with type)
+        returns the token distance tokens after the current one without advancing, None past the last token
         """
-        if not string:
-            return
-        
-        if string[0] in self.symbols:
-            self.tokens.append(JackTokens('SYMBOL', string[0]))
-            self.tokenize(string[1:])
-        elif string[0] == '\"':
-            self.tokens.append(JackTokens('STRING_CONST', string[1:-1]))
-        elif string[0].isdecimal():
-            i = 1
-            while i < len(string) and string[i].isdecimal():
-                i += 1
-            token = string[:i]
-            self.tokens.append(JackTokens('INT_CONST', token))
-            self.tokenize(string[i:])
-        else:
-            i = 0
-            while i < len(string) and string[i] not in self.symbols:
-                i += 1
-            token = string[:i]
-            if token in self.keywords:
-                self.tokens.append(JackTokens('KEYWORD', token))
-            else:
-                self.tokens.append(JackTokens('IDENTIFIER', token))
-            self.tokenize(string[i:])
+        while len(self.lookahead) < distance:
+            token = next(self.tokens, None)
+            if token is None:
+                return None
+            self.lookahead.append(token)
+        return self.lookahead[distance - 1]
 
-        
     def hasMoreTokens(self):
         """
         checks to see if tokenizer has reached last token
         """
-        return self.current_pos < len(self.tokens) - 1
+        return self.peek() is not None
 
     def advance(self):
         """
         move current token to next token
         """
-        self.current_pos += 1
-        self.current_token = self.tokens[self.current_pos]
+        self.current_token = self.lookahead.popleft() if self.lookahead else next(self.tokens)
+
+    def close(self):
+        """
+        stops reading, closing the file when the compiler is done before its last token
+        """
+        self.tokens.close()
 
     def tokenType(self):
         """
         returns the jack type of token
         """
-        return self.current_token.type
+        return self.current_token[0]
 
     def keyWord(self):
-        return self.current_token.token
+        return self.current_token[1]
 
     def symbol(self):
-        return self.current_token.token
+        return self.current_token[1]
 
     def identifier(self):
-        return self.current_token.token
+        return self.current_token[1]
 
     def intVal(self):
-        return int (self.current_token.token)
+        return int (self.current_token[1])
 
     def stringVal(self):
-        return self.current_token.token
+        return self.current_token[1]
     
 class SymbolTable:
     def __init__(self):
@@ -188,6 +191,7 @@ class VMWriter:
                            'that':'that'}
 
         self.file = open(output_file[:-5]+'.vm', 'w')
+        self.classes = set() # classes whose subroutines are called
     
     def writePush(self, segment, index):
         segment = self.kind_to_segment[segment]
@@ -210,6 +214,7 @@ class VMWriter:
         self.file.write('if-goto {}\n'.format(label))
 
     def writeCall(self, name, nArgs):
+        self.classes.add(name.partition('.')[0])
         self.file.write('call {} {}\n'.format(name, nArgs))
 
     def writeFunction(self, name, nVars):
@@ -221,15 +226,38 @@ class VMWriter:
     def close(self):
         self.file.close()
 
+# AST nodes, tuples with named fields: no per node dictionary, so even large classes stay small
+# expressions
+Int = namedtuple('Int', 'value') # negative only once folded
+String = namedtuple('String', 'value')
+Keyword = namedtuple('Keyword', 'value') # true | false | null | this
+Var = namedtuple('Var', 'name kind index type') # resolved in the symbol tables while parsing
+Index = namedtuple('Index', 'array index') # array[index], array is a Var
+Call = namedtuple('Call', 'name this args') # this is pushed before the args of a method call, None otherwise
+Unary = namedtuple('Unary', 'op term')
+Binary = namedtuple('Binary', 'op left right')
+# statements
+Let = namedtuple('Let', 'target index value') # index is None unless target[index] = value
+If = namedtuple('If', 'condition then otherwise') # otherwise is None without an else clause
+While = namedtuple('While', 'condition body')
+Do = namedtuple('Do', 'call')
+Return = namedtuple('Return', 'value') # value is None in void subroutines
+# declarations
+Subroutine = namedtuple('Subroutine', 'kind returnType name nVars body')
+Class = namedtuple('Class', 'name nFields subroutines')
+
 class CompliationEngine:
     """
     Outputs vm code from input jack code
     CompilationEngine as recommended in Nand2Tetris chapter 10
+    The compile methods parse the class into an AST, the optimization passes rewrite it when
+    asked for, then the generate methods write its vm code through the VMWriter.
     """
-    def __init__(self, file):
+    def __init__(self, file, level=0):
         """
         Instantiates the tokenizer to get a stream of jack tokens.
         @param file(str): path to .jack file that is being converted to tokens
+        @param level(int): optimization level, 1 runs the passes of optimizeClass on the AST
         """
         self.tokenizer = JackTokenizer(file) 
         self.classVarDec = ['static', 'field']
@@ -238,10 +266,13 @@ class CompliationEngine:
         self.unary = ['~', '-']
         self.classTable = SymbolTable()
         self.subroutineTable = SymbolTable()
+        self.variables = {} # the Var of every name used in the subroutine, nodes are shared
         self.writer = VMWriter(file)
+        self.level = level
         self.className = None
         self.subroutineName = None
         self.counter = 0
+        self.signature = [] # [kind, return type, name, parameter types] of every subroutine
 
     def compileClass(self):
         """
@@ -254,8 +285,15 @@ class CompliationEngine:
         self.tokenizer.advance() # classVarDeC | subroutineDec
         self.compileClassVarDec() 
         # subroutineDec
-        self.compileSubroutine()
+        subroutines = []
+        while self.tokenizer.keyWord() in self.subroutineDec:
+            subroutines.append(self.compileSubroutine())
         # }
+        self.tokenizer.close()
+        node = Class(self.className, self.classTable.varCount('field'), subroutines)
+        if self.level > 0:
+            node = optimizeClass(node)
+        self.generateClass(node)
         self.writer.close()
 
     def compileClassVarDec(self):
@@ -275,29 +313,29 @@ class CompliationEngine:
     def compileSubroutine(self):
         """
         compiles a complete method, function or constructor 
-        runs recursively until all subroutines have been compiled
         """
-        if self.tokenizer.keyWord() not in self.subroutineDec:
-            return
         # subtourinteDec
         self.subroutineTable.reset()
-        self.counter = 0
+        self.variables.clear()
         subroutineType = self.tokenizer.keyWord() 
         if subroutineType == 'method':
             self.subroutineTable.define('this', self.className, 'arg')
         
         self.tokenizer.advance() # ('void' | type)
+        returnType = self.tokenizer.keyWord()
         self.tokenizer.advance() # subroutineName
-        self.subroutineName = self.tokenizer.identifier()
+        name = self.tokenizer.identifier()
         self.tokenizer.advance() # (
         self.tokenizer.advance() # parameter list
         self.compileParameterList() 
+        parameters = [type for name, (kind, type, _) in self.subroutineTable.table.items() if name != 'this']
+        self.signature.append([subroutineType, returnType, name, parameters])
         # )
         self.tokenizer.advance() # {
-        self.compileSubroutineBody(subroutineType)
+        body = self.compileSubroutineBody()
         # } subroutine
         self.tokenizer.advance() # } class | subroutineDec
-        self.compileSubroutine() 
+        return Subroutine(subroutineType, returnType, name, self.subroutineTable.varCount('var'), body)
 
     def compileParameterList(self):
         """
@@ -314,25 +352,14 @@ class CompliationEngine:
             if self.tokenizer.symbol() == ',':
                 self.tokenizer.advance() # type 
 
-    def compileSubroutineBody(self, subroutineType):
+    def compileSubroutineBody(self):
         """
-        compiles a subroutine's body
+        compiles a subroutine's body, returns its statements
         """
         self.tokenizer.advance() # var | statement keyword
         self.compileVarDec() 
         # statement keyword
-        nVars = self.subroutineTable.varCount('var')
-        self.writer.writeFunction(self.className+'.'+self.subroutineName, nVars)
-        if subroutineType == 'method':
-            self.writer.writePush('arg', 0)
-            self.writer.writePop('pointer', 0)
-        if subroutineType == 'constructor':
-            nFields = self.classTable.varCount('field')
-            self.writer.writePush('constant', nFields)
-            self.writer.writeCall('Memory.alloc', 1)
-            self.writer.writePop('pointer', 0)
-        self.compileStatements()
-
+        return self.compileStatements()
 
     def compileVarDec(self):
         """
@@ -350,21 +377,25 @@ class CompliationEngine:
 
     def compileStatements(self):
         """
-        compiles a sequence of statments
+        compiles a sequence of statments, returns them in a list
         does not handle enclosing { and }
         """
+        statements = []
         while self.tokenizer.tokenType() == 'KEYWORD':
             if self.tokenizer.keyWord() == 'let':
-                self.compilelet()
+                statements.append(self.compilelet())
             elif self.tokenizer.keyWord() == 'if':
-                self.compileIf()
+                statements.append(self.compileIf())
             elif self.tokenizer.keyWord() == 'while':
-                self.compileWhile()
+                statements.append(self.compileWhile())
             elif self.tokenizer.keyWord() == 'do':
-                self.compileDo()
+                statements.append(self.compileDo())
             elif self.tokenizer.keyWord() == 'return':
-                self.compileReturn()
+                statements.append(self.compileReturn())
+            else:
+                raise SyntaxError('unexpected {} in {}'.format(self.tokenizer.keyWord(), self.className))
         # }
+        return statements
 
     def compilelet(self):
         """
@@ -372,38 +403,21 @@ class CompliationEngine:
         """
         # let
         self.tokenizer.advance() # varName
-        varName = self.tokenizer.identifier()
-        kind =  self.subroutineTable.kindOf(varName)
-        if kind == 'NONE':
-            kind = self.classTable.kindOf(varName)
-            index = self.classTable.indexOf(varName)
-        else:
-            index = self.subroutineTable.indexOf(varName)
+        target = self._variable(self.tokenizer.identifier())
         self.tokenizer.advance() # [ | =
-
+        index = None
         if self.tokenizer.symbol() == '[':
-            self.writer.writePush(kind, index)
             # [
             self.tokenizer.advance() # exp
-            self.compileExpression()
+            index = self.compileExpression()
             # ]
-            self.writer.writeArithmetic('add')
             self.tokenizer.advance() # =
-            self.tokenizer.advance() # exp
-            self.compileExpression()
-            # ;
-            self.writer.writePop('temp', 0)
-            self.writer.writePop('pointer', 1)
-            self.writer.writePush('temp', 0)
-            self.writer.writePop('that', 0)
-        else:
-            # =
-            self.tokenizer.advance() # exp 
-            self.compileExpression()
-            # ;
-            self.writer.writePop(kind, index)
-        
+        # =
+        self.tokenizer.advance() # exp 
+        value = self.compileExpression()
+        # ;
         self.tokenizer.advance() # statement keyword | }
+        return Let(target, index, value)
 
     def compileIf(self):
         """
@@ -412,30 +426,22 @@ class CompliationEngine:
         # if
         self.tokenizer.advance() # (
         self.tokenizer.advance() # exp
-        self.compileExpression()
+        condition = self.compileExpression()
         # )
-        self.writer.writeArithmetic('not')
-        label = self.subroutineName + str(self.counter)
-        self.counter += 1
-        self.writer.writeIf(label)
         self.tokenizer.advance() # {
         self.tokenizer.advance() # statements* if branch
-        self.compileStatements()
+        then = self.compileStatements()
         # }
         self.tokenizer.advance() # else | statements*
+        otherwise = None
         if self.tokenizer.tokenType() == 'KEYWORD' and self.tokenizer.keyWord() == 'else':
             # else
-            label2 = self.subroutineName + str(self.counter)
-            self.counter += 1
-            self.writer.writeGoto(label2)
-            self.writer.writeLabel(label)
-            label = label2
             self.tokenizer.advance() # {
             self.tokenizer.advance() # statements* else branch
-            self.compileStatements()
+            otherwise = self.compileStatements()
             # }
             self.tokenizer.advance() # statements*
-        self.writer.writeLabel(label)
+        return If(condition, then, otherwise)
 
     def compileWhile(self):
         """
@@ -443,24 +449,15 @@ class CompliationEngine:
         """
         # while
         self.tokenizer.advance() # (
-        label = self.subroutineName + str (self.counter)
-        self.counter += 1
-        self.writer.writeLabel(label)
         self.tokenizer.advance() # exp
-        self.compileExpression()
+        condition = self.compileExpression()
         # )
-        self.writer.writeArithmetic('not')
-        label2 = self.subroutineName + str(self.counter)
-        self.counter += 1
-        self.writer.writeIf(label2)
         self.tokenizer.advance() # {
         self.tokenizer.advance() # while scope statements
-        self.compileStatements()
+        body = self.compileStatements()
         # }
-        self.writer.writeGoto(label)
-        self.writer.writeLabel(label2)
         self.tokenizer.advance() # statements*
-
+        return While(condition, body)
 
     def compileDo(self):
         """
@@ -468,42 +465,39 @@ class CompliationEngine:
         """
         # do
         self.tokenizer.advance() # subroutineName | (className | varName)
-        self.compileExpression() 
+        call = self.compileExpression() 
         # ; 
-        self.writer.writePop('temp', 0)
         self.tokenizer.advance() # statements*
+        return Do(call)
     
     def compileReturn(self):
         """
         compiles a return statmement
         """
         # return
-        self.tokenizer.advance() # ; | this | expS
-        if self.tokenizer.tokenType == 'SYMBOL' and self.tokenizer.symbol() == ';':
-            self.writer.writePush('constant', 0)
-        elif self.tokenizer.tokenType == 'KEYWORD' and self.tokenizer.keyWord() == 'this':
-            self.writer.writePush('pointer', 0)
-        else:
-            self.compileExpression()
+        self.tokenizer.advance() # ; | expression
+        value = None
+        if self.tokenizer.tokenType() != 'SYMBOL' or self.tokenizer.symbol() != ';':
+            value = self.compileExpression()
         # ;
-        self.writer.writeReturn()
         self.tokenizer.advance() # }
+        return Return(value)
 
     def compileExpression(self):
         """
         compiles an expression
+        jack operators have no precedence, term (op term)* is folded from the left
         """
         # term
-        self.compileTerm() 
+        node = self.compileTerm() 
         # (op term) | ; | )
         while self.tokenizer.tokenType() == 'SYMBOL' and self.tokenizer.symbol() in self.op:
             # op
             op = self.tokenizer.symbol()
             self.tokenizer.advance() # term
-            self.compileTerm()
+            node = Binary(op, node, self.compileTerm())
             # (op term) | ; | )
-            self._writeOp(op)
-
+        return node
 
     def compileTerm(self):
         """
@@ -516,112 +510,203 @@ class CompliationEngine:
             if self.tokenizer.symbol() == '(':
                 # (
                 self.tokenizer.advance()
-                self.compileExpression()
+                node = self.compileExpression()
                 # )
                 self.tokenizer.advance() # (op term) | ;
-            elif self.tokenizer.symbol() in self.unary:
+                return node
+            if self.tokenizer.symbol() in self.unary:
                 # unary
                 unary = self.tokenizer.symbol()
                 self.tokenizer.advance() # term
-                self.compileTerm()
-                # (op term) | ; | )
-                self._writeUnary(unary)
+                return Unary(unary, self.compileTerm())
+            raise SyntaxError('unexpected {} in {}'.format(self.tokenizer.symbol(), self.className))
         
         elif self.tokenizer.tokenType() != 'IDENTIFIER':
             # keywordConst | stringConst | intConst
             if self.tokenizer.tokenType() == 'KEYWORD':
-                self._writeKeywordConst()
+                node = Keyword(self.tokenizer.keyWord())
             elif self.tokenizer.tokenType() == 'STRING_CONST':
-                self._writeString()
-            elif self.tokenizer.tokenType() == 'INT_CONST':
-                intConst = self.tokenizer.intVal()
-                self.writer.writePush('constant', intConst)
-            self.tokenizer.advance() # (op term) | ; | )
-        
-        else:
-            # identifier
-            identifier = self.tokenizer.identifier()
-            kind, index, type = self._searchTable(identifier)
-
-            self.tokenizer.advance() # (op term) | ; | [ | . | ( 
-            if self.tokenizer.symbol() == '[':
-                # [ array
-                # search in subroutine then class
-                self.writer.writePush(kind, index)
-                self.tokenizer.advance() # exp
-                self.compileExpression()
-                # ]
-                self.writer.writeArithmetic('add')
-                self.writer.writePop('pointer', 1)
-                self.writer.writePush('that', 0)
-                self.tokenizer.advance() # (op term) | ;
-                
-            elif self.tokenizer.symbol() == '.':
-                # . subroutinecall
-                # search subroutine then class then it is static function
-                # 
-                
-                if kind == 'NONE':
-                    args = 0
-                else:
-                    self.writer.writePush(kind, index)
-                    args = 1
-                
-                self.tokenizer.advance() # subroutineName
-                subroutineName = self.tokenizer.identifier()
-                self.tokenizer.advance() # (
-                self.tokenizer.advance() # expList
-                args += self.compileExpressionList()
-                # )
-                self.writer.writeCall(type+'.'+subroutineName, args)
-                self.tokenizer.advance() # (op term) | ;
-
-            elif self.tokenizer.symbol() == '(':
-                # ( subroutine call this.
-                subroutineName = identifier
-                kind, index, type = self._searchTable('this')
-                if kind == 'NONE':
-                    self.writer.writePush('pointer', 0)
-                    type = self.className
-                else:
-                    # index = self.subroutineTable.indexOf('this')
-                    # type = self.subroutineTable.typeOf('this')
-                    self.writer.writePush(kind, index)
-
-                # (
-                self.tokenizer.advance()
-                args = self.compileExpressionList() + 1
-                # )
-                self.writer.writeCall(type+'.'+subroutineName, args)
-                self.tokenizer.advance() # (op term) | ;
-            
+                node = String(self.tokenizer.stringVal())
             else:
-                self.writer.writePush(kind, index)
-                # kind = self.subroutineTable.kindOf(identifier)
-                # if kind == 'NONE':
-                #     kind = self.classTable.kindOf(identifier)
-                #     if kind != 'NONE':
-                #         index = self.classTable.indexOf(identifier)
-                #         self.writer.writePush(kind, index)
-                # else:
-                #     index = self.subroutineTable.indexOf(identifier)
-                #     self.writer.writePush(kind, index)
+                node = Int(self.tokenizer.intVal())
+            self.tokenizer.advance() # (op term) | ; | )
+            return node
 
+        # identifier
+        identifier = self.tokenizer.identifier()
+        self.tokenizer.advance() # (op term) | ; | [ | . | ( 
+        if self.tokenizer.symbol() == '[':
+            # [ array
+            array = self._variable(identifier)
+            self.tokenizer.advance() # exp
+            index = self.compileExpression()
+            # ]
+            self.tokenizer.advance() # (op term) | ;
+            return Index(array, index)
 
+        if self.tokenizer.symbol() == '.':
+            # . subroutinecall
+            # search subroutine then class then it is static function
+            kind, index, type = self._searchTable(identifier)
+            this = None if kind == 'NONE' else Var(identifier, kind, index, type)
+            self.tokenizer.advance() # subroutineName
+            name = type + '.' + self.tokenizer.identifier()
+            self.tokenizer.advance() # (
+        elif self.tokenizer.symbol() == '(':
+            # ( subroutine call this.
+            kind, index, type = self._searchTable('this')
+            this = Keyword('this') if kind == 'NONE' else Var('this', kind, index, type)
+            name = self.className + '.' + identifier
+        else:
+            return self._variable(identifier)
+        # (
+        self.tokenizer.advance() # expList
+        args = self.compileExpressionList()
+        # )
+        self.tokenizer.advance() # (op term) | ;
+        return Call(name, this, args)
 
     def compileExpressionList(self):
         """
-        compiles a (possibly empty) list of expressions.
+        compiles a (possibly empty) list of expressions, returns them in a list
         """
-        args = 0
+        expressions = []
         while self.tokenizer.tokenType() != 'SYMBOL' or self.tokenizer.symbol() != ')':
-            args += 1
-            self.compileExpression()
+            expressions.append(self.compileExpression())
             if self.tokenizer.symbol() == ',':
                 # ,
                 self.tokenizer.advance() # ) | exp
-        return args
+        return expressions
+
+    def generateClass(self, node):
+        """
+        writes the vm code of a class AST
+        """
+        for subroutine in node.subroutines:
+            self.subroutineName = subroutine.name
+            self.counter = 0
+            self.writer.writeFunction(node.name+'.'+subroutine.name, subroutine.nVars)
+            if subroutine.kind == 'method':
+                self.writer.writePush('arg', 0)
+                self.writer.writePop('pointer', 0)
+            if subroutine.kind == 'constructor':
+                self.writer.writePush('constant', node.nFields)
+                self.writer.writeCall('Memory.alloc', 1)
+                self.writer.writePop('pointer', 0)
+            self.generateStatements(subroutine.body)
 
+    def generateStatements(self, statements):
+        for statement in statements:
+            self.generate(statement)
+
+    def generate(self, node):
+        """
+        writes the vm code of a statement or expression node with the generate method named after its type
+        """
+        getattr(self, 'generate' + type(node).__name__)(node)
+
+    def generateLet(self, node):
+        target = node.target
+        if node.index is None:
+            self.generate(node.value)
+            self.writer.writePop(target.kind, target.index)
+            return
+        self.writer.writePush(target.kind, target.index)
+        self.generate(node.index)
+        self.writer.writeArithmetic('add')
+        self.generate(node.value)
+        self.writer.writePop('temp', 0)
+        self.writer.writePop('pointer', 1)
+        self.writer.writePush('temp', 0)
+        self.writer.writePop('that', 0)
+
+    def generateIf(self, node):
+        self.generate(node.condition)
+        self.writer.writeArithmetic('not')
+        label = self._newLabel()
+        self.writer.writeIf(label)
+        self.generateStatements(node.then)
+        if node.otherwise is not None:
+            label2 = self._newLabel()
+            self.writer.writeGoto(label2)
+            self.writer.writeLabel(label)
+            label = label2
+            self.generateStatements(node.otherwise)
+        self.writer.writeLabel(label)
+
+    def generateWhile(self, node):
+        label = self._newLabel()
+        self.writer.writeLabel(label)
+        self.generate(node.condition)
+        self.writer.writeArithmetic('not')
+        label2 = self._newLabel()
+        self.writer.writeIf(label2)
+        self.generateStatements(node.body)
+        self.writer.writeGoto(label)
+        self.writer.writeLabel(label2)
+
+    def generateDo(self, node):
+        self.generate(node.call)
+        self.writer.writePop('temp', 0)
+
+    def generateReturn(self, node):
+        if node.value is None:
+            self.writer.writePush('constant', 0)
+        else:
+            self.generate(node.value)
+        self.writer.writeReturn()
+
+    def generateInt(self, node):
+        self.writer.writePush('constant', abs(node.value))
+        if node.value < 0:
+            self.writer.writeArithmetic('neg')
+
+    def generateString(self, node):
+        self.writer.writePush('constant', len(node.value))
+        self.writer.writeCall('String.new', 1)
+        for c in node.value:
+            self.writer.writePush('constant', ord(c))
+            self.writer.writeCall('String.appendChar', 2)
+
+    def generateKeyword(self, node):
+        if node.value == 'true':
+            self.writer.writePush('constant', 1)
+            self.writer.writeArithmetic('neg')
+        elif node.value == 'false' or node.value == 'null':
+            self.writer.writePush('constant', 0)
+        elif node.value == 'this':
+            self.writer.writePush('pointer', 0)
+
+    def generateVar(self, node):
+        self.writer.writePush(node.kind, node.index)
+
+    def generateIndex(self, node):
+        self.generate(node.array)
+        self.generate(node.index)
+        self.writer.writeArithmetic('add')
+        self.writer.writePop('pointer', 1)
+        self.writer.writePush('that', 0)
+
+    def generateCall(self, node):
+        if node.this is not None:
+            self.generate(node.this)
+        for arg in node.args:
+            self.generate(arg)
+        self.writer.writeCall(node.name, len(node.args) + (node.this is not None))
+
+    def generateUnary(self, node):
+        self.generate(node.term)
+        self._writeUnary(node.op)
+
+    def generateBinary(self, node):
+        self.generate(node.left)
+        self.generate(node.right)
+        self._writeOp(node.op)
+
+    def _newLabel(self):
+        label = self.subroutineName + str(self.counter)
+        self.counter += 1
+        return label
 
     def _varDec(self, kind, subroutine=False):
         """
@@ -669,23 +754,17 @@ class CompliationEngine:
         elif unary == '~':
             self.writer.writeArithmetic('not')
 
-    def _writeKeywordConst(self):
-        keyword = self.tokenizer.keyWord()
-        if keyword == 'true':
-            self.writer.writePush('constant', 1)
-            self.writer.writeArithmetic('neg')
-        elif keyword == 'false' or keyword == 'null':
-            self.writer.writePush('constant', 0)
-        elif keyword == 'this':
-            self.writer.writePush('pointer', 0)
-        
-    def _writeString(self):
-        s = self.tokenizer.stringVal()
-        self.writer.writePush('constant', len(s))
-        self.writer.writeCall('String.new', 1)
-        for c in s:
-            self.writer.writePush('constant', ord(c))
-            self.writer.writeCall('String.appendChar', 2)
+    def _variable(self, identifier):
+        """
+        returns the Var of a variable, which must be in the subroutine or class table
+        """
+        node = self.variables.get(identifier)
+        if node is None:
+            kind, index, type = self._searchTable(identifier)
+            if kind == 'NONE':
+                raise NameError('{} is not defined in {}'.format(identifier, self.className))
+            node = self.variables[identifier] = Var(identifier, kind, index, type)
+        return node
 
     def _searchTable(self, identifier):
         kind = self.subroutineTable.kindOf(identifier)
@@ -701,28 +780,341 @@ class CompliationEngine:
 
         return kind, index, type
 
-def main():
+# optimization passes, the expression and statement passes return new nodes
+def toWord(value):
     """
-    Syntax analyzer for Jack code
-    main program to set up other modules
+    returns value wrapped to a 16 bit two's complement word, the arithmetic of the Hack computer
+    """
+    value &= 0xFFFF
+    return value - 0x10000 if value & 0x8000 else value
+
+def constantValue(node):
+    """
+    returns the value of a constant expression, None if it is not constant or not a value push constant
+    and neg can make (-32768 and integer constants above 32767)
+    """
+    if type(node) is Int and -32767 <= node.value <= 32767:
+        return node.value
+    if type(node) is Keyword and node.value != 'this':
+        return -1 if node.value == 'true' else 0
+    return None
+
+def isPure(node):
+    """
+    checks that an expression calls nothing, so evaluating it less or more often changes nothing
+    """
+    if type(node) in (Int, Keyword, Var):
+        return True
+    if type(node) is Index:
+        return isPure(node.index)
+    if type(node) is Unary:
+        return isPure(node.term)
+    if type(node) is Binary:
+        # * and / call Math.multiply and Math.divide
+        return node.op not in '*/' and isPure(node.left) and isPure(node.right)
+    return False
+
+def divide(a, b):
+    # Math.divide divides the absolute values and negates the quotient of operands of different signs
+    quotient = abs(a) // abs(b)
+    return -quotient if (a < 0) != (b < 0) else quotient
+
+FOLDS = {'+': lambda a, b: a + b,
+         '-': lambda a, b: a - b,
+         '*': lambda a, b: a * b,
+         '/': divide,
+         '&': lambda a, b: a & b,
+         '|': lambda a, b: a | b,
+         '<': lambda a, b: -(toWord(a - b) < 0), # lt and gt test the sign of the 16 bit x - y
+         '>': lambda a, b: -(toWord(a - b) > 0),
+         '=': lambda a, b: -(a == b)}
+
+def foldConstant(value, node):
+    """
+    returns the Int of value, or node if push constant and neg cannot make it
+    """
+    value = toWord(value)
+    return Int(value) if value != -0x8000 else node
+
+def foldExpression(node):
+    """
+    constant folding and algebraic simplification, bottom up
+    """
+    if type(node) is Unary:
+        term = foldExpression(node.term)
+        value = constantValue(term)
+        if value is not None:
+            return foldConstant(-value if node.op == '-' else ~value, Unary(node.op, term))
+        if type(term) is Unary and term.op == node.op:
+            # - - x and ~ ~ x
+            return term.term
+        return Unary(node.op, term)
+    if type(node) is Binary:
+        op, left, right = node.op, foldExpression(node.left), foldExpression(node.right)
+        a, b = constantValue(left), constantValue(right)
+        node = Binary(op, left, right)
+        if a is not None and b is not None:
+            # Math.divide would stop the program on a division by 0, that is left to happen at run time
+            if op == '/' and (b == 0 or a == -0x8000 or b == -0x8000):
+                return node
+            return foldConstant(FOLDS[op](a, b), node)
+        return simplify(node, a, b)
+    if type(node) is Index:
+        return Index(node.array, foldExpression(node.index))
+    if type(node) is Call:
+        return Call(node.name, node.this, [foldExpression(arg) for arg in node.args])
+    return node
+
+def simplify(node, a, b):
+    """
+    algebraic simplification of a binary node with at most one constant operand, a or b
+    x + 0, x - 0, x * 1, x / 1, x & -1 and x | 0 are x; x * 0 and x & 0 are 0, x | -1 is -1 when x is
+    pure; 0 - x is -x and x * 2 is x + x, saving a call of Math.multiply, when x is a variable
+    """
+    op, left, right = node
+    if b is not None:
+        x, constant = left, b
+    elif a is not None and op in '+*&|':
+        x, constant = right, a
+    elif a == 0 and op == '-':
+        return Unary('-', right)
+    else:
+        return node
+    if (op, constant) in (('+', 0), ('-', 0), ('*', 1), ('/', 1), ('&', -1), ('|', 0)):
+        return x
+    if (op, constant) in (('*', 0), ('&', 0), ('|', -1)) and isPure(x):
+        return Int(constant)
+    if op == '*' and constant == 2 and type(x) is Var:
+        return Binary('+', x, x)
+    return node
+
+def foldStatements(statements):
+    """
+    folds the expressions of the statements and removes the branches a constant condition never takes
+    if (true) and if (false) are replaced by the branch taken, while (false) is removed
+    an if takes its then branch only when not condition is 0, other constants are left to run time
+    """
+    folded = []
+    for statement in statements:
+        if type(statement) is Let:
+            index = statement.index if statement.index is None else foldExpression(statement.index)
+            folded.append(Let(statement.target, index, foldExpression(statement.value)))
+        elif type(statement) is If:
+            condition = foldExpression(statement.condition)
+            value = constantValue(condition)
+            if value not in (-1, 0):
+                otherwise = statement.otherwise if statement.otherwise is None else foldStatements(statement.otherwise)
+                folded.append(If(condition, foldStatements(statement.then), otherwise))
+            elif value == -1:
+                folded += foldStatements(statement.then)
+            elif statement.otherwise is not None:
+                folded += foldStatements(statement.otherwise)
+        elif type(statement) is While:
+            condition = foldExpression(statement.condition)
+            if constantValue(condition) != 0:
+                folded.append(While(condition, foldStatements(statement.body)))
+        elif type(statement) is Do:
+            folded.append(Do(foldExpression(statement.call)))
+        else:
+            folded.append(Return(statement.value if statement.value is None else foldExpression(statement.value)))
+    return folded
+
+def optimizeClass(node):
+    """
+    runs the optimization passes on every subroutine of a class AST, replacing them one at a time
+    so only one subroutine is ever held twice
+    """
+    for i, subroutine in enumerate(node.subroutines):
+        node.subroutines[i] = subroutine._replace(body=foldStatements(subroutine.body))
+    return node
+
+def compileFile(file, level=0):
+    """
+    compiles one .jack file into the .vm file next to it at an optimization level, also the process
+    pool task of main and build
+    returns a dict of the error the compilation failed with or None, whose partial .vm file is
+    removed, the other classes the file calls and its signature
+    """
+    compiler = None
+    try:
+        compiler = CompliationEngine(file, level)
+        compiler.compileClass()
+    except Exception as error:
+        if compiler:
+            compiler.tokenizer.close()
+            compiler.writer.close()
+            os.remove(compiler.writer.file.name)
+        return {'error': '{}: {}'.format(type(error).__name__, error), 'references': [], 'signature': []}
+    references = sorted(compiler.writer.classes - {compiler.className})
+    return {'error': None, 'references': references, 'signature': compiler.signature}
+
+def compileFiles(files, pool=None, jobs=1, level=0):
+    """
+    compiles the files in the pool if one is given, returns the results of compileFile in order
+    """
+    if pool and len(files) > 1:
+        # a few batches per worker, classes are too small to be worth a round trip each
+        return list(pool.map(compileFile, files, [level] * len(files), chunksize=max(1, len(files) // (4 * jobs))))
+    return [compileFile(file, level) for file in files]
+
+def hashFile(file):
+    with open(file, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+class BuildManifest:
+    """
+    Record of the last build in a directory, kept in MANIFEST_NAME next to the .jack files.
+    For every class compiled without errors: the hash of its .jack file, the other classes it calls
+    and its signature, the subroutines other classes can call.
+    A manifest of another version or optimization level is ignored, every class is compiled again.
+    """
+    def __init__(self, directory, level=0):
+        self.path = os.path.join(directory, MANIFEST_NAME)
+        self.level = level
+        self.classes = {}
+        try:
+            with open(self.path, 'r') as file:
+                manifest = json.load(file)
+            if manifest['version'] == VERSION and manifest['level'] == level:
+                self.classes = manifest['classes']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def save(self):
+        # write to a temporary name first so an interrupted build never leaves half a manifest
+        with open(self.path + '.tmp', 'w') as file:
+            json.dump({'version': VERSION, 'level': self.level, 'classes': self.classes}, file, indent=1, sort_keys=True)
+        os.replace(self.path + '.tmp', self.path)
+
+def build(files, directory, pool=None, jobs=1, level=0):
+    """
+    compiles only the files that changed since the last build, or whose .vm file is missing, then
+    the files calling a class whose signature changed, was added or was removed
+    the .vm file of a class whose .jack file was removed is removed with it, so it is not linked any more
+    returns the number of files compiled and the (file, error) of those that failed
+    """
+    manifest = BuildManifest(directory, level)
+    previous = manifest.classes
+    names = {file: os.path.basename(file)[:-5] for file in files}
+    hashes = {file: hashFile(file) for file in files}
+    changed = [file for file in files if names[file] not in previous or previous[names[file]]['hash'] != hashes[file]
+               or not os.path.exists(file[:-5] + '.vm')]
+    results = dict(zip(changed, compileFiles(changed, pool, jobs, level)))
+
+    # classes gone from the directory, classes that are new and classes whose signature changed
+    signatures = {name: None for name in previous if not os.path.exists(os.path.join(directory, name + '.jack'))}
+    for file, result in results.items():
+        if result['error'] is None and (names[file] not in previous or previous[names[file]]['signature'] != result['signature']):
+            signatures[names[file]] = result['signature']
+    dependents = [file for file in files if file not in results
+                  and set(previous[names[file]]['references']) & set(signatures)]
+    results.update(zip(dependents, compileFiles(dependents, pool, jobs, level)))
+
+    for name in signatures:
+        if signatures[name] is None:
+            del previous[name]
+            try:
+                os.remove(os.path.join(directory, name + '.vm'))
+            except FileNotFoundError:
+                pass
+    failures = []
+    for file, result in results.items():
+        if result['error']:
+            previous.pop(names[file], None)
+            failures.append((file, result['error']))
+        else:
+            previous[names[file]] = {'hash': hashes[file], 'references': result['references'], 'signature': result['signature']}
+    manifest.save()
+    return len(results), failures
+
+def jackFiles(path):
+    """
+    returns the .jack file path names or the .jack files of directory path
     """
-    files = []
-    path = sys.argv[1]
     # check if it is a file
     if os.path.isfile(path):
         ext = path[-5:]
         assert ext == ".jack", "incorrect file type, input must be named like xxx.jack"
-        files = [path]
+        return [path]
+    files = []
     # check if it is a directory
-    elif os.path.isdir(path):
+    if os.path.isdir(path):
         for file in os.listdir(path):
             # store all .jack files to be parsed
             if file[-5:] == ".jack":
                 files.append(os.path.join(path, file))
+    return files
 
-    for file in files:
-        compiler = CompliationEngine(file)
-        compiler.compileClass()
+def reportFailures(failures, n_files):
+    for file, error in failures:
+        print('{}: {}'.format(file, error), file=sys.stderr)
+    if failures:
+        print('{} of {} files failed to compile'.format(len(failures), n_files), file=sys.stderr)
+
+def watch(path, pool, jobs, interval, level=0):
+    """
+    rebuilds path incrementally whenever a .jack file is added, removed or modified, until interrupted
+    """
+    directory = path if os.path.isdir(path) else os.path.dirname(path)
+    state = None
+    while True:
+        files = jackFiles(path)
+        stats = {}
+        for file in files:
+            try:
+                stat = os.stat(file)
+                stats[file] = (stat.st_mtime_ns, stat.st_size)
+            except FileNotFoundError:
+                pass
+        if stats != state:
+            state = stats
+            try:
+                compiled, failures = build(sorted(stats), directory, pool, jobs, level)
+            except FileNotFoundError:
+                # a file went away while being read, the next poll sees it gone
+                state = None
+                continue
+            reportFailures(failures, compiled)
+            print('compiled {} of {} files'.format(compiled, len(stats)), flush=True)
+        time.sleep(interval)
+
+def main():
+    """
+    Syntax analyzer for Jack code
+    main program to set up other modules
+    every file is compiled even if some fail, the failures are listed at the end
+    """
+    arg_parser = argparse.ArgumentParser(description='Compile Jack code to vm code')
+    arg_parser.add_argument('path', help='a .jack file or a directory of .jack files')
+    arg_parser.add_argument('-O', dest='level', type=int, choices=[0, 1], default=0,
+                            help='optimization level, 1 folds constants, simplifies algebra and removes dead branches')
+    arg_parser.add_argument('--jobs', type=int, default=1, help='compile the files in this many worker processes')
+    arg_parser.add_argument('--incremental', action='store_true',
+                            help='only compile what changed since the last build, recorded in ' + MANIFEST_NAME)
+    arg_parser.add_argument('--watch', action='store_true', help='build incrementally every time a .jack file changes')
+    arg_parser.add_argument('--interval', type=float, default=0.5, help='seconds between checks for changes with --watch')
+    args = arg_parser.parse_args()
+
+    files = jackFiles(args.path)
+    pool = ProcessPoolExecutor(args.jobs) if args.jobs > 1 else None
+    try:
+        if args.watch:
+            watch(args.path, pool, args.jobs, args.interval, args.level)
+        elif args.incremental:
+            directory = args.path if os.path.isdir(args.path) else os.path.dirname(args.path)
+            compiled, failures = build(files, directory, pool, args.jobs, args.level)
+            print('compiled {} of {} files'.format(compiled, len(files)))
+        else:
+            results = compileFiles(files, pool, args.jobs, args.level)
+            failures = [(file, result['error']) for file, result in zip(files, results) if result['error']]
+    except KeyboardInterrupt:
+        return
+    finally:
+        if pool:
+            pool.shutdown()
+    reportFailures(failures, len(files))
+    if failures:
+        sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()